@@ -54,6 +54,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.DeadlineMiddleware',
+    'core.middleware.AdmissionMiddleware',
 ]
 
 ROOT_URLCONF = 'WisePick.urls'
@@ -161,6 +163,10 @@ CACHES = {
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
 
+# Compare results, keyed on the catalog version so writes invalidate them
+COMPARE_CACHE_TTL = int(os.environ.get('COMPARE_CACHE_TTL', 60 * 60))  # seconds
+COMPARE_POPULAR_MAX = int(os.environ.get('COMPARE_POPULAR_MAX', 10000))  # pairs per kind kept for warm_compare_cache
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10,
@@ -172,4 +178,58 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'Choosing a laptop is no much more easier',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
-}
\ No newline at end of file
+}
+
+# OpenRouter (LLM) settings
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 60 * 60))  # seconds
+LLM_FLIGHT_WAIT = float(os.environ.get('LLM_FLIGHT_WAIT', 20))  # seconds a duplicate request waits for the first one, then degrades
+LLM_FLIGHT_LOCK_TIMEOUT = int(os.environ.get('LLM_FLIGHT_LOCK_TIMEOUT', 120))  # seconds, outlives a stuck worker
+LLM_BATCH_SIZE = int(os.environ.get('LLM_BATCH_SIZE', 4))  # phone pairs per batched comparison prompt; bigger answers get slow
+OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get('OPENROUTER_CONNECT_TIMEOUT', 3.05))  # seconds
+OPENROUTER_READ_TIMEOUT = float(os.environ.get('OPENROUTER_READ_TIMEOUT', 30))  # seconds
+OPENROUTER_MAX_RETRIES = int(os.environ.get('OPENROUTER_MAX_RETRIES', 2))
+OPENROUTER_BACKOFF = float(os.environ.get('OPENROUTER_BACKOFF', 0.5))  # seconds, doubled per retry
+OPENROUTER_POOL_SIZE = int(os.environ.get('OPENROUTER_POOL_SIZE', 10))
+OPENROUTER_ASYNC_POOL_SIZE = int(os.environ.get('OPENROUTER_ASYNC_POOL_SIZE', 200))
+
+# Background comparison jobs (core/jobs.py)
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 60 * 60))  # seconds
+JOB_WORKER_CONCURRENCY = int(os.environ.get('JOB_WORKER_CONCURRENCY', 8))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))  # runs of a job whose workers keep dying
+JOB_EVENTS_TIMEOUT = int(os.environ.get('JOB_EVENTS_TIMEOUT', 5 * 60))  # seconds an SSE stream stays open
+
+# OpenRouter circuit breaker (core/breaker.py)
+LLM_BREAKER_WINDOW = int(os.environ.get('LLM_BREAKER_WINDOW', 60))  # seconds of history the error rate is taken over
+LLM_BREAKER_BUCKET = int(os.environ.get('LLM_BREAKER_BUCKET', 10))  # seconds per counter
+LLM_BREAKER_MIN_CALLS = int(os.environ.get('LLM_BREAKER_MIN_CALLS', 5))
+LLM_BREAKER_ERROR_RATE = float(os.environ.get('LLM_BREAKER_ERROR_RATE', 0.5))
+LLM_BREAKER_SLOW_CALL = float(os.environ.get('LLM_BREAKER_SLOW_CALL', 15))  # seconds; slower calls count as failures
+LLM_BREAKER_COOLDOWN = int(os.environ.get('LLM_BREAKER_COOLDOWN', 30))  # seconds open before a probe
+
+# Shared OpenRouter rate limiter (core/ratelimit.py); OPENROUTER_RATE_LIMIT=0 turns it off
+OPENROUTER_RATE_LIMIT = float(os.environ.get('OPENROUTER_RATE_LIMIT', 5))  # requests per second, all workers together
+OPENROUTER_RATE_BURST = float(os.environ.get('OPENROUTER_RATE_BURST', 10))  # requests
+OPENROUTER_RATE_MAX_WAIT = float(os.environ.get('OPENROUTER_RATE_MAX_WAIT', 10))  # seconds a call may queue for a slot
+
+# Hedged requests (core/hedging.py): comma-separated, the primary model first
+OPENROUTER_MODELS = [m.strip() for m in os.environ.get('OPENROUTER_MODELS', 'google/gemma-3n-e2b-it:free').split(',') if m.strip()]
+OPENROUTER_HEDGE_PERCENTILE = float(os.environ.get('OPENROUTER_HEDGE_PERCENTILE', 95))  # latency percentile a model gets before the next one is asked
+OPENROUTER_HEDGE_SAMPLES = int(os.environ.get('OPENROUTER_HEDGE_SAMPLES', 200))  # latencies kept per model
+OPENROUTER_HEDGE_MIN_SAMPLES = int(os.environ.get('OPENROUTER_HEDGE_MIN_SAMPLES', 20))  # fewer: OPENROUTER_HEDGE_DEFAULT_DELAY
+OPENROUTER_HEDGE_DEFAULT_DELAY = float(os.environ.get('OPENROUTER_HEDGE_DEFAULT_DELAY', 5))  # seconds
+OPENROUTER_HEDGE_MIN_DELAY = float(os.environ.get('OPENROUTER_HEDGE_MIN_DELAY', 0.5))  # seconds
+OPENROUTER_HEDGE_MAX_DELAY = float(os.environ.get('OPENROUTER_HEDGE_MAX_DELAY', 15))  # seconds
+
+# Admission control for OpenRouter calls (core/admission.py); LLM_ADMISSION_PROCESS_LIMIT=0 turns it off
+LLM_ADMISSION_PROCESS_LIMIT = int(os.environ.get('LLM_ADMISSION_PROCESS_LIMIT', 8))  # calls in flight per process
+LLM_ADMISSION_ASYNC_LIMIT = int(os.environ.get('LLM_ADMISSION_ASYNC_LIMIT', 100))  # async view calls in flight per process (ASGI)
+LLM_ADMISSION_CLUSTER_LIMIT = int(os.environ.get('LLM_ADMISSION_CLUSTER_LIMIT', 32))  # calls in flight, all workers; 0: no limit
+LLM_ADMISSION_QUEUE = int(os.environ.get('LLM_ADMISSION_QUEUE', 16))  # callers per process waiting for a slot
+LLM_ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('LLM_ADMISSION_QUEUE_TIMEOUT', 2))  # seconds a caller waits for a slot
+LLM_ADMISSION_LEASE = int(os.environ.get('LLM_ADMISSION_LEASE', 120))  # seconds before a crashed worker's slot frees up
+LLM_ADMISSION_SHED = os.environ.get('LLM_ADMISSION_SHED', 'False').lower() == 'true'  # 503 instead of the local result
+
+# Request deadline (core/deadlines.py); a client may ask for less or more with X-Request-Timeout
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 25))  # seconds, below the proxy's timeout
+REQUEST_DEADLINE_MAX = float(os.environ.get('REQUEST_DEADLINE_MAX', 60))  # seconds
+REQUEST_DEADLINE_RESERVE = float(os.environ.get('REQUEST_DEADLINE_RESERVE', 0.5))  # seconds kept to send what is there
@@ -0,0 +1,325 @@
+"""
+Admission control for the OpenRouter calls.
+
+A request about to ask OpenRouter (its completion is not cached) needs a
+slot first: one of LLM_ADMISSION_PROCESS_LIMIT in its process (one of
+LLM_ADMISSION_ASYNC_LIMIT, also per process, for the async views) and one of
+LLM_ADMISSION_CLUSTER_LIMIT across all workers. Cluster slots are leases in
+a Redis sorted set, so the slots of a crashed worker expire on their own.
+
+A caller waits at most LLM_ADMISSION_QUEUE_TIMEOUT seconds for its slots,
+and no more than LLM_ADMISSION_QUEUE callers per process wait at all; the
+others are refused with Overloaded at once. Overloaded is an LLMUnavailable, so
+a refused request serves its deterministic result (degraded) like with the
+breaker open, or a 503 with Retry-After when LLM_ADMISSION_SHED is set
+(AdmissionMiddleware). Either way its worker is free again within the queue
+deadline, and the cheap endpoints, which never come here, keep their latency.
+
+A slot stands for one call to OpenRouter: a hedged request (hedging.py)
+takes one more for every model it asks, kept until that call has ended, and
+is only hedged while a slot is free right away.
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from core import deadlines
+from core.breaker import LLMUnavailable
+
+LEASES_KEY = "llm:admission:leases"
+STATS_KEY = "llm:admission:stats"
+
+POLL_INTERVAL = 0.05  # seconds, doubled up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 0.25
+RETRY_AFTER = 5  # seconds a refused client is told to wait
+
+# KEYS[1] leases; ARGV token, limit, lease seconds -> 1 if granted
+TAKE_LEASE = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 60)
+return 1
+"""
+
+_script = None
+
+_lock = threading.Lock()
+_semaphore = None
+_async_semaphore = None
+_waiting = 0
+
+# retry_after of the last refusal in this request (AdmissionMiddleware)
+_refused = contextvars.ContextVar("llm_admission_refused", default=None)
+
+
+class Overloaded(LLMUnavailable):
+    """Too many OpenRouter calls in flight"""
+
+    def __init__(self, retry_after: int = RETRY_AFTER):
+        super().__init__(f"Too many language model requests, retry in {retry_after}s", retry_after)
+
+
+def enabled() -> bool:
+    return settings.LLM_ADMISSION_PROCESS_LIMIT > 0
+
+
+def refused():
+    """retry_after if a call of the current request was refused, else None"""
+    return _refused.get()
+
+
+def start_request():
+    """Forget the refusals of an earlier request in this thread; returns the
+    token for end_request"""
+    return _refused.set(None)
+
+
+def end_request(token):
+    _refused.reset(token)
+
+
+def _count_refusal(reason: str):
+    try:
+        get_redis_connection("default").hincrby(STATS_KEY, f"refused:{reason}", 1)
+    except Exception as e:
+        print(f"Could not record admission stats: {e}")
+
+
+def _refuse(reason: str):
+    _refused.set(RETRY_AFTER)
+    _count_refusal(reason)
+    raise Overloaded()
+
+
+async def _arefuse(reason: str):
+    _refused.set(RETRY_AFTER)
+    await sync_to_async(_count_refusal, thread_sensitive=False)(reason)
+    raise Overloaded()
+
+
+# =====Cluster leases=====
+def _take_lease(token: str) -> bool:
+    global _script
+    conn = get_redis_connection("default")
+    if _script is None:
+        _script = conn.register_script(TAKE_LEASE)
+    return bool(int(_script(keys=[LEASES_KEY], args=[token, settings.LLM_ADMISSION_CLUSTER_LIMIT,
+                                                     settings.LLM_ADMISSION_LEASE], client=conn)))
+
+
+def _try_lease(token: str) -> bool:
+    if settings.LLM_ADMISSION_CLUSTER_LIMIT <= 0:
+        return True
+    try:
+        return _take_lease(token)
+    except Exception as e:
+        # without Redis there is no cluster count; the process limit still holds
+        print(f"Could not take an admission lease: {e}")
+        return True
+
+
+def _release_lease(token: str):
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        if settings.LLM_ADMISSION_CLUSTER_LIMIT > 0:
+            pipe.zrem(LEASES_KEY, token)
+        pipe.hincrby(STATS_KEY, "admitted", 1)
+        pipe.execute()
+    except Exception as e:
+        print(f"Could not release an admission lease: {e}")
+
+
+def _lease(deadline: float) -> str:
+    """A cluster lease token, polling until deadline; None if there was no slot"""
+    token = uuid.uuid4().hex
+    interval = POLL_INTERVAL
+    while not _try_lease(token):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+        time.sleep(min(interval, left))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return token
+
+
+async def _alease(deadline: float) -> str:
+    token = uuid.uuid4().hex
+    interval = POLL_INTERVAL
+    try_lease = sync_to_async(_try_lease, thread_sensitive=False)
+    while not await try_lease(token):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+        await asyncio.sleep(min(interval, left))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return token
+
+
+# =====Gate=====
+def _process_semaphore() -> threading.BoundedSemaphore:
+    global _semaphore
+    with _lock:
+        if _semaphore is None:
+            _semaphore = threading.BoundedSemaphore(settings.LLM_ADMISSION_PROCESS_LIMIT)
+        return _semaphore
+
+
+def _async_process_semaphore() -> threading.BoundedSemaphore:
+    """The async views' slots. Shared by every event loop of the process:
+    under WSGI each async view runs on a loop of its own"""
+    global _async_semaphore
+    with _lock:
+        if _async_semaphore is None:
+            _async_semaphore = threading.BoundedSemaphore(settings.LLM_ADMISSION_ASYNC_LIMIT)
+        return _async_semaphore
+
+
+def _queue(change: int) -> bool:
+    """Join (+1) or leave (-1) this process's queue; False if it is full"""
+    global _waiting
+    with _lock:
+        if change > 0 and _waiting >= settings.LLM_ADMISSION_QUEUE:
+            return False
+        _waiting += change
+        return True
+
+
+def acquire(hedge: bool = False):
+    """Take an OpenRouter slot, waiting up to LLM_ADMISSION_QUEUE_TIMEOUT for
+    it; returns the slot for release. Raises Overloaded if none frees up.
+
+    A hedge (hedging.py) only takes a slot that is free right away, and its
+    refusal is not held against the request.
+    """
+    if not enabled():
+        return None
+    semaphore = _process_semaphore()
+    if hedge:
+        if not semaphore.acquire(blocking=False):
+            _count_refusal("hedge")
+            raise Overloaded()
+        token = uuid.uuid4().hex
+        if not _try_lease(token):
+            semaphore.release()
+            _count_refusal("hedge")
+            raise Overloaded()
+        return token
+
+    deadline = time.monotonic() + deadlines.cap(settings.LLM_ADMISSION_QUEUE_TIMEOUT)
+    if not _queue(1):
+        _refuse("queue")
+    try:
+        if not semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            _refuse("process")
+        token = _lease(deadline)
+        if token is None:
+            semaphore.release()
+            _refuse("cluster")
+    finally:
+        _queue(-1)
+    return token
+
+
+def release(slot):
+    """Give back a slot from acquire (from any thread)"""
+    if slot is None:
+        return
+    _release_lease(slot)
+    _process_semaphore().release()
+
+
+@contextlib.contextmanager
+def admit():
+    """Hold an OpenRouter slot for the block; raises Overloaded if none
+    frees up within LLM_ADMISSION_QUEUE_TIMEOUT"""
+    slot = acquire()
+    try:
+        yield
+    finally:
+        release(slot)
+
+
+async def aacquire(hedge: bool = False):
+    """acquire() for async callers, against LLM_ADMISSION_ASYNC_LIMIT; the
+    wait polls, so it does not hold a thread"""
+    if not enabled():
+        return None
+    semaphore = _async_process_semaphore()
+    try_lease = sync_to_async(_try_lease, thread_sensitive=False)
+    if hedge:
+        if not semaphore.acquire(blocking=False):
+            await sync_to_async(_count_refusal, thread_sensitive=False)("hedge")
+            raise Overloaded()
+        token = uuid.uuid4().hex
+        if not await try_lease(token):
+            semaphore.release()
+            await sync_to_async(_count_refusal, thread_sensitive=False)("hedge")
+            raise Overloaded()
+        return token
+
+    deadline = time.monotonic() + deadlines.cap(settings.LLM_ADMISSION_QUEUE_TIMEOUT)
+    if not _queue(1):
+        await _arefuse("queue")
+    try:
+        interval = POLL_INTERVAL
+        while not semaphore.acquire(blocking=False):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                await _arefuse("process")
+            await asyncio.sleep(min(interval, left))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        token = await _alease(deadline)
+        if token is None:
+            semaphore.release()
+            await _arefuse("cluster")
+    finally:
+        _queue(-1)
+    return token
+
+
+async def arelease(slot):
+    """Give back a slot from aacquire"""
+    if slot is None:
+        return
+    _async_process_semaphore().release()
+    await sync_to_async(_release_lease, thread_sensitive=False)(slot)
+
+
+@contextlib.asynccontextmanager
+async def aadmit():
+    """admit() for async callers"""
+    slot = await aacquire()
+    try:
+        yield
+    finally:
+        await arelease(slot)
+
+
+def stats() -> dict:
+    """Cluster slots in use and admitted/refused counts"""
+    conn = get_redis_connection("default")
+    counts = {key.decode(): int(value) for key, value in conn.hgetall(STATS_KEY).items()}
+    # lease expiries are on the Redis clock (TAKE_LEASE), not this host's
+    seconds, micros = conn.time()
+    now = seconds + micros / 1000000
+    return {
+        "enabled": enabled(),
+        "process_limit": settings.LLM_ADMISSION_PROCESS_LIMIT,
+        "cluster_limit": settings.LLM_ADMISSION_CLUSTER_LIMIT,
+        "in_flight": conn.zcount(LEASES_KEY, now, "+inf"),
+        "waiting_here": _waiting,
+        "admitted": counts.get("admitted", 0),
+        "refused": {reason: counts.get(f"refused:{reason}", 0) for reason in ("queue", "process", "cluster", "hedge")},
+    }
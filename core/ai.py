@@ -2,8 +2,13 @@ import json
 import os
 import sys
 import django
+import httpx
 import requests
+from django.conf import settings
 from dotenv import load_dotenv
+from core import admission, hedging, llm_cache, llm_client
+from core.breaker import LLMUnavailable
+from core.json_stream import FieldParser
 from core.models import CPU, GPU, RAM, Needs, Phone, BrandsCoefficients
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,6 +23,11 @@ if not api_key:
     raise ValueError("OPENROUTER_API_KEY not found")
 
 # =====API HELPER FUNCTIONS=====
+# the primary model; a completion is cached under it whichever model of
+# settings.OPENROUTER_MODELS answered (core/hedging.py)
+OPENROUTER_MODEL = settings.OPENROUTER_MODELS[0]
+OPENROUTER_TEMPERATURE = 0.1
+
 def get_openrouter_headers():
     """Get headers for OpenRouter API requests"""
     headers = {
@@ -33,6 +43,84 @@ def get_openrouter_headers():
         headers["X-Title"] = site_name
     return headers
 
+
+def cached_completion(prompt):
+    """Completion text for a prompt answered before (or being answered by
+    another worker right now), or None if this caller should post it; raises
+    llm_cache.FlightPending if the other worker's answer takes too long"""
+    return llm_cache.claim_or_wait(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+
+
+def completion_payload(prompt, model=OPENROUTER_MODEL):
+    return {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": OPENROUTER_TEMPERATURE
+    }
+
+
+def chart_schema(data):
+    """The bar chart prompts: a list of objects with a name and a performance_score"""
+    return isinstance(data, list) and bool(data) and all(
+        isinstance(item, dict) and "name" in item and "performance_score" in item for item in data)
+
+
+def comparison_schema(data):
+    """The PC and phone prompts: two comparison entries, a winner and the reasoning"""
+    return (isinstance(data, dict) and isinstance(data.get("comparison"), list) and len(data["comparison"]) == 2
+            and all(isinstance(item, dict) for item in data["comparison"])
+            and isinstance(data.get("winner"), str) and isinstance(data.get("reasoning"), str))
+
+
+def valid_completion(response, schema=None):
+    """Completion text of a 200 response if it is valid JSON (and passes
+    schema), else None"""
+    if response.status_code != 200:
+        return None
+    try:
+        content = response.json()['choices'][0]['message']['content']
+        data = json.loads(clean_json_response(content))
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    if schema is not None and not schema(data):
+        return None
+    return content
+
+
+def post_completion(prompt, schema=None):
+    """POST prompt to OpenRouter, hedged over the configured models, and cache
+    the completion if it is valid JSON passing schema"""
+    try:
+        # hedging holds an admission slot for every call it makes
+        response = hedging.post_hedged(lambda model: completion_payload(prompt, model), get_openrouter_headers(),
+                                       lambda answer: valid_completion(answer, schema) is not None)
+        content = valid_completion(response, schema)
+        if content is not None:
+            llm_cache.set_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE, content)
+    finally:
+        llm_cache.release_flight(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+    return response
+
+
+async def acached_completion(prompt):
+    return await llm_cache.aclaim_or_wait(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+
+
+async def apost_completion(prompt, schema=None):
+    """Async post_completion for the ASGI views"""
+    try:
+        response = await hedging.apost_hedged(lambda model: completion_payload(prompt, model), get_openrouter_headers(),
+                                              lambda answer: valid_completion(answer, schema) is not None)
+        content = valid_completion(response, schema)
+        if content is not None:
+            await llm_cache.aset_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE, content)
+    finally:
+        await llm_cache.arelease_flight(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+    return response
+
+
 # =====Promts=========
 cpu_prompt = """
 You are an assistant that generates structured JSON data for bar chart visualization based on processor characteristics.
@@ -159,17 +247,12 @@ def get_gpu_comparison_json(gpu1_name: str, gpu2_name: str):
             }
         ]
 
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=get_openrouter_headers(),
-            data=json.dumps({
-                "model": "google/gemma-3n-e2b-it:free",
-                "messages": [
-                    {"role": "user", "content": gpu_prompt + "\n\nDATA:\n" + str(data)}
-                ],
-                "temperature": 0.1
-            })
-        )
+        prompt = gpu_prompt + "\n\nDATA:\n" + str(data)
+        cached = cached_completion(prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        response = post_completion(prompt, chart_schema)
         if response.status_code == 200:
             result = response.json()
             print(f"GPU API Response: {result}")
@@ -196,6 +279,14 @@ def get_gpu_comparison_json(gpu1_name: str, gpu2_name: str):
                 "comparison": data
             }
 
+    except (requests.RequestException, LLMUnavailable) as e:
+        print(f"OpenRouter unreachable: {e}")
+        return {
+            "winner": winner,
+            "reasoning": reasoning,
+            "comparison": data,
+            "degraded": True
+        }
     except GPU.DoesNotExist as e:
         print(f"GPU not found: {e}")
         return None
@@ -238,17 +329,12 @@ def get_cpu_comparison_json(cpu1_name: str, cpu2_name: str):
             }
         ]
 
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=get_openrouter_headers(),
-            data=json.dumps({
-                "model": "google/gemma-3n-e2b-it:free",
-                "messages": [
-                    {"role": "user", "content": cpu_prompt + "\n\nDATA:\n" + str(data)}
-                ],
-                "temperature": 0.1
-            })
-        )
+        prompt = cpu_prompt + "\n\nDATA:\n" + str(data)
+        cached = cached_completion(prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        response = post_completion(prompt, chart_schema)
 
         if response.status_code == 200:
             result = response.json()
@@ -280,6 +366,14 @@ def get_cpu_comparison_json(cpu1_name: str, cpu2_name: str):
                 "comparison": data
             }
 
+    except (requests.RequestException, LLMUnavailable) as e:
+        print(f"OpenRouter unreachable: {e}")
+        return {
+            "winner": winner,
+            "reasoning": reasoning,
+            "comparison": data,
+            "degraded": True
+        }
     except CPU.DoesNotExist as e:
         print(f"CPU not found: {e}")
         return None
@@ -320,17 +414,12 @@ def get_ram_comparison_json(ram1_name: str, ram2_name: str):
             }
         ]
 
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=get_openrouter_headers(),
-            data=json.dumps({
-                "model": "google/gemma-3n-e2b-it:free",
-                "messages": [
-                    {"role": "user", "content": ram_prompt + "\n\nDATA:\n" + str(data)}
-                ],
-                "temperature": 0.1
-            })
-        )
+        prompt = ram_prompt + "\n\nDATA:\n" + str(data)
+        cached = cached_completion(prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        response = post_completion(prompt, chart_schema)
 
         if response.status_code == 200:
             result = response.json()
@@ -362,80 +451,79 @@ def get_ram_comparison_json(ram1_name: str, ram2_name: str):
                 "comparison": data
             }
 
+    except (requests.RequestException, LLMUnavailable) as e:
+        print(f"OpenRouter unreachable: {e}")
+        return {
+            "winner": winner,
+            "reasoning": reasoning,
+            "comparison": data,
+            "degraded": True
+        }
     except RAM.DoesNotExist as e:
         print(f"RAM not found: {e}")
         return None
 
 
-def get_pc_comparison_json(pc1_components: dict, pc2_components: dict, need_description: str = None):
-    try:
-        cpu1 = CPU.objects.get(name=pc1_components.get('cpu_name'))
-        gpu1 = GPU.objects.get(name=pc1_components.get('gpu_name'))
-        ram1 = RAM.objects.get(name=pc1_components.get('ram_name'))
-
-        cpu2 = CPU.objects.get(name=pc2_components.get('cpu_name'))
-        gpu2 = GPU.objects.get(name=pc2_components.get('gpu_name'))
-        ram2 = RAM.objects.get(name=pc2_components.get('ram_name'))
-
-        pc1_data = {
-            "name": f"PC1 ({cpu1.name} + {gpu1.name} + {ram1.name})",
-            "cpu": {
-                "name": cpu1.name,
-                "clock_speed_ghz": float(cpu1.clock_speed_ghz),
-                "core_count": cpu1.core_count,
-                "thread_count": cpu1.thread_count,
-                "tdp_watts": cpu1.tdp_watts,
-                "ipc": float(cpu1.ipc),
-                "performance_score": round(cpu1.core_count * cpu1.clock_speed_ghz * cpu1.ipc, 2)
-            },
-            "gpu": {
-                "name": gpu1.name,
-                "vram_gb": float(gpu1.vram_gb),
-                "core_count": gpu1.core_count,
-                "core_clock_ghz": float(gpu1.core_clock_ghz),
-                "memory_bandwidth_gbps": float(gpu1.memory_bandwidth_gbps),
-                "ray_tracing_support": gpu1.ray_tracing_support,
-                "performance_score": round(gpu1.core_count * gpu1.core_clock_ghz * gpu1.memory_bandwidth_gbps, 2)
-            },
-            "ram": {
-                "name": ram1.name,
-                "size_gb": ram1.size_gb,
-                "speed_mhz": ram1.speed_mhz,
-                "type": ram1.type,
-                "performance_score": round(ram1.size_gb * ram1.speed_mhz, 2)
-            }
+def build_pc_prompt(cpu1, gpu1, ram1, cpu2, gpu2, ram2, need_description: str = None):
+    pc1_data = {
+        "name": f"PC1 ({cpu1.name} + {gpu1.name} + {ram1.name})",
+        "cpu": {
+            "name": cpu1.name,
+            "clock_speed_ghz": float(cpu1.clock_speed_ghz),
+            "core_count": cpu1.core_count,
+            "thread_count": cpu1.thread_count,
+            "tdp_watts": cpu1.tdp_watts,
+            "ipc": float(cpu1.ipc),
+            "performance_score": round(cpu1.core_count * cpu1.clock_speed_ghz * cpu1.ipc, 2)
+        },
+        "gpu": {
+            "name": gpu1.name,
+            "vram_gb": float(gpu1.vram_gb),
+            "core_count": gpu1.core_count,
+            "core_clock_ghz": float(gpu1.core_clock_ghz),
+            "memory_bandwidth_gbps": float(gpu1.memory_bandwidth_gbps),
+            "ray_tracing_support": gpu1.ray_tracing_support,
+            "performance_score": round(gpu1.core_count * gpu1.core_clock_ghz * gpu1.memory_bandwidth_gbps, 2)
+        },
+        "ram": {
+            "name": ram1.name,
+            "size_gb": ram1.size_gb,
+            "speed_mhz": ram1.speed_mhz,
+            "type": ram1.type,
+            "performance_score": round(ram1.size_gb * ram1.speed_mhz, 2)
         }
+    }
 
-        pc2_data = {
-            "name": f"PC2 ({cpu2.name} + {gpu2.name} + {ram2.name})",
-            "cpu": {
-                "name": cpu2.name,
-                "clock_speed_ghz": float(cpu2.clock_speed_ghz),
-                "core_count": cpu2.core_count,
-                "thread_count": cpu2.thread_count,
-                "tdp_watts": cpu2.tdp_watts,
-                "ipc": float(cpu2.ipc),
-                "performance_score": round(cpu2.core_count * cpu2.clock_speed_ghz * cpu2.ipc, 2)
-            },
-            "gpu": {
-                "name": gpu2.name,
-                "vram_gb": float(gpu2.vram_gb),
-                "core_count": gpu2.core_count,
-                "core_clock_ghz": float(gpu2.core_clock_ghz),
-                "memory_bandwidth_gbps": float(gpu2.memory_bandwidth_gbps),
-                "ray_tracing_support": gpu2.ray_tracing_support,
-                "performance_score": round(gpu2.core_count * gpu2.core_clock_ghz * gpu2.memory_bandwidth_gbps, 2)
-            },
-            "ram": {
-                "name": ram2.name,
-                "size_gb": ram2.size_gb,
-                "speed_mhz": ram2.speed_mhz,
-                "type": ram2.type,
-                "performance_score": round(ram2.size_gb * ram2.speed_mhz, 2)
-            }
+    pc2_data = {
+        "name": f"PC2 ({cpu2.name} + {gpu2.name} + {ram2.name})",
+        "cpu": {
+            "name": cpu2.name,
+            "clock_speed_ghz": float(cpu2.clock_speed_ghz),
+            "core_count": cpu2.core_count,
+            "thread_count": cpu2.thread_count,
+            "tdp_watts": cpu2.tdp_watts,
+            "ipc": float(cpu2.ipc),
+            "performance_score": round(cpu2.core_count * cpu2.clock_speed_ghz * cpu2.ipc, 2)
+        },
+        "gpu": {
+            "name": gpu2.name,
+            "vram_gb": float(gpu2.vram_gb),
+            "core_count": gpu2.core_count,
+            "core_clock_ghz": float(gpu2.core_clock_ghz),
+            "memory_bandwidth_gbps": float(gpu2.memory_bandwidth_gbps),
+            "ray_tracing_support": gpu2.ray_tracing_support,
+            "performance_score": round(gpu2.core_count * gpu2.core_clock_ghz * gpu2.memory_bandwidth_gbps, 2)
+        },
+        "ram": {
+            "name": ram2.name,
+            "size_gb": ram2.size_gb,
+            "speed_mhz": ram2.speed_mhz,
+            "type": ram2.type,
+            "performance_score": round(ram2.size_gb * ram2.speed_mhz, 2)
         }
+    }
 
-        comparison_prompt = f"""
+    comparison_prompt = f"""
 You are an assistant that compares two PC configurations based on user needs and generates structured JSON data.
 
 I provide you with two PC configurations and a user need description. Each PC has CPU, GPU, and RAM components with their specifications.
@@ -484,68 +572,105 @@ Based on the user need and component specifications, generate a JSON object with
 
 Return ONLY clean JSON, without comments, explanations, or Markdown.
 """
+    return comparison_prompt
 
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=get_openrouter_headers(),
-            data=json.dumps({
-                "model": "google/gemma-3n-e2b-it:free",
-                "messages": [
-                    {"role": "user", "content": comparison_prompt}
-                ],
-                "temperature": 0.1
-            })
-        )
 
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            cleaned = clean_json_response(content)
-            return json.loads(cleaned)
-        else:
-            print("API Error:", response.status_code, response.text)
-            return None
+def pc_comparison_result(response):
+    if response.status_code == 200:
+        result = response.json()
+        content = result['choices'][0]['message']['content']
+        cleaned = clean_json_response(content)
+        return json.loads(cleaned)
+    else:
+        print("API Error:", response.status_code, response.text)
+        return None
+
+
+def pc_prompt(pc1_components: dict, pc2_components: dict, need_description: str = None):
+    cpu1 = CPU.objects.get(name=pc1_components.get('cpu_name'))
+    gpu1 = GPU.objects.get(name=pc1_components.get('gpu_name'))
+    ram1 = RAM.objects.get(name=pc1_components.get('ram_name'))
+
+    cpu2 = CPU.objects.get(name=pc2_components.get('cpu_name'))
+    gpu2 = GPU.objects.get(name=pc2_components.get('gpu_name'))
+    ram2 = RAM.objects.get(name=pc2_components.get('ram_name'))
+
+    return build_pc_prompt(cpu1, gpu1, ram1, cpu2, gpu2, ram2, need_description)
+
+
+def get_pc_comparison_json(pc1_components: dict, pc2_components: dict, need_description: str = None):
+    try:
+        comparison_prompt = pc_prompt(pc1_components, pc2_components, need_description)
+        cached = cached_completion(comparison_prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        return pc_comparison_result(post_completion(comparison_prompt, comparison_schema))
 
     except (CPU.DoesNotExist, GPU.DoesNotExist, RAM.DoesNotExist) as e:
         print(f"Component not found: {e}")
         return None
+    except LLMUnavailable as e:
+        print(f"OpenRouter unavailable: {e}")
+        return None
     except Exception as e:
         print(f"Error comparing PCs: {e}")
         return None
 
 
-def get_phone_comparison_json(phone1_name: str, phone2_name: str, need_description: str = None):
+async def apc_prompt(pc1_components: dict, pc2_components: dict, need_description: str = None):
+    """The PC comparison prompt, loaded with async ORM calls"""
+    cpu1 = await CPU.objects.aget(name=pc1_components.get('cpu_name'))
+    gpu1 = await GPU.objects.aget(name=pc1_components.get('gpu_name'))
+    ram1 = await RAM.objects.aget(name=pc1_components.get('ram_name'))
+
+    cpu2 = await CPU.objects.aget(name=pc2_components.get('cpu_name'))
+    gpu2 = await GPU.objects.aget(name=pc2_components.get('gpu_name'))
+    ram2 = await RAM.objects.aget(name=pc2_components.get('ram_name'))
+
+    return build_pc_prompt(cpu1, gpu1, ram1, cpu2, gpu2, ram2, need_description)
+
+
+async def aget_pc_comparison_json(pc1_components: dict, pc2_components: dict, need_description: str = None):
+    """get_pc_comparison_json for async views: async ORM and HTTP, no thread held"""
     try:
-        phone1 = Phone.objects.select_related('brand').get(name=phone1_name)
-        phone2 = Phone.objects.select_related('brand').get(name=phone2_name)
-
-        brand_coeffs = dict(BrandsCoefficients.objects.values_list('name', 'coefficient'))
-
-        phone1_data = {
-            "name": phone1.name,
-            "brand": phone1.brand.name,
-            "ram_size": phone1.ram_size,
-            "memory_size": phone1.memory_size,
-            "processor": phone1.processor,
-            "camera_mp": phone1.camera_mp,
-            "battery": phone1.battery,
-            "year": phone1.year,
-            "brand_coefficient": phone1.brand.coefficient
-        }
+        comparison_prompt = await apc_prompt(pc1_components, pc2_components, need_description)
+        cached = await acached_completion(comparison_prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
 
-        phone2_data = {
-            "name": phone2.name,
-            "brand": phone2.brand.name,
-            "ram_size": phone2.ram_size,
-            "memory_size": phone2.memory_size,
-            "processor": phone2.processor,
-            "camera_mp": phone2.camera_mp,
-            "battery": phone2.battery,
-            "year": phone2.year,
-            "brand_coefficient": phone2.brand.coefficient
-        }
+        return pc_comparison_result(await apost_completion(comparison_prompt, comparison_schema))
 
-        comparison_prompt = f"""
+    except (CPU.DoesNotExist, GPU.DoesNotExist, RAM.DoesNotExist) as e:
+        print(f"Component not found: {e}")
+        return None
+    except LLMUnavailable as e:
+        print(f"OpenRouter unavailable: {e}")
+        return None
+    except Exception as e:
+        print(f"Error comparing PCs: {e}")
+        return None
+
+
+def phone_prompt_data(phone):
+    return {
+        "name": phone.name,
+        "brand": phone.brand.name,
+        "ram_size": phone.ram_size,
+        "memory_size": phone.memory_size,
+        "processor": phone.processor,
+        "camera_mp": phone.camera_mp,
+        "battery": phone.battery,
+        "year": phone.year,
+        "brand_coefficient": phone.brand.coefficient
+    }
+
+
+def build_phone_prompt(phone1, phone2, brand_coeffs: dict, need_description: str = None):
+    phone1_data = phone_prompt_data(phone1)
+    phone2_data = phone_prompt_data(phone2)
+
+    comparison_prompt = f"""
 You are an assistant that compares two smartphones based on user needs and component specifications.
 
 User Need: {need_description or "General purpose smartphone usage"}
@@ -591,42 +716,117 @@ Generate a JSON object with the following structure:
 
 Return ONLY pure JSON (no markdown or text).
 """
+    return comparison_prompt
+
+
+def phone_comparison_result(response):
+    if response.status_code == 200:
+        result = response.json()
+        content = result['choices'][0]['message']['content']
+        cleaned = clean_json_response(content)
+        return json.loads(cleaned)
+    else:
+        error_data = response.json() if response.text else {}
+        error_msg = error_data.get('error', {}).get('message', 'Unknown API error')
+        error_code = error_data.get('error', {}).get('code', response.status_code)
+        
+        print(f"API Error {response.status_code}: {error_msg}")
+        print(f"Full response: {response.text}")
+        
+        # Return error info instead of None for better error handling
+        return {
+            "error": True,
+            "api_error": True,
+            "status_code": response.status_code,
+            "error_code": error_code,
+            "message": error_msg,
+            "details": "OpenRouter API error. Please check your API key or try again later."
+        }
 
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=get_openrouter_headers(),
-            data=json.dumps({
-                "model": "google/gemma-3n-e2b-it:free",
-                "messages": [
-                    {"role": "user", "content": comparison_prompt}
-                ],
-                "temperature": 0.1
-            })
-        )
 
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            cleaned = clean_json_response(content)
-            return json.loads(cleaned)
-        else:
-            error_data = response.json() if response.text else {}
-            error_msg = error_data.get('error', {}).get('message', 'Unknown API error')
-            error_code = error_data.get('error', {}).get('code', response.status_code)
-            
-            print(f"API Error {response.status_code}: {error_msg}")
-            print(f"Full response: {response.text}")
-            
-            # Return error info instead of None for better error handling
-            return {
-                "error": True,
-                "api_error": True,
-                "status_code": response.status_code,
-                "error_code": error_code,
-                "message": error_msg,
-                "details": "OpenRouter API error. Please check your API key or try again later."
-            }
+def phone_unavailable(e):
+    print(f"OpenRouter unavailable: {e}")
+    return {
+        "error": True,
+        "api_error": True,
+        "status_code": 503,
+        "error_code": "circuit_open",
+        "message": "Phone comparison is temporarily unavailable",
+        "details": "OpenRouter API is degraded. Please try again later.",
+        "retry_after": e.retry_after,
+        "degraded": True
+    }
+
+
+def phone_unreachable(e, timed_out: bool):
+    print(f"OpenRouter unreachable: {e}")
+    return {
+        "error": True,
+        "api_error": True,
+        "status_code": 504 if timed_out else 502,
+        "error_code": type(e).__name__,
+        "message": str(e),
+        "details": "OpenRouter API did not answer in time. Please try again later."
+    }
+
+
+def phone_prompt(phone1_name: str, phone2_name: str, need_description: str = None):
+    phone1 = Phone.objects.select_related('brand').get(name=phone1_name)
+    phone2 = Phone.objects.select_related('brand').get(name=phone2_name)
+
+    brand_coeffs = dict(BrandsCoefficients.objects.values_list('name', 'coefficient'))
+
+    return build_phone_prompt(phone1, phone2, brand_coeffs, need_description)
+
+
+def get_phone_comparison_json(phone1_name: str, phone2_name: str, need_description: str = None):
+    try:
+        comparison_prompt = phone_prompt(phone1_name, phone2_name, need_description)
+        cached = cached_completion(comparison_prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        return phone_comparison_result(post_completion(comparison_prompt, comparison_schema))
+
+    except LLMUnavailable as e:
+        return phone_unavailable(e)
+    except requests.RequestException as e:
+        return phone_unreachable(e, isinstance(e, requests.Timeout))
+    except Phone.DoesNotExist as e:
+        print(f"Phone not found: {e}")
+        return None
+    except Exception as e:
+        print(f"Error comparing phones: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+async def aphone_prompt(phone1_name: str, phone2_name: str, need_description: str = None):
+    """The phone comparison prompt, loaded with async ORM calls"""
+    phone1 = await Phone.objects.select_related('brand').aget(name=phone1_name)
+    phone2 = await Phone.objects.select_related('brand').aget(name=phone2_name)
+
+    brand_coeffs = {name: coefficient async for name, coefficient
+                    in BrandsCoefficients.objects.values_list('name', 'coefficient')}
+
+    return build_phone_prompt(phone1, phone2, brand_coeffs, need_description)
+
+
+async def aget_phone_comparison_json(phone1_name: str, phone2_name: str, need_description: str = None):
+    """get_phone_comparison_json for async views: async ORM and HTTP, no thread held"""
+    try:
+        comparison_prompt = await aphone_prompt(phone1_name, phone2_name, need_description)
+        cached = await acached_completion(comparison_prompt)
+        if cached is not None:
+            return json.loads(clean_json_response(cached))
+
+        return phone_comparison_result(await apost_completion(comparison_prompt, comparison_schema))
 
+    except LLMUnavailable as e:
+        return phone_unavailable(e)
+    except httpx.HTTPError as e:
+        return phone_unreachable(e, isinstance(e, httpx.TimeoutException))
     except Phone.DoesNotExist as e:
         print(f"Phone not found: {e}")
         return None
@@ -635,3 +835,239 @@ Return ONLY pure JSON (no markdown or text).
         import traceback
         traceback.print_exc()
         return None
+
+
+# =====Batch phone comparisons=====
+def build_phone_batch_prompt(phones: list, pairs: list, brand_coeffs: dict, need_description: str = None):
+    """One prompt for many pairs: the instructions, brand coefficients and
+    every phone are written once, the pairs refer to the phones as P1, P2..."""
+    phones_data = "\n".join(f"P{i}: {phone_prompt_data(phone)}" for i, phone in enumerate(phones, 1))
+    pairs_data = "\n".join(f"{n}. P{a + 1} (Phone1) vs P{b + 1} (Phone2)" for n, (a, b) in enumerate(pairs, 1))
+
+    comparison_prompt = f"""
+You are an assistant that compares pairs of smartphones based on user needs and component specifications.
+
+User Need: {need_description or "General purpose smartphone usage"}
+
+Each phone has brand-based coefficients that influence its overall performance, reliability, and optimization quality.
+
+Phones:
+{phones_data}
+
+Brand Coefficients:
+{brand_coeffs}
+
+Pairs to compare:
+{pairs_data}
+
+Generate a JSON array with exactly one object per pair, in the order of the pairs above. Each object has the following structure:
+{{
+    "pair": <pair number>,
+    "comparison": [
+        {{
+            "phone_name": "Phone1",
+            "overall_score": <score from 0-100>,
+            "performance_score": <score from 0-100>,
+            "camera_score": <score from 0-100>,
+            "battery_score": <score from 0-100>,
+            "recommendation": "<brief recommendation based on user need>",
+            "strengths": ["<strength1>", "<strength2>", "<strength3>"],
+            "weaknesses": ["<weakness1>", "<weakness2>"]
+        }},
+        {{
+            "phone_name": "Phone2",
+            "overall_score": <score from 0-100>,
+            "performance_score": <score from 0-100>,
+            "camera_score": <score from 0-100>,
+            "battery_score": <score from 0-100>,
+            "recommendation": "<brief recommendation based on user need>",
+            "strengths": ["<strength1>", "<strength2>", "<strength3>"],
+            "weaknesses": ["<weakness1>", "<weakness2>"]
+        }}
+    ],
+    "winner": "<Phone1 or Phone2>",
+    "reasoning": "<detailed explanation of which phone better fits the described need>"
+}}
+
+Return ONLY pure JSON (no markdown or text).
+"""
+    return comparison_prompt
+
+
+def split_phone_batch(response, count: int) -> list:
+    """The comparison of each of count pairs from a batch answer, None for
+    the pairs it has no schema-conforming entry for"""
+    results = [None] * count
+    content = valid_completion(response)
+    if content is None:
+        return results
+    items = json.loads(clean_json_response(content))
+    if not isinstance(items, list):
+        return results
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        item = dict(item)
+        number = item.pop("pair", position + 1)
+        index = number - 1 if isinstance(number, int) else position
+        if 0 <= index < count and results[index] is None and comparison_schema(item):
+            results[index] = item
+    return results
+
+
+def _post_phone_batch(phones: list, pairs: list, brand_coeffs: dict, need_description: str = None) -> list:
+    index = {}
+    for phone in phones:
+        index.setdefault(phone.pk, len(index))
+    listed = list({phone.pk: phone for phone in phones}.values())
+    prompt = build_phone_batch_prompt(listed, [(index[a.pk], index[b.pk]) for a, b in pairs],
+                                      brand_coeffs, need_description)
+    # straight to the primary model: a batch takes far longer than one pair
+    # and would skew the latencies the hedge delays are taken from
+    with admission.admit():
+        response = llm_client.post_chat(completion_payload(prompt), get_openrouter_headers())
+    if response.status_code != 200:
+        print(f"Batch API Error {response.status_code}: {response.text}")
+    return split_phone_batch(response, len(pairs))
+
+
+def get_phone_batch_comparison_json(pairs: list, need_description: str = None) -> list:
+    """LLM comparisons of many (phone1 name, phone2 name) pairs, up to
+    LLM_BATCH_SIZE pairs per OpenRouter call.
+
+    Each answer is cached as the completion of the pair's own prompt, so
+    get_phone_comparison_json and the streaming view find it later. Returns
+    the comparison of every pair, None where a phone was not found or the
+    model gave nothing usable.
+    """
+    names = {name for pair in pairs for name in pair}
+    phones = {phone.name: phone for phone in Phone.objects.select_related('brand').filter(name__in=names)}
+    brand_coeffs = dict(BrandsCoefficients.objects.values_list('name', 'coefficient'))
+
+    results = [None] * len(pairs)
+    todo = []
+    for i, (name1, name2) in enumerate(pairs):
+        if name1 not in phones or name2 not in phones:
+            print(f"Phone not found: {name1 if name1 not in phones else name2}")
+            continue
+        prompt = build_phone_prompt(phones[name1], phones[name2], brand_coeffs, need_description)
+        cached = llm_cache.get_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+        if cached is not None:
+            results[i] = json.loads(clean_json_response(cached))
+        else:
+            todo.append((i, prompt, (phones[name1], phones[name2])))
+
+    size = max(settings.LLM_BATCH_SIZE, 1)
+    for start in range(0, len(todo), size):
+        chunk = todo[start:start + size]
+        try:
+            answers = _post_phone_batch([phone for _, _, pair in chunk for phone in pair],
+                                        [pair for _, _, pair in chunk], brand_coeffs, need_description)
+        except LLMUnavailable as e:
+            print(f"OpenRouter unavailable: {e}")
+            break
+        except requests.RequestException as e:
+            print(f"OpenRouter unreachable: {e}")
+            continue
+        for (i, prompt, _), answer in zip(chunk, answers):
+            if answer is not None:
+                llm_cache.set_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE, json.dumps(answer))
+                results[i] = answer
+    return results
+
+
+async def astream_comparison(prompt):
+    """(event, data) pairs for a comparison prompt, streamed from OpenRouter.
+
+    `comparison` ({"index", "item"}) for every entry of comparison[] and
+    `winner`/`reasoning` (other top-level fields as `field`) as soon as they
+    are complete, then `done` with the whole result or `error`.
+    """
+    content = await llm_cache.aget_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE)
+    parser = FieldParser()
+    try:
+        if content is not None:
+            events = parser.feed(content)
+        else:
+            pieces = []
+            events = []
+            async with admission.aadmit():
+                async for delta in llm_client.astream_chat(completion_payload(prompt), get_openrouter_headers()):
+                    pieces.append(delta)
+                    for event in _stream_events(parser.feed(delta)):
+                        yield event
+            content = "".join(pieces)
+        for event in _stream_events(events):
+            yield event
+        result = json.loads(clean_json_response(content))
+        if not comparison_schema(result):
+            raise ValueError("not a comparison")
+    except LLMUnavailable as e:
+        print(f"OpenRouter unavailable: {e}")
+        yield "error", {"status_code": 503, "message": str(e), "retry_after": e.retry_after, "degraded": True}
+        return
+    except llm_client.UpstreamError as e:
+        print(f"OpenRouter stream failed: {e}")
+        yield "error", {"status_code": e.status_code, "message": e.message}
+        return
+    except httpx.HTTPError as e:
+        print(f"OpenRouter unreachable: {e}")
+        yield "error", {"status_code": 504 if isinstance(e, httpx.TimeoutException) else 502, "message": str(e)}
+        return
+    except ValueError as e:
+        print(f"Streamed completion is not a valid comparison: {e}")
+        yield "error", {"status_code": 502, "message": "Invalid response from the language model"}
+        return
+
+    await llm_cache.aset_completion(OPENROUTER_MODEL, prompt, OPENROUTER_TEMPERATURE, content)
+    yield "done", result
+
+
+def stream_comparison(prompt):
+    """astream_comparison for WSGI, whose servers only stream sync iterators:
+    the completion is fetched whole (cached, coalesced and hedged like
+    get_pc_comparison_json) and then reported as the same events"""
+    try:
+        content = cached_completion(prompt)
+        if content is None:
+            response = post_completion(prompt, comparison_schema)
+            content = valid_completion(response, comparison_schema)
+            if content is None and response.status_code != 200:
+                print(f"API Error {response.status_code}: {response.text}")
+                yield "error", {"status_code": response.status_code, "message": "OpenRouter API error"}
+                return
+        if content is None:
+            raise ValueError("not a comparison")
+        result = json.loads(clean_json_response(content))
+    except LLMUnavailable as e:
+        print(f"OpenRouter unavailable: {e}")
+        yield "error", {"status_code": 503, "message": str(e), "retry_after": e.retry_after, "degraded": True}
+        return
+    except requests.RequestException as e:
+        print(f"OpenRouter unreachable: {e}")
+        yield "error", {"status_code": 504 if isinstance(e, requests.Timeout) else 502, "message": str(e)}
+        return
+    except ValueError as e:
+        print(f"Completion is not a valid comparison: {e}")
+        yield "error", {"status_code": 502, "message": "Invalid response from the language model"}
+        return
+
+    yield from _stream_events(FieldParser().feed(content))
+    yield "done", result
+
+
+def _stream_events(events):
+    for event in events:
+        if event[0] == "item":
+            _, key, index, value = event
+            if key == "comparison":
+                yield "comparison", {"index": index, "item": value}
+            else:
+                yield "item", {"name": key, "index": index, "item": value}
+            continue
+        _, key, value = event
+        if key in ("winner", "reasoning"):
+            yield key, value
+        elif key != "comparison":
+            # comparison[] has already been sent entry by entry
+            yield "field", {"name": key, "value": value}
@@ -0,0 +1,135 @@
+"""
+Circuit breaker around the OpenRouter client, shared through the default
+(Redis) cache so every worker and host sees the same state.
+
+Calls are counted in LLM_BREAKER_BUCKET second buckets. Once at least
+LLM_BREAKER_MIN_CALLS calls in the last LLM_BREAKER_WINDOW seconds have
+failed (429, 5xx, unreachable) or taken longer than LLM_BREAKER_SLOW_CALL
+seconds at a rate of LLM_BREAKER_ERROR_RATE or more, the breaker opens:
+calls fail at once with CircuitOpen for LLM_BREAKER_COOLDOWN seconds and
+callers serve their deterministic result instead. After the cooldown one
+probe call at a time is let through (half-open); the first good one closes
+the breaker, a bad one opens it again.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+OPEN_KEY = "llm:breaker:open"
+TRIPPED_KEY = "llm:breaker:tripped"
+PROBE_KEY = "llm:breaker:probe"
+CALLS_KEY = "llm:breaker:calls:{}"
+BAD_KEY = "llm:breaker:bad:{}"
+
+CLOSED, PROBE = "closed", "probe"
+
+# a tripped breaker forgets about itself after this long (seconds) even if
+# no probe ever reports back
+TRIPPED_TIMEOUT = 24 * 60 * 60
+
+
+class LLMUnavailable(Exception):
+    """OpenRouter is not asked right now; try again after retry_after seconds.
+
+    Raised before a call goes out: the breaker is open (CircuitOpen), the
+    quota is booked up (ratelimit.RateLimited), too many calls are in flight
+    (admission.Overloaded) or the request's deadline is spent
+    (deadlines.DeadlineExceeded). Callers serve their local result instead.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(LLMUnavailable):
+    """OpenRouter is considered down"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OpenRouter circuit open, retry in {retry_after}s", retry_after)
+
+
+def _buckets(now: float) -> list:
+    bucket = settings.LLM_BREAKER_BUCKET
+    current = int(now // bucket)
+    return [current - i for i in range(max(settings.LLM_BREAKER_WINDOW // bucket, 1))]
+
+
+def _incr(key: str):
+    cache.add(key, 0, settings.LLM_BREAKER_WINDOW + settings.LLM_BREAKER_BUCKET)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired between add and incr
+        cache.add(key, 1, settings.LLM_BREAKER_WINDOW + settings.LLM_BREAKER_BUCKET)
+
+
+def _trip():
+    # calls still in flight when it opened must not push the cooldown back
+    if not cache.add(OPEN_KEY, time.time() + settings.LLM_BREAKER_COOLDOWN, settings.LLM_BREAKER_COOLDOWN):
+        return
+    cache.set(TRIPPED_KEY, True, TRIPPED_TIMEOUT)
+    cache.delete(PROBE_KEY)
+    print("OpenRouter circuit breaker opened")
+
+
+def _close():
+    keys = [CALLS_KEY.format(b) for b in _buckets(time.time())] + [BAD_KEY.format(b) for b in _buckets(time.time())]
+    cache.delete_many(keys + [TRIPPED_KEY, PROBE_KEY])
+    print("OpenRouter circuit breaker closed")
+
+
+def before_call() -> str:
+    """CLOSED or PROBE if a call may go out; raises CircuitOpen otherwise"""
+    open_until = cache.get(OPEN_KEY)
+    if open_until is not None:
+        raise CircuitOpen(max(int(open_until - time.time()) + 1, 1))
+    if cache.get(TRIPPED_KEY) is None:
+        return CLOSED
+    # half-open: only one probe in flight, everyone else keeps failing fast
+    if cache.add(PROBE_KEY, True, settings.LLM_BREAKER_COOLDOWN):
+        return PROBE
+    raise CircuitOpen(1)
+
+
+def after_call(mode: str, ok: bool, latency: float):
+    bad = not ok or latency > settings.LLM_BREAKER_SLOW_CALL
+    if mode == PROBE:
+        if bad:
+            _trip()
+        else:
+            _close()
+        return
+
+    now = time.time()
+    bucket = _buckets(now)[0]
+    _incr(CALLS_KEY.format(bucket))
+    if not bad:
+        return
+    _incr(BAD_KEY.format(bucket))
+
+    buckets = _buckets(now)
+    counts = cache.get_many([CALLS_KEY.format(b) for b in buckets] + [BAD_KEY.format(b) for b in buckets])
+    calls = sum(counts.get(CALLS_KEY.format(b), 0) for b in buckets)
+    failures = sum(counts.get(BAD_KEY.format(b), 0) for b in buckets)
+    if calls >= settings.LLM_BREAKER_MIN_CALLS and failures / calls >= settings.LLM_BREAKER_ERROR_RATE:
+        _trip()
+
+
+def cancel(mode: str):
+    """The call allowed by before_call() never went out"""
+    if mode == PROBE:
+        cache.delete(PROBE_KEY)
+
+
+def state() -> str:
+    if cache.get(OPEN_KEY) is not None:
+        return "open"
+    return "half-open" if cache.get(TRIPPED_KEY) is not None else "closed"
+
+
+abefore_call = sync_to_async(before_call, thread_sensitive=False)
+aafter_call = sync_to_async(after_call, thread_sensitive=False)
+acancel = sync_to_async(cancel, thread_sensitive=False)
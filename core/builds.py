@@ -0,0 +1,198 @@
+"""
+Deterministic, need-aware scoring of whole PC builds.
+
+Every need maps to a weight profile over the CPU, GPU and RAM performance
+indexes from compare.py and a build's overall score is the weighted sum.
+The result has the same shape as the LLM comparison in ai.py, so the LLM
+is only needed to enrich the text, not to produce the scores.
+"""
+import numpy as np
+
+from core.compare import performance_indexes
+from core.models import CPU, GPU, RAM, Needs
+from core.ranking import top_k
+
+NEED_PROFILES = {
+    "gaming": {"cpu": 0.30, "gpu": 0.55, "ram": 0.15},
+    "work": {"cpu": 0.50, "gpu": 0.10, "ram": 0.40},
+    "video_editing": {"cpu": 0.40, "gpu": 0.30, "ram": 0.30},
+    "3d_rendering": {"cpu": 0.35, "gpu": 0.45, "ram": 0.20},
+    "general": {"cpu": 0.40, "gpu": 0.35, "ram": 0.25},
+}
+
+# checked in order against the need name and its Needs.description
+NEED_KEYWORDS = (
+    ("gaming", ("gaming", "game")),
+    ("3d_rendering", ("3d", "render", "cad", "modeling")),
+    ("video_editing", ("video", "editing", "content creation")),
+    ("work", ("work", "office", "productivity")),
+)
+
+COMPONENTS = (("cpu", CPU, "CPU"), ("gpu", GPU, "GPU"), ("ram", RAM, "RAM"))
+
+MAX_BUILDS = 50
+
+
+def _normalize_need(need):
+    return "_".join((need or "").strip().lower().replace("-", " ").split())
+
+
+def need_profile(need: str):
+    """(profile name, weights) for a need name such as a Needs row's name"""
+    key = _normalize_need(need)
+    if key in NEED_PROFILES:
+        return key, NEED_PROFILES[key]
+
+    description = Needs.objects.filter(name__iexact=(need or "").strip()).values_list("description", flat=True).first()
+    text = f"{key.replace('_', ' ')} {description or ''}".lower()
+    for name, keywords in NEED_KEYWORDS:
+        if any(word in text for word in keywords):
+            return name, NEED_PROFILES[name]
+    return "general", NEED_PROFILES["general"]
+
+
+def _fetch(model, names):
+    found = {}
+    for obj in model.objects.filter(name__in=set(names)).order_by("pk"):
+        found.setdefault(obj.name, obj)
+    return found
+
+
+def component_scores(builds):
+    """[{"cpu": (obj, index), "gpu": .., "ram": ..}] for builds given as
+    {"cpu_name", "gpu_name", "ram_name"} dicts, or None if any is missing"""
+    scored = [{} for _ in builds]
+    for key, model, _ in COMPONENTS:
+        names = [build.get(f"{key}_name") for build in builds]
+        found = _fetch(model, names)
+        if any(name not in found for name in names):
+            return None
+        objs = [found[name] for name in names]
+        for slot, obj, idx in zip(scored, objs, performance_indexes(model, objs)):
+            slot[key] = (obj, float(idx))
+    return scored
+
+
+def _verdict(overall):
+    if overall >= 70:
+        return "Great fit"
+    if overall >= 45:
+        return "Adequate"
+    return "Underpowered"
+
+
+def _build_entry(label, parts, other, weights, need):
+    overall = sum(parts[key][1] * weights[key] for key, _, _ in COMPONENTS)
+    strengths, weaknesses = [], []
+    for key, _, title in COMPONENTS:
+        obj, idx = parts[key]
+        other_idx = other[key][1]
+        if idx > other_idx:
+            strengths.append(f"Stronger {title}: {obj.name} (index {idx:.1f} vs {other_idx:.1f})")
+        elif idx < other_idx:
+            weaknesses.append(f"Weaker {title}: {obj.name} (index {idx:.1f} vs {other_idx:.1f})")
+    focus = max(weights, key=weights.get).upper()
+    return {
+        "pc_name": label,
+        "overall_score": round(overall, 1),
+        "cpu_score": round(parts["cpu"][1], 1),
+        "gpu_score": round(parts["gpu"][1], 1),
+        "ram_score": round(parts["ram"][1], 1),
+        "recommendation": f"{_verdict(overall)} for {need.replace('_', ' ')} ({focus} carries the most weight)",
+        "strengths": strengths,
+        "weaknesses": weaknesses,
+    }
+
+
+def get_pc_score_json(pc1_components: dict, pc2_components: dict, need_description: str = None):
+    """Local equivalent of ai.get_pc_comparison_json; None if a component is missing"""
+    scored = component_scores([pc1_components, pc2_components])
+    if scored is None:
+        return None
+
+    need, weights = need_profile(need_description)
+    pc1 = _build_entry("PC1", scored[0], scored[1], weights, need)
+    pc2 = _build_entry("PC2", scored[1], scored[0], weights, need)
+
+    if pc1["overall_score"] > pc2["overall_score"]:
+        winner, loser = pc1, pc2
+    elif pc2["overall_score"] > pc1["overall_score"]:
+        winner, loser = pc2, pc1
+    else:
+        winner = None
+
+    if winner is None:
+        reasoning = f"Both PCs score {pc1['overall_score']:.1f} for {need.replace('_', ' ')}"
+    else:
+        reasoning = (f"{winner['pc_name']} scores {winner['overall_score']:.1f} vs {loser['overall_score']:.1f} "
+                     f"for {need.replace('_', ' ')} (weights: CPU {weights['cpu']:.0%}, "
+                     f"GPU {weights['gpu']:.0%}, RAM {weights['ram']:.0%})")
+
+    return {
+        "comparison": [pc1, pc2],
+        "winner": winner["pc_name"] if winner else "Tie",
+        "reasoning": reasoning,
+        "need": need,
+        "source": "local",
+    }
+
+
+def enrich_with_llm(data: dict, llm: dict, name_key: str = "pc_name") -> dict:
+    """Keep the local scores, take the LLM's wording where it has any
+    (entries are matched on name_key: pc_name, or phone_name for phones)"""
+    if not isinstance(llm, dict):
+        return data
+    by_name = {item.get(name_key): item for item in llm.get("comparison") or [] if isinstance(item, dict)}
+    for item in data["comparison"]:
+        extra = by_name.get(item[name_key], {})
+        for field in ("recommendation", "strengths", "weaknesses"):
+            if extra.get(field):
+                item[field] = extra[field]
+    if llm.get("reasoning"):
+        data["reasoning"] = llm["reasoning"]
+    data["source"] = "local+llm"
+    return data
+
+
+def recommend_builds(need: str, limit: int, ranges: dict = None):
+    """(profile name, builds) with the limit best CPU+GPU+RAM combinations.
+
+    ranges maps "cpu"/"gpu"/"ram" to range filters for that axis. A build's
+    score is a positively weighted sum of its three indexes, so the best
+    `limit` builds can only use each axis' best `limit` components: the
+    search is exact over limit^3 candidates instead of the full product.
+    """
+    name, weights = need_profile(need)
+    ranges = ranges or {}
+
+    axes = []
+    for key, model, _ in COMPONENTS:
+        pks, scores = top_k(model, limit, ranges.get(key))
+        if not len(pks):
+            return name, []
+        axes.append((model, pks, scores))
+
+    (_, _, cpu), (_, _, gpu), (_, _, ram) = axes
+    total = (weights["cpu"] * cpu[:, None, None]
+             + weights["gpu"] * gpu[None, :, None]
+             + weights["ram"] * ram[None, None, :])
+    flat = total.ravel()
+    best = np.argpartition(-flat, min(limit, flat.size) - 1)[:limit]
+    best = best[np.argsort(-flat[best], kind="stable")]
+    picks = np.unravel_index(best, total.shape)
+
+    objs = [model.objects.in_bulk(pks.tolist()) for model, pks, _ in axes]
+    builds = []
+    for rank, position in enumerate(best.tolist()):
+        build = {"rank": rank + 1, "overall_score": round(float(flat[position]), 1)}
+        for axis, (key, _, _) in enumerate(COMPONENTS):
+            _, pks, scores = axes[axis]
+            i = picks[axis][rank]
+            obj = objs[axis].get(int(pks[i]))
+            build[key] = {
+                "id": int(pks[i]),
+                "name": obj.name if obj else None,
+                "performance_index": round(float(scores[i]), 2),
+            }
+        builds.append(build)
+    return name, builds
@@ -0,0 +1,55 @@
+"""
+Parser for the free-text Phone.camera_mp field.
+
+Values are whatever the catalog was filled with: "50 MP", "50MP + 12MP + 5MP",
+"108+12+2", "2x12 MP", "Dual 12 MP" or "48 MP (wide), 12 MP (ultrawide),
+front 32 MP".
+The phone scoring needs numbers, so Phone.save() keeps the main (largest)
+rear sensor and the number of rear lenses in camera_main_mp/camera_count.
+"""
+import re
+
+# "2x12", "2 × 12" or "dual 12": that many sensors of the same size
+_NUMBER = r"(?:(\d+)\s*[x×]\s*|\b(dual|triple|quad|penta)[\s-]*)?(\d+(?:[.,]\d+)?)"
+_WITH_UNIT = re.compile(_NUMBER + r"\s*(?:mp|мп|megapixels?)", re.IGNORECASE)
+_BARE = re.compile(_NUMBER)
+# everything after this is the selfie camera
+_FRONT = re.compile(r"front|selfie|фронт", re.IGNORECASE)
+
+_WORDS = {"dual": 2, "triple": 3, "quad": 4, "penta": 5}
+
+# bigger values are typos or resolutions, not phone sensors
+MAX_MP = 250
+MAX_LENSES = 8
+
+
+def parse_camera_mp(text):
+    """(main sensor MP, rear lens count), or (None, None) if text has no sensors"""
+    if not text:
+        return None, None
+    rear = _FRONT.split(text, maxsplit=1)[0]
+    # only trust unitless numbers when nothing is marked as MP
+    matches = _WITH_UNIT.findall(rear) or _BARE.findall(rear)
+
+    sensors = []
+    for count, word, value in matches:
+        mp = float(value.replace(",", "."))
+        if 0 < mp <= MAX_MP:
+            count = int(count) if count else _WORDS.get(word.lower(), 1)
+            sensors.extend([mp] * min(count, MAX_LENSES))
+    if not sensors:
+        return None, None
+    return max(sensors), min(len(sensors), MAX_LENSES)
+
+
+def refresh_camera_fields(queryset, batch_size: int = 1000) -> int:
+    """Re-parse camera_mp for rows written without Phone.save() (bulk loads);
+    returns the number of rows that changed"""
+    changed = []
+    rows = queryset.order_by("pk").values_list("pk", "camera_mp", "camera_main_mp", "camera_count")
+    for pk, text, main_mp, count in rows.iterator(chunk_size=batch_size):
+        parsed = parse_camera_mp(text)
+        if parsed != (main_mp, count):
+            changed.append(queryset.model(pk=pk, camera_main_mp=parsed[0], camera_count=parsed[1]))
+    queryset.model.objects.bulk_update(changed, ["camera_main_mp", "camera_count"], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,64 @@
+"""
+Write counters for the catalog tables.
+
+Every save/delete bumps the model's counter in the shared cache. Anything a
+process builds from a whole table (scales, score matrices, sorted indexes)
+remembers the counter it was built at and is rebuilt once the counter moves.
+A write of a single row also logs its pk under the new counter for a while,
+so a structure that can take single rows in (similar.py) catches up on just
+those rows instead.
+"""
+import time
+
+from django.core.cache import cache
+
+# seconds a process reuses a counter it has read from the shared cache
+VERSION_TTL = 1
+# seconds the pk written at a version stays in the change log
+CHANGE_TTL = 60 * 60
+# more versions behind than this and a process rebuilds instead
+MAX_CHANGES = 500
+
+_local = {}
+
+
+def _version_key(model):
+    return f"catalog:{model._meta.label_lower}:version"
+
+
+def catalog_version(model) -> int:
+    entry = _local.get(model)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    version = cache.get(_version_key(model), 0)
+    _local[model] = (time.monotonic() + VERSION_TTL, version)
+    return version
+
+
+def _change_key(model, version):
+    return f"catalog:{model._meta.label_lower}:change:{version}"
+
+
+def bump_catalog_version(model, pk=None) -> int:
+    """Bump the counter; pk is the one row written, if it was just one"""
+    key = _version_key(model)
+    if cache.add(key, 1, None):
+        version = 1
+    else:
+        version = cache.incr(key)
+    if pk is not None:
+        cache.set(_change_key(model, version), pk, CHANGE_TTL)
+    _local[model] = (time.monotonic() + VERSION_TTL, version)
+    return version
+
+
+def changed_pks(model, since: int, until: int):
+    """pks written after version since up to until, or None if the change log
+    does not cover all of them (a bulk write, expired entries, too many)"""
+    if until - since > MAX_CHANGES:
+        return None
+    keys = [_change_key(model, version) for version in range(since + 1, until + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return None
+    return set(found.values())
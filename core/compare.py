@@ -1,6 +1,13 @@
-from django.db.models import Max, Min, Avg
+import hashlib
+import json
+
+import numpy as np
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from core.models import CPU, GPU, RAM, Needs
+from core.catalog import catalog_version
+from core.engine import Feature, fields, matrix_from_objects, matrix_from_rows, normalize, score, weight_vector
+from core.models import CPU, GPU, RAM, Phone
+from core.scales import get_scales
 
 WEIGHTS = {
     "core_count": 0.25,
@@ -10,48 +17,35 @@ WEIGHTS = {
     "tdp_efficiency": 0.15,
 }
 
+CPU_FEATURES = (
+    Feature("core_count", "cc", "core_count"),
+    Feature("clock_speed_ghz", "cs", "clock_speed"),
+    Feature("ipc", "ipc", "ipc"),
+    Feature("thread_count", "tc", "thread_count"),
+    Feature("tdp_watts", "tdp", "tdp_efficiency", invert=True),
+)
 
-def _normalize(value, min_v, max_v):
-    if max_v == min_v:
-        return 100.0
-    return 100 * (value - min_v) / (max_v - min_v)
-
-
-def _build_scales():
-    aggs = CPU.objects.aggregate(
-        min_cc=Min("core_count"), max_cc=Max("core_count"),
-        min_cs=Min("clock_speed_ghz"), max_cs=Max("clock_speed_ghz"),
-        min_ipc=Min("ipc"), max_ipc=Max("ipc"),
-        min_tc=Min("thread_count"), max_tc=Max("thread_count"),
-        min_tdp=Min("tdp_watts"), max_tdp=Max("tdp_watts"),
-    )
-    return aggs
 
-
-def _cpu_index(cpu: CPU, scales: dict) -> float:
-    cc = _normalize(cpu.core_count, scales["min_cc"], scales["max_cc"])
-    cs = _normalize(cpu.clock_speed_ghz, scales["min_cs"], scales["max_cs"])
-    ipc = _normalize(cpu.ipc, scales["min_ipc"], scales["max_ipc"])
-    tc = _normalize(cpu.thread_count, scales["min_tc"], scales["max_tc"])
-    tdp = 100 - _normalize(cpu.tdp_watts, scales["min_tdp"], scales["max_tdp"])
-
-    return (cc * WEIGHTS["core_count"] +
-            cs * WEIGHTS["clock_speed"] +
-            ipc * WEIGHTS["ipc"] +
-            tc * WEIGHTS["thread_count"] +
-            tdp * WEIGHTS["tdp_efficiency"])
+def _cpu_row(cpu: CPU, idx: float) -> dict:
+    return {
+        "name": cpu.name,
+        "clock_speed_ghz": float(cpu.clock_speed_ghz),
+        "core_count": cpu.core_count,
+        "thread_count": cpu.thread_count,
+        "tdp_watts": cpu.tdp_watts,
+        "ipc": float(cpu.ipc),
+        "performance_index": round(idx, 2),
+    }
 
 
 def get_cpu_comparison_json(cpu1_name: str, cpu2_name: str):
     try:
         cpu1 = CPU.objects.get(name=cpu1_name)
         cpu2 = CPU.objects.get(name=cpu2_name)
-    except ObjectDoesNotExist as e:
+    except ObjectDoesNotExist:
         return None
 
-    scales = _build_scales()
-    idx1 = _cpu_index(cpu1, scales)
-    idx2 = _cpu_index(cpu2, scales)
+    idx1, idx2 = performance_indexes(CPU, [cpu1, cpu2])
 
     if idx1 > idx2:
         winner, reasoning = cpu1.name, f"{cpu1.name} wins (index {idx1:.1f} vs {idx2:.1f})"
@@ -60,26 +54,7 @@ def get_cpu_comparison_json(cpu1_name: str, cpu2_name: str):
     else:
         winner, reasoning = "Tie", "Both CPUs show equal performance index"
 
-    comparison = [
-        {
-            "name": cpu1.name,
-            "clock_speed_ghz": float(cpu1.clock_speed_ghz),
-            "core_count": cpu1.core_count,
-            "thread_count": cpu1.thread_count,
-            "tdp_watts": cpu1.tdp_watts,
-            "ipc": float(cpu1.ipc),
-            "performance_index": round(idx1, 2),
-        },
-        {
-            "name": cpu2.name,
-            "clock_speed_ghz": float(cpu2.clock_speed_ghz),
-            "core_count": cpu2.core_count,
-            "thread_count": cpu2.thread_count,
-            "tdp_watts": cpu2.tdp_watts,
-            "ipc": float(cpu2.ipc),
-            "performance_index": round(idx2, 2),
-        }
-    ]
+    comparison = [_cpu_row(cpu1, idx1), _cpu_row(cpu2, idx2)]
 
     return {
         "winner": winner,
@@ -96,34 +71,25 @@ GPU_WEIGHTS = {
     "ray_tracing": 0.10,
 }
 
-
-def _gpu_norm(value, min_v, max_v):
-    if max_v == min_v:
-        return 100.0
-    return 100 * (value - min_v) / (max_v - min_v)
-
-
-def _gpu_scales():
-    return GPU.objects.aggregate(
-        min_cc=Min("core_count"), max_cc=Max("core_count"),
-        min_ck=Min("core_clock_ghz"), max_ck=Max("core_clock_ghz"),
-        min_bw=Min("memory_bandwidth_gbps"), max_bw=Max("memory_bandwidth_gbps"),
-        min_vram=Min("vram_gb"), max_vram=Max("vram_gb"),
-    )
+GPU_FEATURES = (
+    Feature("core_count", "cc", "core_count"),
+    Feature("core_clock_ghz", "ck", "core_clock"),
+    Feature("memory_bandwidth_gbps", "bw", "memory_bandwidth"),
+    Feature("vram_gb", "vram", "vram"),
+    Feature("ray_tracing_support", (0, 1), "ray_tracing"),
+)
 
 
-def _gpu_index(gpu: GPU, scales: dict) -> float:
-    cc = _gpu_norm(gpu.core_count, scales["min_cc"], scales["max_cc"])
-    ck = _gpu_norm(gpu.core_clock_ghz, scales["min_ck"], scales["max_ck"])
-    bw = _gpu_norm(gpu.memory_bandwidth_gbps, scales["min_bw"], scales["max_bw"])
-    vram = _gpu_norm(gpu.vram_gb, scales["min_vram"], scales["max_vram"])
-    rt = 100.0 if gpu.ray_tracing_support else 0.0
-
-    return (cc * GPU_WEIGHTS["core_count"] +
-            ck * GPU_WEIGHTS["core_clock"] +
-            bw * GPU_WEIGHTS["memory_bandwidth"] +
-            vram * GPU_WEIGHTS["vram"] +
-            rt * GPU_WEIGHTS["ray_tracing"])
+def _gpu_row(gpu: GPU, idx: float) -> dict:
+    return {
+        "name": gpu.name,
+        "vram_gb": float(gpu.vram_gb),
+        "core_count": gpu.core_count,
+        "core_clock_ghz": float(gpu.core_clock_ghz),
+        "memory_bandwidth_gbps": float(gpu.memory_bandwidth_gbps),
+        "ray_tracing_support": gpu.ray_tracing_support,
+        "performance_index": round(idx, 2),
+    }
 
 
 def get_gpu_comparison_json(gpu1_name: str, gpu2_name: str):
@@ -133,9 +99,7 @@ def get_gpu_comparison_json(gpu1_name: str, gpu2_name: str):
     except ObjectDoesNotExist:
         return None
 
-    scales = _gpu_scales()
-    idx1 = _gpu_index(gpu1, scales)
-    idx2 = _gpu_index(gpu2, scales)
+    idx1, idx2 = performance_indexes(GPU, [gpu1, gpu2])
 
     if idx1 > idx2:
         winner, reasoning = gpu1.name, f"{gpu1.name} wins (index {idx1:.1f} vs {idx2:.1f})"
@@ -144,26 +108,7 @@ def get_gpu_comparison_json(gpu1_name: str, gpu2_name: str):
     else:
         winner, reasoning = "Tie", "Both GPUs show equal performance index"
 
-    comparison = [
-        {
-            "name": gpu1.name,
-            "vram_gb": float(gpu1.vram_gb),
-            "core_count": gpu1.core_count,
-            "core_clock_ghz": float(gpu1.core_clock_ghz),
-            "memory_bandwidth_gbps": float(gpu1.memory_bandwidth_gbps),
-            "ray_tracing_support": gpu1.ray_tracing_support,
-            "performance_index": round(idx1, 2),
-        },
-        {
-            "name": gpu2.name,
-            "vram_gb": float(gpu2.vram_gb),
-            "core_count": gpu2.core_count,
-            "core_clock_ghz": float(gpu2.core_clock_ghz),
-            "memory_bandwidth_gbps": float(gpu2.memory_bandwidth_gbps),
-            "ray_tracing_support": gpu2.ray_tracing_support,
-            "performance_index": round(idx2, 2),
-        }
-    ]
+    comparison = [_gpu_row(gpu1, idx1), _gpu_row(gpu2, idx2)]
 
     return {
         "winner": winner,
@@ -184,27 +129,21 @@ TYPE_SCORES = {
     "DDR5": 100
 }
 
-
-def _norm(val, min_v, max_v):
-    if max_v == min_v:
-        return 100.0
-    return 100 * (val - min_v) / (max_v - min_v)
-
-
-def _ram_scales():
-    return RAM.objects.aggregate(
-        min_sz=Min("size_gb"),
-        max_sz=Max("size_gb"),
-        min_sp=Min("speed_mhz"),
-        max_sp=Max("speed_mhz")
-    )
+RAM_FEATURES = (
+    Feature("size_gb", "sz", "size"),
+    Feature("speed_mhz", "sp", "speed"),
+    Feature("type", (0, 100), "type_score", encode=lambda t: TYPE_SCORES.get(t, 0)),
+)
 
 
-def _ram_index(ram, scales):
-    sz = _norm(ram.size_gb, scales["min_sz"], scales["max_sz"])
-    sp = _norm(ram.speed_mhz, scales["min_sp"], scales["max_sp"])
-    tp = TYPE_SCORES.get(ram.type, 0)
-    return sz * RAM_WEIGHTS["size"] + sp * RAM_WEIGHTS["speed"] + tp * RAM_WEIGHTS["type_score"]
+def _ram_row(ram, idx):
+    return {
+        "name": ram.name,
+        "size": ram.size_gb,
+        "speed": ram.speed_mhz,
+        "type": ram.type,
+        "performance_index": round(idx, 2)
+    }
 
 
 def get_ram_comparison_json(ram1_name, ram2_name):
@@ -214,9 +153,7 @@ def get_ram_comparison_json(ram1_name, ram2_name):
     except ObjectDoesNotExist:
         return None
 
-    scales = _ram_scales()
-    i1 = _ram_index(r1, scales)
-    i2 = _ram_index(r2, scales)
+    i1, i2 = performance_indexes(RAM, [r1, r2])
 
     if i1 > i2:
         w, msg = r1.name, f"{r1.name} wins (index {i1:.1f} vs {i2:.1f})"
@@ -228,20 +165,260 @@ def get_ram_comparison_json(ram1_name, ram2_name):
     return {
         "winner": w,
         "reasoning": msg,
-        "comparison": [
-            {
-                "name": r1.name,
-                "size": r1.size_gb,
-                "speed": r1.speed_mhz,
-                "type": r1.type,
-                "performance_index": round(i1, 2)
-            },
-            {
-                "name": r2.name,
-                "size": r2.size_gb,
-                "speed": r2.speed_mhz,
-                "type": r2.type,
-                "performance_index": round(i2, 2)
-            }
-        ]
+        "comparison": [_ram_row(r1, i1), _ram_row(r2, i2)]
+    }
+
+
+# =====Phones=====
+PHONE_WEIGHTS = {
+    "ram": 0.15,
+    "memory": 0.10,
+    "year": 0.15,
+    "brand": 0.10,
+    "camera": 0.20,
+    "lenses": 0.05,
+    "battery": 0.25,
+}
+
+# the per-area scores of a phone comparison, over the same features
+PHONE_AREA_WEIGHTS = {
+    "performance": {**dict.fromkeys(PHONE_WEIGHTS, 0.0), "ram": 0.40, "memory": 0.20, "year": 0.25, "brand": 0.15},
+    "camera": {**dict.fromkeys(PHONE_WEIGHTS, 0.0), "camera": 0.75, "lenses": 0.25},
+    "battery": {**dict.fromkeys(PHONE_WEIGHTS, 0.0), "battery": 1.0},
+}
+
+# a missing spec scores 0 on its axis
+PHONE_FEATURES = (
+    Feature("ram_size", "ram", "ram"),
+    Feature("memory_size", "mem", "memory"),
+    Feature("year", "yr", "year"),
+    Feature("brand__coefficient", "brand", "brand"),
+    Feature("camera_main_mp", "cam", "camera"),
+    Feature("camera_count", "lens", "lenses"),
+    Feature("battery", "bat", "battery"),
+)
+
+
+def phone_area_scores(phones) -> dict:
+    """{"performance"|"camera"|"battery": scores} for phones (with brands loaded)"""
+    points = normalize(matrix_from_objects(phones, PHONE_FEATURES), PHONE_FEATURES, get_scales(Phone))
+    return {area: points @ weight_vector(PHONE_FEATURES, weights) for area, weights in PHONE_AREA_WEIGHTS.items()}
+
+
+def _phone_verdict(overall):
+    if overall >= 70:
+        return "Flagship-class all-rounder"
+    if overall >= 45:
+        return "Solid mid-range choice"
+    return "Budget option"
+
+
+def _phone_specs(phone):
+    return {
+        "performance": f"{phone.ram_size or '?'} GB RAM, {phone.memory_size or '?'} GB storage, {phone.year or 'unknown year'}",
+        "camera": (f"{phone.camera_main_mp:g} MP main camera, {phone.camera_count} rear lens(es)"
+                   if phone.camera_main_mp else "unknown camera"),
+        "battery": f"{phone.battery} mAh battery" if phone.battery else "unknown battery",
+    }
+
+
+def _phone_entry(label, phone, scores, other_scores):
+    specs = _phone_specs(phone)
+    strengths, weaknesses = [], []
+    for area in PHONE_AREA_WEIGHTS:
+        if scores[area] > other_scores[area]:
+            strengths.append(f"Better {area} ({scores[area]:.1f} vs {other_scores[area]:.1f}): {specs[area]}")
+        elif scores[area] < other_scores[area]:
+            weaknesses.append(f"Weaker {area} ({scores[area]:.1f} vs {other_scores[area]:.1f}): {specs[area]}")
+    best = max(PHONE_AREA_WEIGHTS, key=lambda area: scores[area])
+    return {
+        "phone_name": label,
+        "overall_score": round(scores["overall"], 1),
+        "performance_score": round(scores["performance"], 1),
+        "camera_score": round(scores["camera"], 1),
+        "battery_score": round(scores["battery"], 1),
+        "recommendation": f"{_phone_verdict(scores['overall'])}, strongest on {best}",
+        "strengths": strengths,
+        "weaknesses": weaknesses,
+    }
+
+
+def get_phone_score_json(phone1_name: str, phone2_name: str):
+    """Local equivalent of ai.get_phone_comparison_json; None if a phone is missing"""
+    found = {}
+    for phone in Phone.objects.select_related("brand").filter(name__in=[phone1_name, phone2_name]).order_by("pk"):
+        found.setdefault(phone.name, phone)
+    if phone1_name not in found or phone2_name not in found:
+        return None
+
+    phones = [found[phone1_name], found[phone2_name]]
+    areas = phone_area_scores(phones)
+    overall = performance_indexes(Phone, phones)
+    scores = [{"overall": float(overall[i]), **{area: float(s[i]) for area, s in areas.items()}} for i in range(2)]
+
+    phone1 = _phone_entry("Phone1", phones[0], scores[0], scores[1])
+    phone2 = _phone_entry("Phone2", phones[1], scores[1], scores[0])
+
+    if phone1["overall_score"] > phone2["overall_score"]:
+        winner, loser, name = phone1, phone2, phones[0].name
+    elif phone2["overall_score"] > phone1["overall_score"]:
+        winner, loser, name = phone2, phone1, phones[1].name
+    else:
+        winner = None
+
+    if winner is None:
+        reasoning = f"Both phones score {phone1['overall_score']:.1f} overall"
+    else:
+        reasoning = (f"{winner['phone_name']} ({name}) scores {winner['overall_score']:.1f} vs "
+                     f"{loser['overall_score']:.1f} overall (performance {winner['performance_score']:.1f} vs "
+                     f"{loser['performance_score']:.1f}, camera {winner['camera_score']:.1f} vs "
+                     f"{loser['camera_score']:.1f}, battery {winner['battery_score']:.1f} vs "
+                     f"{loser['battery_score']:.1f})")
+
+    return {
+        "comparison": [phone1, phone2],
+        "winner": winner["phone_name"] if winner else "Tie",
+        "reasoning": reasoning,
+        "source": "local",
     }
+
+
+# =====N-way comparison=====
+MAX_COMPARE = 50
+
+
+def _multi_comparison(model, names, row, label):
+    """Rank names of model with one query and one vectorized scoring pass.
+
+    Returns (data, missing names); data is None when any name is missing.
+    """
+    names = list(dict.fromkeys(names))
+    found = {}
+    for obj in model.objects.filter(name__in=names).order_by("pk"):
+        found.setdefault(obj.name, obj)
+    missing = [name for name in names if name not in found]
+    if missing:
+        return None, missing
+
+    objs = [found[name] for name in names]
+    idx = np.asarray(performance_indexes(model, objs), dtype=np.float64)
+    order = np.argsort(-idx, kind="stable").tolist()
+    ranking = [dict(row(objs[i], float(idx[i])), rank=r + 1) for r, i in enumerate(order)]
+
+    best = ranking[0]
+    if len(order) > 1 and idx[order[0]] == idx[order[1]]:
+        winner, reasoning = "Tie", f"Top {label} show equal performance index"
+    elif len(ranking) > 1:
+        runner_up = ranking[1]
+        winner = best["name"]
+        reasoning = (f"{best['name']} ranks first (index {best['performance_index']:.1f}, "
+                     f"{best['performance_index'] - runner_up['performance_index']:.1f} ahead of {runner_up['name']})")
+    else:
+        winner, reasoning = best["name"], f"Only one {label[:-1]} compared"
+
+    return {
+        "winner": winner,
+        "reasoning": reasoning,
+        "ranking": ranking,
+        "names": names,
+        # deltas[i][j] = index of names[i] minus index of names[j]
+        "deltas": np.round(idx[:, None] - idx[None, :], 2).tolist(),
+    }, []
+
+
+def get_cpu_multi_comparison_json(names):
+    return _multi_comparison(CPU, names, _cpu_row, "CPUs")
+
+
+def get_gpu_multi_comparison_json(names):
+    return _multi_comparison(GPU, names, _gpu_row, "GPUs")
+
+
+def get_ram_multi_comparison_json(names):
+    return _multi_comparison(RAM, names, _ram_row, "RAMs")
+
+
+# =====Batch scoring=====
+INDEX_VERSION_KEY = "performance-index:{}:version"
+
+# model -> (features, weights, every table the score depends on)
+SCORING = {
+    CPU: (CPU_FEATURES, WEIGHTS, (WEIGHTS,)),
+    GPU: (GPU_FEATURES, GPU_WEIGHTS, (GPU_WEIGHTS,)),
+    RAM: (RAM_FEATURES, RAM_WEIGHTS, (RAM_WEIGHTS, TYPE_SCORES)),
+    Phone: (PHONE_FEATURES, PHONE_WEIGHTS, (PHONE_WEIGHTS,)),
+}
+
+_catalog = {}
+
+
+def score_objects(model, objs) -> np.ndarray:
+    features, weights, _ = SCORING[model]
+    return score(matrix_from_objects(objs, features), features, get_scales(model), weights)
+
+
+def score_rows(model, rows) -> np.ndarray:
+    """Scores for values_list(*feature fields) rows of model"""
+    features, weights, _ = SCORING[model]
+    return score(matrix_from_rows(rows, features), features, get_scales(model), weights)
+
+
+def catalog_key(model):
+    """Identifies the table contents and scoring a cached structure was built from"""
+    return catalog_version(model), index_version(model)
+
+
+def catalog_scores(model):
+    """(pks, feature matrix, scores) for the whole table, sorted by pk.
+
+    Loaded once per catalog version and scoring version and then served from
+    process memory.
+    """
+    key = catalog_key(model)
+    entry = _catalog.get(model)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    features, weights, _ = SCORING[model]
+    rows = list(model.objects.order_by("pk").values_list("pk", *fields(features)))
+    pks = np.array([row[0] for row in rows], dtype=np.int64)
+    matrix = matrix_from_rows((row[1:] for row in rows), features)
+    data = (pks, matrix, score(matrix, features, get_scales(model), weights))
+    _catalog[model] = (key, data)
+    return data
+
+
+def catalog_subset(model, ids=None):
+    """(pks, scores) for the whole catalog, or for those ids that exist (in the given order)"""
+    pks, _, scores = catalog_scores(model)
+    if ids is None:
+        return pks, scores
+    wanted = np.asarray(ids, dtype=np.int64)
+    if not len(pks):
+        return wanted[:0], scores[:0]
+    pos = np.clip(np.searchsorted(pks, wanted), 0, len(pks) - 1)
+    found = pks[pos] == wanted
+    return wanted[found], scores[pos[found]]
+
+
+def index_version(model) -> str:
+    """Fingerprint of everything a stored performance_index was computed from"""
+    _, _, tables = SCORING[model]
+    scales = {k: None if v is None else float(v) for k, v in get_scales(model).items()}
+    payload = json.dumps([scales, tables], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def stored_index_version(model):
+    return cache.get(INDEX_VERSION_KEY.format(model._meta.label_lower))
+
+
+def index_is_current(model) -> bool:
+    return stored_index_version(model) == index_version(model)
+
+
+def performance_indexes(model, objs) -> list:
+    """Stored indexes while they are current, otherwise scored on the fly"""
+    if index_is_current(model):
+        return [obj.performance_index for obj in objs]
+    return score_objects(model, objs).tolist()
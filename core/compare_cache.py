@@ -0,0 +1,177 @@
+"""
+Order-independent cache for the pairwise compare endpoints.
+
+compare_cpu/A/B and compare_cpu/B/A are the same comparison, and "Intel  i5",
+"intel i5" and "intel%20i5" the same CPU. Names are decoded, whitespace- and
+case-normalized and resolved to primary keys; the key holds the two sides
+sorted by pk plus the catalog/scoring versions of the models involved, so
+writes to the catalog invalidate it. CPU/GPU/RAM results are stored oriented
+to the sorted sides and flipped back (comparison[] reversed) when the request
+asked for the other order. PC and phone results call the sides PC1/PC2 and
+Phone1/Phone2, in the reasoning and the LLM's wording too, so each order of
+those is cached under a key of its own.
+
+Every resolved request also bumps the pair in a per-kind Redis sorted set,
+capped at COMPARE_POPULAR_MAX pairs, which `manage.py warm_compare_cache`
+reads to refill the cache after a deploy or a flush.
+"""
+import copy
+import hashlib
+import json
+import string
+import urllib.parse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from django_redis import get_redis_connection
+
+from core.catalog import catalog_version
+from core.compare import SCORING, catalog_key
+
+# results that label the sides (PC1/PC2, Phone1/Phone2) and cannot be flipped
+LABELLED = {"pc", "phone"}
+
+POPULAR_KEY = "compare:popular:{}"
+
+# Lower() is ASCII-only on SQLite and full Unicode elsewhere; names are looked up both ways
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def canonical_name(name: str) -> str:
+    return " ".join(urllib.parse.unquote(name or "").split()).casefold()
+
+
+def resolve(model, name):
+    """(pk, stored name) for a name as it came in the URL, or None; the
+    lowest pk wins duplicates"""
+    decoded = urllib.parse.unquote(name or "")
+    spaced = " ".join(decoded.split())
+    candidates = {value for text in (spaced, decoded) for value in (text.lower(), text.translate(ASCII_LOWER))}
+    wanted = canonical_name(name)
+    rows = (model.objects.annotate(name_lower=Lower("name")).filter(name_lower__in=candidates)
+            .order_by("pk").values_list("pk", "name"))
+    return next((row for row in rows if canonical_name(row[1]) == wanted), None)
+
+
+def _version(model):
+    return catalog_key(model) if model in SCORING else catalog_version(model)
+
+
+def _prepare(kind, models, side1, side2, extra):
+    """(cache key, flipped, stored names of both sides in the requested order),
+    or None if a name does not resolve"""
+    resolved = [[resolve(model, name) for model, name in zip(models, side)] for side in (side1, side2)]
+    if any(found is None for side in resolved for found in side):
+        return None
+    pks = [tuple(found[0] for found in side) for side in resolved]
+    names = [tuple(found[1] for found in side) for side in resolved]
+    sides = pks if kind in LABELLED else sorted(pks)
+    payload = json.dumps([[_version(model) for model in dict.fromkeys(models)], sides, list(extra)])
+    key = f"compare:{kind}:{hashlib.sha1(payload.encode()).hexdigest()}"
+    return key, sides != pks, names
+
+
+def reorient(kind: str, body: dict) -> dict:
+    """CPU/GPU/RAM body as if the two sides had been requested the other way
+    round; their rows name the components, so only comparison[] moves"""
+    if kind in LABELLED:
+        raise ValueError(f"{kind} results name their sides and are cached per order")
+    body = copy.deepcopy(body)
+    if isinstance(body.get("comparison"), list):
+        body["comparison"].reverse()
+    return body
+
+
+def _record(kind, names, flipped, extra):
+    # counted in the cached orientation so A/B and B/A add up where they share an entry
+    member = json.dumps([list(names[::-1] if flipped else names), list(extra)])
+    key = POPULAR_KEY.format(kind)
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        pipe.zincrby(key, 1, member)
+        # drop the least requested pairs beyond the cap
+        pipe.zremrangebyrank(key, 0, -settings.COMPARE_POPULAR_MAX - 1)
+        pipe.execute()
+    except Exception as e:
+        print(f"Could not record compare popularity: {e}")
+
+
+def popular(kind: str, limit: int) -> list:
+    """The limit most requested (sides, extra, count) of kind, most requested first"""
+    entries = get_redis_connection("default").zrevrange(POPULAR_KEY.format(kind), 0, limit - 1, withscores=True)
+    result = []
+    for member, count in entries:
+        sides, extra = json.loads(member)
+        result.append(([tuple(side) for side in sides], tuple(extra), int(count)))
+    return result
+
+
+def is_cached(kind: str, models, side1, side2, extra=()) -> bool:
+    prepared = _prepare(kind, models, side1, side2, extra)
+    return prepared is not None and cache.has_key(prepared[0])
+
+
+def _cacheable(status, body) -> bool:
+    return status == 200 and isinstance(body, dict) and not body.get("degraded")
+
+
+def compare(kind: str, models, side1, side2, compute, extra=(), record: bool = True):
+    """(HTTP status, body) of compute(side1 names, side2 names), cached
+    (for both orders of the sides at once unless kind is LABELLED).
+
+    models holds the model of each position in a side ((CPU,) for a CPU,
+    (CPU, GPU, RAM) for a PC) and side1/side2 the names as requested. compute
+    gets the stored names; extra is whatever else the result depends on.
+    record=False leaves the popularity counts alone (the cache warmer).
+    """
+    prepared = _prepare(kind, models, side1, side2, extra)
+    if prepared is None:
+        # let compute report the missing names
+        return compute(tuple(side1), tuple(side2))
+    key, flipped, names = prepared
+    if record:
+        _record(kind, names, flipped, extra)
+
+    hit = cache.get(key)
+    if hit is not None:
+        status, body = hit
+        return status, reorient(kind, body) if flipped else body
+
+    status, body = compute(*names)
+    if _cacheable(status, body):
+        cache.set(key, (status, reorient(kind, body) if flipped else body), settings.COMPARE_CACHE_TTL)
+    return status, body
+
+
+async def acompare(kind: str, models, side1, side2, compute, extra=()):
+    """compare() for async views; compute is a coroutine function"""
+    prepared = await sync_to_async(_prepare)(kind, models, side1, side2, extra)
+    if prepared is None:
+        return await compute(tuple(side1), tuple(side2))
+    key, flipped, names = prepared
+    await sync_to_async(_record, thread_sensitive=False)(kind, names, flipped, extra)
+
+    hit = await cache.aget(key)
+    if hit is not None:
+        status, body = hit
+        return status, reorient(kind, body) if flipped else body
+
+    status, body = await compute(*names)
+    if _cacheable(status, body):
+        await cache.aset(key, (status, reorient(kind, body) if flipped else body), settings.COMPARE_CACHE_TTL)
+    return status, body
+
+
+def pair_compute(compare_json, error: str):
+    """compute for the single-component endpoints, whose compare_json(name1,
+    name2) returns the comparison or None"""
+    def compute(side1, side2):
+        data = compare_json(side1[0], side2[0])
+        return (400, {"error": error}) if data is None else (200, data)
+    return compute
+
+
+def compare_pair(kind: str, model, name1: str, name2: str, compare_json, error: str):
+    return compare(kind, (model,), (name1,), (name2,), pair_compute(compare_json, error))
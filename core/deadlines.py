@@ -0,0 +1,95 @@
+"""
+Per-request deadline.
+
+DeadlineMiddleware gives every request a budget: the X-Request-Timeout
+header (seconds, at most REQUEST_DEADLINE_MAX and at least
+REQUEST_DEADLINE_RESERVE + MIN_QUERY_BUDGET) or REQUEST_DEADLINE. It is
+kept in a context variable, so it follows the request into sync_to_async
+threads, async tasks and the hedging pool, and whatever may wait sizes the
+wait from what is left: the OpenRouter timeouts and retries (llm_client.py),
+the rate limiter and admission queues, and the wait for a completion another
+worker is fetching (llm_cache.py).
+
+Once the budget is spent, an OpenRouter call raises DeadlineExceeded, a
+LLMUnavailable, so the compare views answer with their local scores (degraded)
+instead of running into the proxy's timeout. A database query raises it
+too, and the middleware answers 504. The last REQUEST_DEADLINE_RESERVE
+seconds of the budget are kept back to build the answer from what is there.
+
+Code outside a request (management commands, the job worker, responses that
+stream) has no deadline.
+"""
+import contextvars
+import math
+import time
+
+from django.conf import settings
+
+from core.breaker import LLMUnavailable
+
+HEADER = "X-Request-Timeout"
+# seconds a request gets for its queries however little a client asks for,
+# so a small X-Request-Timeout degrades to the local scores instead of a 504
+MIN_QUERY_BUDGET = 1
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(LLMUnavailable):
+    """The request's time budget is spent"""
+
+    def __init__(self):
+        super().__init__("Request deadline exceeded", 1)
+
+
+def request_budget(request) -> float:
+    """Seconds the request may take: its X-Request-Timeout or REQUEST_DEADLINE"""
+    try:
+        budget = float(request.headers.get(HEADER, settings.REQUEST_DEADLINE))
+    except ValueError:
+        budget = settings.REQUEST_DEADLINE
+    if not math.isfinite(budget):
+        budget = settings.REQUEST_DEADLINE
+    floor = settings.REQUEST_DEADLINE_RESERVE + MIN_QUERY_BUDGET
+    return max(min(budget, settings.REQUEST_DEADLINE_MAX), floor)
+
+
+def start(budget: float):
+    """Set the deadline budget seconds (less the reserve) from now; returns
+    the token for end"""
+    return _deadline.set(time.monotonic() + budget - settings.REQUEST_DEADLINE_RESERVE)
+
+
+def end(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left, or None without a deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def cap(seconds: float) -> float:
+    """seconds, or what is left of the budget if that is less"""
+    left = remaining()
+    return seconds if left is None else min(seconds, left)
+
+
+def check(min_left: float = 0.0):
+    """Raise DeadlineExceeded unless more than min_left seconds are left"""
+    left = remaining()
+    if left is not None and left <= min_left:
+        raise DeadlineExceeded()
+
+
+# =====Database=====
+def _check_query(execute, sql, params, many, context):
+    check()
+    return execute(sql, params, many, context)
+
+
+def install_db_check(sender, connection, **kwargs):
+    """connection_created receiver: no query starts after the deadline"""
+    if _check_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_check_query)
@@ -0,0 +1,82 @@
+"""
+Vectorized scoring for the compare.py indexes.
+
+Rows are loaded into a contiguous float64 matrix with one column per
+feature, normalized against the scales in one pass and scored with a single
+matrix-vector product against the weight vector, so scoring a whole table
+costs the same few array operations as scoring a pair.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# field: model attribute / column (brand__coefficient style paths follow relations)
+# scale: key into the scales dict (min_<scale>/max_<scale>) or a fixed (min, max)
+# weight: key into the weights dict
+# invert: lower raw values score higher
+# encode: maps the raw value to a number before scaling
+Feature = namedtuple("Feature", "field scale weight invert encode", defaults=(False, None))
+
+
+def fields(features) -> list:
+    return [f.field for f in features]
+
+
+def matrix_from_rows(rows, features) -> np.ndarray:
+    """Matrix from value tuples ordered like features (e.g. values_list rows)"""
+    rows = list(rows)
+    matrix = np.empty((len(rows), len(features)), dtype=np.float64)
+    for j, feature in enumerate(features):
+        column = [row[j] for row in rows]
+        if feature.encode is not None:
+            column = [feature.encode(v) for v in column]
+        # None (a NULL column) becomes NaN
+        matrix[:, j] = np.array(column, dtype=np.float64)
+    return matrix
+
+
+def value(obj, field):
+    """obj's value for a field or a brand__coefficient style path"""
+    for name in field.split("__"):
+        obj = getattr(obj, name)
+    return obj
+
+
+def matrix_from_objects(objs, features) -> np.ndarray:
+    return matrix_from_rows(([value(obj, f.field) for f in features] for obj in objs), features)
+
+
+def bounds(features, scales):
+    lo = np.empty(len(features))
+    hi = np.empty(len(features))
+    for j, feature in enumerate(features):
+        if isinstance(feature.scale, tuple):
+            lo[j], hi[j] = feature.scale
+        else:
+            lo[j] = scales[f"min_{feature.scale}"] or 0
+            hi[j] = scales[f"max_{feature.scale}"] or 0
+    return lo, hi
+
+
+def normalize(matrix, features, scales) -> np.ndarray:
+    """0-100 per feature; a column with no spread scores 100 (0 if inverted)
+    and a missing value (NaN) scores 0"""
+    lo, hi = bounds(features, scales)
+    span = hi - lo
+    flat = span == 0
+    missing = np.isnan(matrix)
+    out = 100 * (matrix - lo) / np.where(flat, 1, span)
+    out[:, flat] = 100.0
+    invert = np.array([f.invert for f in features], dtype=bool)
+    out[:, invert] = 100 - out[:, invert]
+    # after the flat columns, which would otherwise fill their gaps with 100
+    out[missing] = 0.0
+    return out
+
+
+def weight_vector(features, weights) -> np.ndarray:
+    return np.array([weights[f.weight] for f in features], dtype=np.float64)
+
+
+def score(matrix, features, scales, weights) -> np.ndarray:
+    return normalize(matrix, features, scales) @ weight_vector(features, weights)
@@ -0,0 +1,293 @@
+"""
+Hedged OpenRouter requests over the OPENROUTER_MODELS list.
+
+The first (primary) model gets the request. If it has not answered within
+its hedge delay, the same request goes to the next model, and so on down
+the list; an error or an answer the caller rejects (not JSON, wrong shape)
+moves on to the next model at once. The first accepted answer wins.
+
+The hedge delay of a model is the OPENROUTER_HEDGE_PERCENTILE latency of
+its last OPENROUTER_HEDGE_SAMPLES calls, kept in a capped Redis list that
+every worker feeds, so only the slow tail gets a second request. Async
+losers are cancelled. requests cannot abort a read, so a sync loser is
+left to finish in its pool thread and its answer is dropped. Every call
+holds an admission slot (admission.py) until it has really ended, losers
+included, and a hedge only goes out while a slot is free right away.
+
+With a single model configured every call goes straight to llm_client.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from core import admission, llm_client
+from core.breaker import LLMUnavailable
+
+LATENCY_KEY = "llm:latency:{}"
+STATS_KEY = "llm:hedge:stats"
+
+# seconds a process reuses a hedge delay before reading the samples again
+DELAY_REFRESH = 10
+
+_delays = {}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def models() -> list:
+    return settings.OPENROUTER_MODELS
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """The process-wide pool the sync requests race in (recreated after a fork)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.OPENROUTER_POOL_SIZE, thread_name_prefix="hedge")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# =====Latency stats=====
+def record_latency(model: str, seconds: float):
+    key = LATENCY_KEY.format(model)
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.lpush(key, round(seconds, 3))
+        pipe.ltrim(key, 0, settings.OPENROUTER_HEDGE_SAMPLES - 1)
+        pipe.execute()
+    except Exception as e:
+        print(f"Could not record OpenRouter latency: {e}")
+
+
+def latencies(model: str) -> list:
+    return [float(value) for value in get_redis_connection("default").lrange(LATENCY_KEY.format(model), 0, -1)]
+
+
+def hedge_delay(model: str) -> float:
+    """Seconds to wait for model before the request goes to the next one"""
+    now = time.monotonic()
+    entry = _delays.get(model)
+    if entry is not None and now - entry[0] < DELAY_REFRESH:
+        return entry[1]
+    try:
+        samples = latencies(model)
+    except Exception as e:
+        print(f"Could not read OpenRouter latencies: {e}")
+        samples = []
+    if len(samples) < settings.OPENROUTER_HEDGE_MIN_SAMPLES:
+        delay = settings.OPENROUTER_HEDGE_DEFAULT_DELAY
+    else:
+        delay = float(np.percentile(samples, settings.OPENROUTER_HEDGE_PERCENTILE))
+    delay = min(max(delay, settings.OPENROUTER_HEDGE_MIN_DELAY), settings.OPENROUTER_HEDGE_MAX_DELAY)
+    _delays[model] = (now, delay)
+    return delay
+
+
+def _count(*fields):
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        for field in fields:
+            pipe.hincrby(STATS_KEY, field, 1)
+        pipe.execute()
+    except Exception as e:
+        print(f"Could not record hedging stats: {e}")
+
+
+def stats() -> dict:
+    """Per model latency percentiles, hedge delay, requests and wins"""
+    conn = get_redis_connection("default")
+    counts = {key.decode(): int(value) for key, value in conn.hgetall(STATS_KEY).items()}
+    result = {"models": [], "hedged": counts.get("hedged", 0)}
+    for model in models():
+        samples = latencies(model)
+        result["models"].append({
+            "model": model,
+            "samples": len(samples),
+            "p50": round(float(np.percentile(samples, 50)), 3) if samples else None,
+            "p95": round(float(np.percentile(samples, 95)), 3) if samples else None,
+            "hedge_delay": round(hedge_delay(model), 3),
+            "requests": counts.get(f"requests:{model}", 0),
+            "wins": counts.get(f"wins:{model}", 0),
+        })
+    return result
+
+
+# =====Requests=====
+def _post(model, payload, headers):
+    started = time.monotonic()
+    try:
+        return llm_client.post_chat(payload, headers)
+    except LLMUnavailable:
+        # never went out, says nothing about the model
+        started = None
+        raise
+    finally:
+        if started is not None:
+            record_latency(model, time.monotonic() - started)
+
+
+async def _apost(model, payload, headers):
+    started = time.monotonic()
+    try:
+        return await llm_client.apost_chat(payload, headers)
+    except LLMUnavailable:
+        started = None
+        raise
+    finally:
+        # a cancelled loser still tells how long the model took at least
+        if started is not None:
+            await sync_to_async(record_latency, thread_sensitive=False)(model, time.monotonic() - started)
+
+
+def _post_admitted(slot, model, payload, headers):
+    try:
+        return _post(model, payload, headers)
+    finally:
+        # a loser keeps its slot until its call is really over
+        admission.release(slot)
+
+
+async def _apost_admitted(key, held: dict, model, payload, headers):
+    try:
+        return await _apost(model, payload, headers)
+    finally:
+        await admission.arelease(held.pop(key, None))
+
+
+def post_hedged(payload_for, headers: dict, accept):
+    """llm_client.post_chat raced over the models, each call holding an
+    admission slot (admission.py) until it has ended.
+
+    payload_for(model) builds the request body and accept(response) tells
+    whether an answer is good enough to win. Returns the first accepted
+    response, else the last one; raises the last error if no model answered
+    and admission.Overloaded if there is no slot for the first call.
+    """
+    names = models()
+    if len(names) == 1:
+        with admission.admit():
+            return _post(names[0], payload_for(names[0]), headers)
+
+    pool = _get_pool()
+    futures = {}
+    launched = []
+    response = error = None
+
+    def launch():
+        model = names[len(launched)]
+        # a hedge next to a call still out only goes if a slot is free now
+        slot = admission.acquire(hedge=bool(futures))
+        launched.append(model)
+        try:
+            # the pool thread keeps the request's context (its deadline)
+            future = pool.submit(contextvars.copy_context().run, _post_admitted, slot, model, payload_for(model),
+                                 headers)
+        except BaseException:
+            admission.release(slot)
+            raise
+        futures[future] = (model, slot)
+        _count(f"requests:{model}", *(("hedged",) if len(launched) > 1 else ()))
+
+    launch()
+    try:
+        while futures:
+            more = len(launched) < len(names)
+            done, _ = wait(futures, timeout=hedge_delay(launched[-1]) if more else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                model, _ = futures.pop(future)
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if accept(answer):
+                    _count(f"wins:{model}")
+                    return answer
+                response = answer
+            if more:
+                try:
+                    launch()
+                except admission.Overloaded as e:
+                    # no slot for another model: make do with the calls already out
+                    names = list(launched)
+                    error = error or e
+    finally:
+        for loser, (_, slot) in futures.items():
+            # one still queued never runs, so never gives its slot back
+            if loser.cancel():
+                admission.release(slot)
+
+    if response is not None:
+        return response
+    raise error
+
+
+async def apost_hedged(payload_for, headers: dict, accept):
+    """post_hedged for the async views; losers are cancelled"""
+    names = models()
+    if len(names) == 1:
+        async with admission.aadmit():
+            return await _apost(names[0], payload_for(names[0]), headers)
+
+    tasks = {}
+    held = {}
+    launched = []
+    response = error = None
+    acount = sync_to_async(_count, thread_sensitive=False)
+    ahedge_delay = sync_to_async(hedge_delay, thread_sensitive=False)
+
+    async def launch():
+        model = names[len(launched)]
+        slot = await admission.aacquire(hedge=bool(tasks))
+        key = len(launched)
+        launched.append(model)
+        held[key] = slot
+        tasks[asyncio.ensure_future(_apost_admitted(key, held, model, payload_for(model), headers))] = model
+        await acount(f"requests:{model}", *(("hedged",) if len(launched) > 1 else ()))
+
+    try:
+        await launch()
+        while tasks:
+            more = len(launched) < len(names)
+            timeout = await ahedge_delay(launched[-1]) if more else None
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model = tasks.pop(task)
+                try:
+                    answer = task.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if accept(answer):
+                    await acount(f"wins:{model}")
+                    return answer
+                response = answer
+            if more:
+                try:
+                    await launch()
+                except admission.Overloaded as e:
+                    names = list(launched)
+                    error = error or e
+    finally:
+        for loser in tasks:
+            loser.cancel()
+        # let the losers wind down inside their slots
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # a task cancelled before it started never gives its slot back
+        for key in list(held):
+            await admission.arelease(held.pop(key))
+
+    if response is not None:
+        return response
+    raise error
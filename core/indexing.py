@@ -0,0 +1,112 @@
+"""
+Recompute job for the materialized performance_index columns.
+
+Stored scores are only trusted while the version recorded after the last
+recompute matches compare.index_version(), i.e. the current scales and
+weight tables; until then every reader (compare, top, list ordering, the
+serializers) scores live. Whenever a write changes the scales the model is
+added to a pending set in Redis as its transaction commits, and the compare
+worker (jobs.py) recomputes the pending tables between jobs, so the writing
+request does not rewrite the table. The set outlives the process that wrote
+it, and a model whose recompute failed or was already running elsewhere
+stays pending. The recompute_performance_index command does the same job
+(run it after deploys that change the weight tables).
+"""
+import logging
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from core.compare import INDEX_VERSION_KEY, SCORING, index_is_current, index_version, score_rows
+from core.engine import fields
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+LOCK_TIMEOUT = 10 * 60
+
+PENDING_KEY = "performance-index:pending"
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def recompute_performance_index(model, batch_size: int = BATCH_SIZE):
+    """Rewrite every stored score of model; returns the number of rows or
+    None if another process is already recomputing it"""
+    lock_key = f"performance-index:{_label(model)}:lock"
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return None
+
+    features = SCORING[model][0]
+    try:
+        while True:
+            version = index_version(model)
+            count = 0
+            batch = []
+            rows = model.objects.order_by("pk").values_list("pk", *fields(features))
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    count += _write_scores(model, batch)
+                    batch = []
+            if batch:
+                count += _write_scores(model, batch)
+
+            # scales moved while we were writing: go again with the new ones
+            if index_version(model) == version:
+                cache.set(INDEX_VERSION_KEY.format(_label(model)), version, None)
+                return count
+    finally:
+        cache.delete(lock_key)
+
+
+def _write_scores(model, rows) -> int:
+    scores = score_rows(model, (row[1:] for row in rows))
+    objs = [model(pk=row[0], performance_index=value) for row, value in zip(rows, scores.tolist())]
+    model.objects.bulk_update(objs, ["performance_index"])
+    return len(objs)
+
+
+def _mark_pending(model):
+    try:
+        get_redis_connection("default").sadd(PENDING_KEY, _label(model))
+    except Exception:
+        # readers score live until the next write or recompute_performance_index
+        logger.exception("Could not queue the performance_index recompute of %s", _label(model))
+
+
+def recompute_on_commit(model):
+    """Have a compare worker recompute model's scores once the current
+    transaction commits (at once outside a transaction)"""
+    transaction.on_commit(lambda: _mark_pending(model))
+
+
+def recompute_pending() -> int:
+    """Recompute every pending model whose scores are out of date (the
+    compare worker calls this); returns the number of rows rewritten"""
+    conn = get_redis_connection("default")
+    count = 0
+    retry = []
+    try:
+        while (label := conn.spop(PENDING_KEY)) is not None:
+            model = apps.get_model(label.decode())
+            if index_is_current(model):
+                continue
+            try:
+                written = recompute_performance_index(model)
+            except Exception:
+                logger.exception("performance_index recompute failed for %s", _label(model))
+                written = None
+            if written is None:
+                # failed, or running elsewhere and maybe from before this write
+                retry.append(label)
+            else:
+                count += written
+    finally:
+        if retry:
+            conn.sadd(PENDING_KEY, *retry)
+    return count
@@ -0,0 +1,291 @@
+"""
+Background jobs for the slow, LLM-backed comparisons.
+
+With ?mode=async, compare_pc and compare_phone answer 202 with a job id and
+push the job (always with the LLM wording, the only slow part) onto a Redis
+list. `manage.py run_compare_worker` moves jobs from there onto a
+processing list of its own (BLMOVE) and runs them on a bounded thread pool,
+dropping each from the processing list once it is done. A worker refreshes
+a heartbeat key while it runs; the jobs of a worker whose heartbeat expired
+(killed, crashed) go back on the queue when another worker starts or next
+looks, and a job is given up after JOB_MAX_ATTEMPTS tries. Between jobs the
+worker also rewrites the stored performance_index of tables whose scales
+moved (indexing.py). Job records (status and, once finished, the HTTP
+status and body the synchronous endpoint would have returned) live in the
+default cache for JOB_RESULT_TTL seconds and are read by the
+/core/jobs/<id> poll and /core/jobs/<id>/events SSE endpoints.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django_redis import get_redis_connection
+
+from core import compare_cache, indexing
+from core.ai import get_pc_comparison_json, get_phone_batch_comparison_json, get_phone_comparison_json
+from core.builds import COMPONENTS, enrich_with_llm, get_pc_score_json
+from core.compare import get_phone_score_json
+from core.models import Phone
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "jobs:compare:queue"
+JOB_KEY = "jobs:compare:{}"
+PROCESSING_KEY = "jobs:compare:processing:{}"
+WORKERS_KEY = "jobs:compare:workers"
+HEARTBEAT_KEY = "jobs:compare:worker:{}"
+
+# seconds a worker blocks on an empty queue before checking for shutdown
+POP_TIMEOUT = 5
+# seconds without a heartbeat after which a worker counts as dead
+HEARTBEAT_TTL = 30
+# seconds between looks for the jobs of dead workers
+RECOVER_INTERVAL = 60
+# seconds between looks for stored scores to recompute
+RECOMPUTE_INTERVAL = 5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+# =====Comparisons=====
+PC_MODELS = tuple(model for _, model, _ in COMPONENTS)
+
+
+def pc_side(components: dict) -> tuple:
+    return tuple(components.get(f"{key}_name") for key, _, _ in COMPONENTS)
+
+
+def pc_components(side) -> dict:
+    return {f"{key}_name": name for (key, _, _), name in zip(COMPONENTS, side)}
+
+
+def pc_compute(need: str, enrich: bool = False):
+    """compare_cache compute for compare_pc"""
+    return lambda side1, side2: _compare_pc(pc_components(side1), pc_components(side2), need, enrich)
+
+
+def compare_pc(pc1_components: dict, pc2_components: dict, need: str, enrich: bool = False):
+    """(HTTP status, body) of compare_pc, cached (compare_cache)"""
+    return compare_cache.compare("pc", PC_MODELS, pc_side(pc1_components), pc_side(pc2_components),
+                                 pc_compute(need, enrich), extra=(compare_cache.canonical_name(need), enrich))
+
+
+def _compare_pc(pc1_components: dict, pc2_components: dict, need: str, enrich: bool = False):
+    data = get_pc_score_json(pc1_components, pc2_components, need)
+    if data is None:
+        return 400, {"error": "Failed to compare PC configurations"}
+    # the LLM only adds wording on top of the local scores, on request
+    if enrich:
+        llm = get_pc_comparison_json(pc1_components, pc2_components, need)
+        if llm is None:
+            # OpenRouter is failing (or its breaker is open): the local scores still stand
+            data["degraded"] = True
+        data = enrich_with_llm(data, llm)
+    return 200, data
+
+
+def llm_failed(llm) -> bool:
+    """get_phone_comparison_json gave nothing usable (not found, API error, breaker open)"""
+    return llm is None or (isinstance(llm, dict) and bool(llm.get("api_error")))
+
+
+def phone_compute(enrich: bool = False):
+    """compare_cache compute for compare_phone"""
+    return lambda side1, side2: _compare_phone(side1[0], side2[0], enrich)
+
+
+def compare_phone(phone1: str, phone2: str, enrich: bool = False):
+    """(HTTP status, body) of compare_phone, cached (compare_cache)"""
+    return compare_cache.compare("phone", (Phone,), (phone1,), (phone2,), phone_compute(enrich), extra=(enrich,))
+
+
+def _compare_phone(phone1: str, phone2: str, enrich: bool = False):
+    data = get_phone_score_json(phone1, phone2)
+    if data is None:
+        return 400, {"error": "Failed to compare phones. Phone not found or database error."}
+    # the LLM only adds wording on top of the local scores, on request
+    if enrich:
+        llm = get_phone_comparison_json(phone1, phone2)
+        if llm_failed(llm):
+            # OpenRouter is failing (or its breaker is open): the local scores still stand
+            data["degraded"] = True
+            llm = None
+        data = enrich_with_llm(data, llm, "phone_name")
+    return 200, data
+
+
+# pairs one batch request may ask for: every pair of a 10 phone shortlist
+MAX_BATCH_PAIRS = 45
+
+
+def prefetch_phone_llm(pairs) -> int:
+    """Fetch the LLM wording of the (phone1, phone2) pairs whose enriched
+    compare_phone result is not cached yet in batched prompts, so computing
+    them finds the completions cached; returns the number of pairs asked for"""
+    todo = []
+    for phone1, phone2 in pairs:
+        if compare_cache.is_cached("phone", (Phone,), (phone1,), (phone2,), (True,)):
+            continue
+        found = [compare_cache.resolve(Phone, name) for name in (phone1, phone2)]
+        if None not in found:
+            todo.append((found[0][1], found[1][1]))
+    todo = list(dict.fromkeys(todo))
+    if todo:
+        get_phone_batch_comparison_json(todo)
+    return len(todo)
+
+
+def compare_phones(pairs, enrich: bool = True) -> list:
+    """(HTTP status, body) of compare_phone for every (phone1, phone2) pair,
+    with the LLM wording of the uncached ones fetched in batches first"""
+    if enrich:
+        prefetch_phone_llm(pairs)
+    return [compare_phone(phone1, phone2, enrich) for phone1, phone2 in pairs]
+
+
+JOBS = {
+    "compare_pc": compare_pc,
+    "compare_phone": compare_phone,
+}
+
+
+# =====Queue=====
+def get_job(job_id: str):
+    return cache.get(JOB_KEY.format(job_id))
+
+
+async def aget_job(job_id: str):
+    return await cache.aget(JOB_KEY.format(job_id))
+
+
+def _save(job: dict):
+    cache.set(JOB_KEY.format(job["id"]), job, settings.JOB_RESULT_TTL)
+
+
+def enqueue(kind: str, **params) -> dict:
+    """Queue JOBS[kind](**params) and return the job record"""
+    if kind not in JOBS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "created_at": time.time()}
+    _save(job)
+    get_redis_connection("default").lpush(QUEUE_KEY, json.dumps({"id": job["id"], "kind": kind, "params": params}))
+    return job
+
+
+def run_job(message: dict):
+    job = get_job(message["id"]) or {"id": message["id"], "kind": message["kind"], "created_at": time.time()}
+    # requeued after its worker died, but it had finished already
+    if job.get("status") in FINISHED:
+        return job
+    attempts = job.get("attempts", 0) + 1
+    if attempts > settings.JOB_MAX_ATTEMPTS:
+        logger.error("Job %s (%s) given up after %d attempts", message["id"], message["kind"], attempts - 1)
+        job.update(status=FAILED, status_code=500, result={"error": "Comparison failed"}, finished_at=time.time())
+        _save(job)
+        return job
+
+    job.update(status=RUNNING, started_at=time.time(), attempts=attempts)
+    _save(job)
+    try:
+        status_code, result = JOBS[message["kind"]](**message["params"])
+        job.update(status=DONE, status_code=status_code, result=result)
+    except Exception:
+        logger.exception("Job %s (%s) failed", message["id"], message["kind"])
+        job.update(status=FAILED, status_code=500, result={"error": "Comparison failed"})
+    finally:
+        close_old_connections()
+    job["finished_at"] = time.time()
+    _save(job)
+    return job
+
+
+# =====Worker=====
+def _heartbeat(conn, worker: str):
+    pipe = conn.pipeline()
+    pipe.sadd(WORKERS_KEY, worker)
+    pipe.set(HEARTBEAT_KEY.format(worker), 1, ex=HEARTBEAT_TTL)
+    pipe.execute()
+
+
+def recover(conn) -> int:
+    """Put the jobs of workers whose heartbeat expired back on the queue;
+    returns how many were requeued"""
+    requeued = 0
+    for worker in conn.smembers(WORKERS_KEY):
+        worker = worker.decode()
+        if conn.exists(HEARTBEAT_KEY.format(worker)):
+            continue
+        processing = PROCESSING_KEY.format(worker)
+        # oldest first, and to the end the queue is taken from
+        while conn.lmove(processing, QUEUE_KEY, "RIGHT", "RIGHT") is not None:
+            requeued += 1
+        conn.srem(WORKERS_KEY, worker)
+    if requeued:
+        logger.warning("Requeued %d jobs of stopped compare workers", requeued)
+    return requeued
+
+
+def _recompute_pending():
+    try:
+        indexing.recompute_pending()
+    except Exception:
+        logger.exception("Could not recompute the pending performance_index columns")
+    finally:
+        close_old_connections()
+
+
+def _run_and_ack(conn, processing: str, raw: bytes):
+    try:
+        run_job(json.loads(raw))
+    finally:
+        conn.lrem(processing, 1, raw)
+
+
+def work(concurrency: int, stop: threading.Event = None):
+    """Take and run jobs, at most `concurrency` at a time, until stop is set"""
+    conn = get_redis_connection("default")
+    slots = threading.BoundedSemaphore(concurrency)
+    stop = stop or threading.Event()
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    processing = PROCESSING_KEY.format(worker)
+
+    _heartbeat(conn, worker)
+    recover(conn)
+    beat = recovered = recomputed = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="compare-job") as pool:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now - beat > HEARTBEAT_TTL / 3:
+                    _heartbeat(conn, worker)
+                    beat = now
+                if now - recovered > RECOVER_INTERVAL:
+                    recover(conn)
+                    recovered = now
+                if now - recomputed > RECOMPUTE_INTERVAL:
+                    _recompute_pending()
+                    recomputed = time.monotonic()
+                # only take a job off the queue once a thread is free for it, so
+                # queued jobs stay visible to other workers
+                if not slots.acquire(timeout=POP_TIMEOUT):
+                    continue
+                raw = conn.blmove(QUEUE_KEY, processing, POP_TIMEOUT, "RIGHT", "LEFT")
+                if raw is None:
+                    slots.release()
+                    continue
+                future = pool.submit(_run_and_ack, conn, processing, raw)
+                future.add_done_callback(lambda _: slots.release())
+    finally:
+        conn.delete(HEARTBEAT_KEY.format(worker))
+        # jobs left over (the loop failed) are requeued by the next recover()
+        if not conn.llen(processing):
+            conn.srem(WORKERS_KEY, worker)
@@ -0,0 +1,107 @@
+"""
+Incremental parsing of a JSON object that arrives in pieces (a streamed LLM
+completion).
+
+FieldParser is fed text chunks and reports each top-level field as soon as
+its value is complete, and each object inside a top-level array as soon as
+that object closes, so `comparison[0]` can be shown before `reasoning` has
+even started. Text before the first `{` (such as a ```json fence) is skipped.
+"""
+import json
+
+_WHITESPACE = " \t\r\n"
+
+
+class FieldParser:
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escaped = False
+        self.expect_key = False
+        self.key = None
+        self.last_string = None
+        self.string_start = None
+        self.value_start = None
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, text: str) -> list:
+        """Events completed by text: ("item", key, index, value) for objects
+        in a top-level array and ("field", key, value) for top-level fields"""
+        self.buffer += text
+        events = []
+        buf = self.buffer
+        while self.pos < len(buf) and not self.finished:
+            i, ch = self.pos, buf[self.pos]
+            self.pos += 1
+
+            if not self.started:
+                if ch == "{":
+                    self.started, self.depth, self.expect_key = True, 1, True
+                continue
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        if self.expect_key:
+                            self.last_string = buf[self.string_start:i + 1]
+                        else:
+                            self._field(events, i + 1)
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i
+                if self.depth == 1 and not self.expect_key:
+                    self.value_start = i
+            elif ch in "{[":
+                if self.depth == 1:
+                    self.value_start = i
+                    self.item_index = 0
+                elif self.depth == 2 and ch == "{" and buf[self.value_start] == "[":
+                    self.item_start = i
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._primitive(events, i)
+                    self.finished = True
+                elif self.depth == 1:
+                    self._field(events, i + 1)
+                elif self.depth == 2 and self.item_start is not None:
+                    self._item(events, i + 1)
+            elif self.depth == 1:
+                if ch == ":":
+                    self.key = json.loads(self.last_string)
+                    self.expect_key = False
+                    self.value_start = None
+                elif ch == ",":
+                    self._primitive(events, i)
+                    self.expect_key = True
+                elif ch not in _WHITESPACE and self.value_start is None and not self.expect_key:
+                    # start of a number, true, false or null
+                    self.value_start = i
+        return events
+
+    def _field(self, events, end):
+        events.append(("field", self.key, json.loads(self.buffer[self.value_start:end])))
+        self.value_start = None
+
+    def _primitive(self, events, end):
+        if self.value_start is not None and not self.expect_key:
+            events.append(("field", self.key, json.loads(self.buffer[self.value_start:end])))
+        self.value_start = None
+
+    def _item(self, events, end):
+        events.append(("item", self.key, self.item_index, json.loads(self.buffer[self.item_start:end])))
+        self.item_index += 1
+        self.item_start = None
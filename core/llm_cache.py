@@ -0,0 +1,155 @@
+"""
+Content-addressed cache for OpenRouter completions.
+
+Keys are a SHA-256 of (model, prompt, temperature) and values the
+zlib-compressed completion text, stored in the default (Redis) cache for
+LLM_CACHE_TTL seconds. Every prompt embeds the rows it is about, so editing
+a component, phone or brand coefficient changes the prompt and therefore
+the key: answers about old data are never served and simply age out.
+
+Identical prompts in flight at the same time are coalesced across processes
+and hosts: the first caller takes a lock next to the key and asks OpenRouter,
+the others poll the cache for its answer for up to LLM_FLIGHT_WAIT seconds.
+A waiter that runs out of time raises FlightPending (a
+breaker.LLMUnavailable) and serves its local result rather than asking
+OpenRouter next to the lock holder.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import deadlines
+from core.breaker import LLMUnavailable
+
+
+def completion_key(model: str, prompt: str, temperature: float) -> str:
+    digest = hashlib.sha256(json.dumps([model, prompt, temperature]).encode()).hexdigest()
+    return f"llm:completion:{digest}"
+
+
+def _decode(blob):
+    if blob is None:
+        return None
+    try:
+        return zlib.decompress(blob).decode()
+    except zlib.error:
+        return None
+
+
+def get_completion(model: str, prompt: str, temperature: float):
+    return _decode(cache.get(completion_key(model, prompt, temperature)))
+
+
+def set_completion(model: str, prompt: str, temperature: float, content: str):
+    cache.set(completion_key(model, prompt, temperature), zlib.compress(content.encode()), settings.LLM_CACHE_TTL)
+
+
+async def aget_completion(model: str, prompt: str, temperature: float):
+    return _decode(await cache.aget(completion_key(model, prompt, temperature)))
+
+
+async def aset_completion(model: str, prompt: str, temperature: float, content: str):
+    await cache.aset(completion_key(model, prompt, temperature), zlib.compress(content.encode()), settings.LLM_CACHE_TTL)
+
+
+# =====Single flight=====
+POLL_INTERVAL = 0.05  # seconds, doubled up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 0.5
+RETRY_AFTER = 2  # seconds a waiter that gave up is told to wait
+
+# flight locks held by the current thread / task: {lock key: token}
+_flights = contextvars.ContextVar("llm_flights")
+
+
+class FlightPending(LLMUnavailable):
+    """Another worker is still fetching the completion"""
+
+    def __init__(self):
+        super().__init__(f"Completion still in flight elsewhere, retry in {RETRY_AFTER}s", RETRY_AFTER)
+
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+
+def _held() -> dict:
+    held = _flights.get(None)
+    if held is None:
+        held = {}
+        _flights.set(held)
+    return held
+
+
+def claim_or_wait(model: str, prompt: str, temperature: float):
+    """The cached completion, waiting for one already in flight, or None.
+
+    None means the caller holds the flight lock now and has to ask OpenRouter
+    itself (release_flight once the answer is cached). Raises FlightPending
+    if the answer in flight does not arrive within LLM_FLIGHT_WAIT. When the
+    lock holder fails, the next waiter takes over.
+    """
+    key = completion_key(model, prompt, temperature)
+    content = _decode(cache.get(key))
+    if content is not None:
+        return content
+
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + deadlines.cap(settings.LLM_FLIGHT_WAIT)
+    interval = POLL_INTERVAL
+    while True:
+        if cache.add(_lock_key(key), token, settings.LLM_FLIGHT_LOCK_TIMEOUT):
+            _held()[_lock_key(key)] = token
+            return None
+        if time.monotonic() >= deadline:
+            print(f"Gave up waiting for in-flight completion {key}")
+            raise FlightPending()
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        content = _decode(cache.get(key))
+        if content is not None:
+            return content
+
+
+def release_flight(model: str, prompt: str, temperature: float):
+    lock = _lock_key(completion_key(model, prompt, temperature))
+    token = _held().pop(lock, None)
+    if token is not None and cache.get(lock) == token:
+        cache.delete(lock)
+
+
+async def aclaim_or_wait(model: str, prompt: str, temperature: float):
+    """Async claim_or_wait"""
+    key = completion_key(model, prompt, temperature)
+    content = _decode(await cache.aget(key))
+    if content is not None:
+        return content
+
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + deadlines.cap(settings.LLM_FLIGHT_WAIT)
+    interval = POLL_INTERVAL
+    while True:
+        if await cache.aadd(_lock_key(key), token, settings.LLM_FLIGHT_LOCK_TIMEOUT):
+            _held()[_lock_key(key)] = token
+            return None
+        if time.monotonic() >= deadline:
+            print(f"Gave up waiting for in-flight completion {key}")
+            raise FlightPending()
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        content = _decode(await cache.aget(key))
+        if content is not None:
+            return content
+
+
+async def arelease_flight(model: str, prompt: str, temperature: float):
+    lock = _lock_key(completion_key(model, prompt, temperature))
+    token = _held().pop(lock, None)
+    if token is not None and await cache.aget(lock) == token:
+        await cache.adelete(lock)
@@ -0,0 +1,337 @@
+"""
+Shared HTTP clients for OpenRouter.
+
+One keep-alive requests.Session per process (and an httpx.AsyncClient for
+the async views, see async_client) with a bounded connection pool,
+connect/read timeouts on every call, and a few retries with jittered
+exponential backoff on connection errors, 429 and 5xx answers. A read
+timeout is not retried: the upstream is already slow and a retry would
+only double the wait. Every call goes through the circuit breaker in
+breaker.py and raises breaker.CircuitOpen while OpenRouter is down, and
+every attempt waits for a token from the shared rate limiter in
+ratelimit.py (RateLimited if the quota is booked up); both are a
+breaker.LLMUnavailable. Timeouts, retries and waits stay within the request's deadline
+(deadlines.py); a call cut short by it raises DeadlineExceeded and is not
+held against OpenRouter by the breaker.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core import breaker, deadlines, ratelimit
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 10  # seconds; longer Retry-After answers are not waited out
+MIN_CALL_BUDGET = 1  # seconds; with less of the request's deadline left OpenRouter is not asked
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_async_clients = weakref.WeakKeyDictionary()
+# the client of the current request while it cannot outlive it (async_client)
+_request_client = contextvars.ContextVar("openrouter_request_client", default=None)
+
+
+class UpstreamError(Exception):
+    """OpenRouter answered a streamed request with an error"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def get_session() -> requests.Session:
+    """The process-wide session (recreated after a fork)"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.OPENROUTER_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def _backoff(attempt: int, response=None) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    return settings.OPENROUTER_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _timeouts():
+    """(connect, read) timeouts within the request's deadline; raises
+    DeadlineExceeded if too little of it is left to ask OpenRouter"""
+    deadlines.check(MIN_CALL_BUDGET)
+    return deadlines.cap(settings.OPENROUTER_CONNECT_TIMEOUT), deadlines.cap(settings.OPENROUTER_READ_TIMEOUT)
+
+
+def post_chat(payload: dict, headers: dict) -> requests.Response:
+    """POST a chat completion request.
+
+    Returns the last response (possibly a 429/5xx once retries are used up),
+    raises requests.RequestException if the upstream cannot be reached and
+    breaker.LLMUnavailable without trying while it is known to be down or the
+    rate limiter has no slot soon enough.
+    """
+    deadlines.check(MIN_CALL_BUDGET)
+    mode = breaker.before_call()
+    try:
+        ratelimit.acquire()
+    except ratelimit.RateLimited:
+        breaker.cancel(mode)
+        raise
+    # the breaker judges OpenRouter, not our own queue or deadline
+    started = time.monotonic()
+    ok = cut = False
+    try:
+        response = _post_chat(payload, headers)
+        ok = response.status_code not in RETRY_STATUSES
+        return response
+    except deadlines.DeadlineExceeded:
+        cut = True
+        raise
+    finally:
+        if cut:
+            breaker.cancel(mode)
+        else:
+            breaker.after_call(mode, ok, time.monotonic() - started)
+
+
+def _post_chat(payload: dict, headers: dict) -> requests.Response:
+    retries = settings.OPENROUTER_MAX_RETRIES
+    body = json.dumps(payload)
+
+    for attempt in range(retries + 1):
+        if attempt:
+            ratelimit.acquire()
+        connect, read = _timeouts()
+        try:
+            response = get_session().post(OPENROUTER_URL, headers=headers, data=body, timeout=(connect, read))
+        except requests.ConnectionError as e:
+            # a timeout shortened to fit the deadline is the deadline's, not OpenRouter's
+            if isinstance(e, requests.Timeout) and connect < settings.OPENROUTER_CONNECT_TIMEOUT:
+                raise deadlines.DeadlineExceeded() from e
+            if attempt == retries:
+                raise
+            time.sleep(deadlines.cap(_backoff(attempt)))
+            continue
+        except requests.Timeout as e:
+            if read < settings.OPENROUTER_READ_TIMEOUT:
+                raise deadlines.DeadlineExceeded() from e
+            raise
+
+        if response.status_code == 429:
+            ratelimit.drain()
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            print(f"OpenRouter returned {response.status_code}, retrying ({attempt + 1}/{retries})")
+            time.sleep(deadlines.cap(_backoff(attempt, response)))
+            continue
+        return response
+
+
+def _new_async_client() -> httpx.AsyncClient:
+    size = settings.OPENROUTER_ASYNC_POOL_SIZE
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+        # waiting for a free pooled connection counts like waiting for the answer
+        timeout=httpx.Timeout(settings.OPENROUTER_READ_TIMEOUT, connect=settings.OPENROUTER_CONNECT_TIMEOUT),
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The AsyncClient of the current request (async_client), else the one of
+    the running event loop"""
+    client = _request_client.get()
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _new_async_client()
+    return client
+
+
+@contextlib.asynccontextmanager
+async def async_client(shared: bool):
+    """Scope of an async view's OpenRouter calls.
+
+    Under ASGI (shared) the event loop lives as long as the process and its
+    client is kept for every request. Under WSGI each async view runs on an
+    event loop of its own that is gone when the view returns, so the block
+    gets a client of its own and closes it at the end.
+    """
+    if shared:
+        yield
+        return
+    client = _new_async_client()
+    token = _request_client.set(client)
+    try:
+        yield
+    finally:
+        _request_client.reset(token)
+        await client.aclose()
+
+
+async def apost_chat(payload: dict, headers: dict) -> httpx.Response:
+    """Async post_chat; raises httpx.HTTPError if the upstream cannot be reached"""
+    deadlines.check(MIN_CALL_BUDGET)
+    mode = await breaker.abefore_call()
+    try:
+        await ratelimit.aacquire()
+    except ratelimit.RateLimited:
+        await breaker.acancel(mode)
+        raise
+    started = time.monotonic()
+    ok = cancelled = False
+    try:
+        response = await _apost_chat(payload, headers)
+        ok = response.status_code not in RETRY_STATUSES
+        return response
+    except (asyncio.CancelledError, deadlines.DeadlineExceeded):
+        # a hedged request that lost the race (hedging.py) or one the
+        # request's deadline cut short is no failure of OpenRouter
+        cancelled = True
+        raise
+    finally:
+        if cancelled:
+            await breaker.acancel(mode)
+        else:
+            await breaker.aafter_call(mode, ok, time.monotonic() - started)
+
+
+async def _apost_chat(payload: dict, headers: dict) -> httpx.Response:
+    retries = settings.OPENROUTER_MAX_RETRIES
+    body = json.dumps(payload)
+
+    for attempt in range(retries + 1):
+        if attempt:
+            await ratelimit.aacquire()
+        connect, read = _timeouts()
+        try:
+            response = await get_async_client().post(OPENROUTER_URL, headers=headers, content=body,
+                                                     timeout=httpx.Timeout(read, connect=connect))
+        except httpx.ConnectTimeout as e:
+            if connect < settings.OPENROUTER_CONNECT_TIMEOUT:
+                raise deadlines.DeadlineExceeded() from e
+            if attempt == retries:
+                raise
+            await asyncio.sleep(deadlines.cap(_backoff(attempt)))
+            continue
+        except httpx.ConnectError:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(deadlines.cap(_backoff(attempt)))
+            continue
+        except httpx.TimeoutException as e:
+            if read < settings.OPENROUTER_READ_TIMEOUT:
+                raise deadlines.DeadlineExceeded() from e
+            raise
+
+        if response.status_code == 429:
+            await ratelimit.adrain()
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            print(f"OpenRouter returned {response.status_code}, retrying ({attempt + 1}/{retries})")
+            await asyncio.sleep(deadlines.cap(_backoff(attempt, response)))
+            continue
+        return response
+
+
+async def astream_chat(payload: dict, headers: dict):
+    """Completion text deltas of a stream=True request.
+
+    Retries like apost_chat until the answer starts; raises UpstreamError for
+    an error answer and httpx.HTTPError if the upstream cannot be reached.
+    The breaker judges the call by the time to the first delta, or by how it
+    ended if none came. A consumer that goes away (or is cancelled) before
+    that says nothing about OpenRouter, so nothing is recorded.
+    """
+    mode = await breaker.abefore_call()
+    try:
+        await ratelimit.aacquire()
+    except ratelimit.RateLimited:
+        await breaker.acancel(mode)
+        raise
+    started = time.monotonic()
+    recorded = ok = cancelled = False
+    try:
+        async for delta in _astream_chat(payload, headers):
+            if not recorded:
+                recorded = True
+                await breaker.aafter_call(mode, True, time.monotonic() - started)
+            yield delta
+        # ended without a single delta: an empty answer, but an answer
+        ok = True
+    except UpstreamError as e:
+        ok = e.status_code not in RETRY_STATUSES
+        raise
+    except (GeneratorExit, asyncio.CancelledError, deadlines.DeadlineExceeded):
+        cancelled = True
+        raise
+    finally:
+        if cancelled and not recorded:
+            await breaker.acancel(mode)
+        elif not recorded:
+            await breaker.aafter_call(mode, ok, time.monotonic() - started)
+
+
+async def _astream_chat(payload: dict, headers: dict):
+    retries = settings.OPENROUTER_MAX_RETRIES
+    body = json.dumps({**payload, "stream": True})
+
+    for attempt in range(retries + 1):
+        if attempt:
+            await ratelimit.aacquire()
+        try:
+            async with get_async_client().stream("POST", OPENROUTER_URL, headers=headers, content=body) as response:
+                if response.status_code != 200:
+                    text = (await response.aread()).decode(errors="replace")
+                    if response.status_code == 429:
+                        await ratelimit.adrain()
+                    if response.status_code in RETRY_STATUSES and attempt < retries:
+                        print(f"OpenRouter returned {response.status_code}, retrying ({attempt + 1}/{retries})")
+                        await asyncio.sleep(_backoff(attempt, response))
+                        continue
+                    raise UpstreamError(response.status_code, text)
+
+                async for line in response.aiter_lines():
+                    # skip blank lines and ": OPENROUTER PROCESSING" comments
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+                    if chunk.get("error"):
+                        raise UpstreamError(502, chunk["error"].get("message", "Unknown API error"))
+                    choices = chunk.get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+                return
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(_backoff(attempt))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.camera import refresh_camera_fields
+from core.compare import index_is_current
+from core.indexing import BATCH_SIZE, recompute_performance_index
+from core.models import CPU, GPU, RAM, Phone
+from core.scales import rebuild_scales
+
+MODELS = {"cpu": CPU, "gpu": GPU, "ram": RAM, "phone": Phone}
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored performance_index of CPU, GPU, RAM and phone rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("components", nargs="*", help="cpu, gpu, ram and/or phone (default: all)")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--force", action="store_true", help="recompute even if the stored scores are current")
+
+    def handle(self, *args, **options):
+        names = options["components"] or list(MODELS)
+        unknown = set(names) - set(MODELS)
+        if unknown:
+            raise CommandError(f"Unknown components: {', '.join(sorted(unknown))}")
+
+        for name in names:
+            model = MODELS[name]
+            # bulk loads bypass the signals (and Phone.save()), so start from a fresh scan
+            if model is Phone:
+                refresh_camera_fields(Phone.objects.all(), options["batch_size"])
+            rebuild_scales(model)
+            if index_is_current(model) and not options["force"]:
+                self.stdout.write(f"{name}: up to date")
+                continue
+            count = recompute_performance_index(model, options["batch_size"])
+            if count is None:
+                self.stdout.write(f"{name}: already being recomputed elsewhere")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: {count} rows recomputed"))
@@ -0,0 +1,25 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Run queued compare_pc/compare_phone jobs and pending performance_index recomputes (see core/jobs.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.JOB_WORKER_CONCURRENCY,
+                            help="jobs run at the same time")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        self.stdout.write(f"Compare worker started with {options['concurrency']} threads")
+        # running jobs are finished before exiting
+        work(max(options["concurrency"], 1), stop)
+        self.stdout.write("Compare worker stopped")
@@ -0,0 +1,164 @@
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core import breaker, compare_cache
+from core.compare import get_cpu_comparison_json, get_gpu_comparison_json, get_ram_comparison_json
+from core.jobs import PC_MODELS, pc_compute, phone_compute, prefetch_phone_llm
+from core.models import CPU, GPU, RAM, Phone
+
+# kind -> (models of a side, names per side, compute for an extra)
+KINDS = {
+    "cpu": ((CPU,), 1, lambda extra: compare_cache.pair_compute(get_cpu_comparison_json, "Failed to compare processors")),
+    "gpu": ((GPU,), 1, lambda extra: compare_cache.pair_compute(get_gpu_comparison_json, "Failed to compare video cards")),
+    "ram": ((RAM,), 1, lambda extra: compare_cache.pair_compute(get_ram_comparison_json, "Failed to compare RAMs")),
+    "pc": (PC_MODELS, 3, lambda extra: pc_compute(*extra)),
+    "phone": ((Phone,), 1, lambda extra: phone_compute(*extra)),
+}
+
+# kinds whose extra ends with the enrich flag, i.e. that may call OpenRouter
+LLM_KINDS = ("pc", "phone")
+
+
+class Command(BaseCommand):
+    help = ("Precompute compare results (and their LLM completions) for given pairs or the most "
+            "requested ones; pairs that are already cached are skipped, so an interrupted run resumes")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pair", nargs="+", action="append", default=[], metavar="ARG",
+                            help="KIND NAME1 NAME2, or pc CPU1 GPU1 RAM1 CPU2 GPU2 RAM2 NEED (repeatable)")
+        parser.add_argument("--kinds", default=",".join(KINDS),
+                            help="kinds taken from the popularity counts when no --pair is given")
+        parser.add_argument("--top", type=int, default=100, help="most requested pairs per kind")
+        parser.add_argument("--enrich", action="store_true", help="warm pc/phone pairs with LLM wording")
+        parser.add_argument("--concurrency", type=int, default=4, help="pairs computed at the same time")
+        parser.add_argument("--rate", type=float, default=0, help="pairs started per second (0: no limit)")
+
+    def handle(self, *args, **options):
+        items = self._items(options)
+        if not items:
+            self.stdout.write("Nothing to warm")
+            return
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        started = time.monotonic()
+        self._prefetch_phones(items, options["concurrency"], stop)
+
+        counts = {"warmed": 0, "cached": 0, "failed": 0}
+        interval = 1 / options["rate"] if options["rate"] > 0 else 0
+        next_start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(options["concurrency"], 1), thread_name_prefix="warm") as pool:
+            pending = set()
+            for item in items:
+                if stop.is_set():
+                    break
+                if len(pending) >= options["concurrency"]:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, counts)
+                if item[0] in LLM_KINDS and item[3][-1]:
+                    self._wait_for_breaker(stop)
+                if interval:
+                    time.sleep(max(next_start - time.monotonic(), 0))
+                    next_start = max(next_start, time.monotonic()) + interval
+                pending.add(pool.submit(self._warm, *item))
+            done, _ = wait(pending)
+            self._collect(done, counts)
+
+        elapsed = time.monotonic() - started
+        total = sum(counts.values())
+        if stop.is_set():
+            self.stdout.write(self.style.WARNING("Interrupted; run again to resume"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} pairs in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} pairs/s): "
+            f"{counts['warmed']} warmed, {counts['cached']} already cached, {counts['failed']} failed, "
+            f"hit ratio {counts['cached'] / max(total, 1):.0%}"
+        ))
+
+    def _items(self, options):
+        """(kind, side1, side2, extra) to warm"""
+        items = []
+        for args in options["pair"]:
+            kind, names = args[0], args[1:]
+            if kind not in KINDS:
+                raise CommandError(f"Unknown kind: {kind}")
+            size = KINDS[kind][1]
+            expected = 2 * size + (1 if kind == "pc" else 0)
+            if len(names) != expected:
+                raise CommandError(f"{kind} pairs take {expected} names, got {len(names)}")
+            extra = ()
+            if kind == "pc":
+                extra = (compare_cache.canonical_name(names[-1]), options["enrich"])
+            elif kind == "phone":
+                extra = (options["enrich"],)
+            items.append((kind, tuple(names[:size]), tuple(names[size:2 * size]), extra))
+        if items:
+            return items
+
+        kinds = [kind.strip() for kind in options["kinds"].split(",") if kind.strip()]
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise CommandError(f"Unknown kinds: {', '.join(sorted(unknown))}")
+        for kind in kinds:
+            for (side1, side2), extra, _ in compare_cache.popular(kind, options["top"]):
+                if kind in LLM_KINDS and options["enrich"]:
+                    extra = extra[:-1] + (True,)
+                items.append((kind, side1, side2, extra))
+        # popular entries recorded with and without enrich may now coincide
+        return list(dict.fromkeys(items))
+
+    def _prefetch_phones(self, items, concurrency, stop):
+        # enriched phone pairs get their LLM wording in batched prompts first,
+        # then warming them below only finds cached completions
+        pairs = [(side1[0], side2[0]) for kind, side1, side2, extra in items if kind == "phone" and extra[-1]]
+        size = max(settings.LLM_BATCH_SIZE, 1)
+        batches = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+        if not batches:
+            return
+        self._wait_for_breaker(stop)
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="warm") as pool:
+            asked = sum(pool.map(lambda batch: self._prefetch(batch, stop), batches))
+        self.stdout.write(f"Asked OpenRouter about {asked} phone pairs in batches of {size}")
+
+    def _prefetch(self, pairs, stop):
+        if stop.is_set():
+            return 0
+        try:
+            return prefetch_phone_llm(pairs)
+        except Exception as e:
+            print(f"Prefetching phone comparisons failed: {e}")
+            return 0
+        finally:
+            close_old_connections()
+
+    def _warm(self, kind, side1, side2, extra):
+        """Outcome of one pair: warmed, cached or failed"""
+        models, _, compute = KINDS[kind]
+        try:
+            if compare_cache.is_cached(kind, models, side1, side2, extra):
+                return "cached"
+            status, body = compare_cache.compare(kind, models, side1, side2, compute(extra), extra, record=False)
+            return "warmed" if status == 200 and not body.get("degraded") else "failed"
+        except Exception as e:
+            print(f"Warming {kind} {side1} vs {side2} failed: {e}")
+            return "failed"
+        finally:
+            close_old_connections()
+
+    def _collect(self, futures, counts):
+        for future in futures:
+            counts[future.result()] += 1
+
+    def _wait_for_breaker(self, stop):
+        # OpenRouter is failing: wait for the cooldown instead of adding to it
+        while not stop.is_set() and breaker.state() == "open":
+            self.stdout.write("OpenRouter circuit breaker is open, waiting")
+            stop.wait(5)
@@ -0,0 +1,80 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from core import admission, deadlines
+
+
+class DeadlineMiddleware:
+    """Give the request its deadline (deadlines.py) and answer 504 if a
+    query was refused because it was spent. Streamed responses run after the
+    view returned and get no deadline."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = deadlines.start(deadlines.request_budget(request))
+        try:
+            return self.get_response(request)
+        finally:
+            deadlines.end(token)
+
+    async def __acall__(self, request):
+        token = deadlines.start(deadlines.request_budget(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            deadlines.end(token)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, deadlines.DeadlineExceeded):
+            return JsonResponse({"error": "The request took longer than its deadline"}, status=504)
+        return None
+
+
+class AdmissionMiddleware:
+    """With LLM_ADMISSION_SHED, answer 503 with Retry-After instead of the
+    degraded result a view fell back to when the admission gate (admission.py)
+    refused its OpenRouter call. Streams have already started by then and
+    report the refusal as an event instead."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = admission.start_request()
+        try:
+            return self.shed(self.get_response(request))
+        finally:
+            admission.end_request(token)
+
+    async def __acall__(self, request):
+        token = admission.start_request()
+        try:
+            return self.shed(await self.get_response(request))
+        finally:
+            admission.end_request(token)
+
+    def shed(self, response):
+        retry_after = admission.refused()
+        if retry_after is None or not settings.LLM_ADMISSION_SHED or response.streaming:
+            return response
+        shed = JsonResponse({"error": "Too many comparisons in progress, try again later",
+                             "retry_after": retry_after}, status=503)
+        shed["Retry-After"] = str(retry_after)
+        return shed
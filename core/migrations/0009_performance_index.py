@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_alter_phone_brand'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cpu',
+            name='performance_index',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gpu',
+            name='performance_index',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ram',
+            name='performance_index',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:20
+
+import re
+
+from django.db import migrations, models
+
+# a copy of core.camera.parse_camera_mp as of this migration, so later
+# changes to the parser do not change what the migration does
+NUMBER = r"(?:(\d+)\s*[x×]\s*|\b(dual|triple|quad|penta)[\s-]*)?(\d+(?:[.,]\d+)?)"
+WITH_UNIT = re.compile(NUMBER + r"\s*(?:mp|мп|megapixels?)", re.IGNORECASE)
+BARE = re.compile(NUMBER)
+FRONT = re.compile(r"front|selfie|фронт", re.IGNORECASE)
+WORDS = {"dual": 2, "triple": 3, "quad": 4, "penta": 5}
+MAX_MP = 250
+MAX_LENSES = 8
+
+
+def parse_camera_mp(text):
+    if not text:
+        return None, None
+    rear = FRONT.split(text, maxsplit=1)[0]
+    sensors = []
+    for count, word, value in WITH_UNIT.findall(rear) or BARE.findall(rear):
+        mp = float(value.replace(",", "."))
+        if 0 < mp <= MAX_MP:
+            count = int(count) if count else WORDS.get(word.lower(), 1)
+            sensors.extend([mp] * min(count, MAX_LENSES))
+    if not sensors:
+        return None, None
+    return max(sensors), min(len(sensors), MAX_LENSES)
+
+
+def parse_cameras(apps, schema_editor):
+    Phone = apps.get_model('core', 'Phone')
+    changed = []
+    for pk, text in Phone.objects.order_by('pk').values_list('pk', 'camera_mp').iterator(chunk_size=1000):
+        main_mp, count = parse_camera_mp(text)
+        if main_mp is not None:
+            changed.append(Phone(pk=pk, camera_main_mp=main_mp, camera_count=count))
+    Phone.objects.bulk_update(changed, ['camera_main_mp', 'camera_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_performance_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phone',
+            name='camera_count',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='phone',
+            name='camera_main_mp',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='phone',
+            name='performance_index',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(parse_cameras, migrations.RunPython.noop),
+    ]
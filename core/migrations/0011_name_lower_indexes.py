@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:34
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_phone_scoring'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cpu',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='cpu_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gpu',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='gpu_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phone',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='phone_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ram',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='ram_name_lower_idx'),
+        ),
+    ]
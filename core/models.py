@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models.functions import Lower
+
+from core.camera import parse_camera_mp
 
 
 class CPU(models.Model):
@@ -12,6 +15,11 @@ class CPU(models.Model):
     tdp_watts = models.IntegerField()
     architecture_generation = models.CharField(max_length=255)
     ipc = models.FloatField(help_text="Instructions per clock")
+    performance_index = models.FloatField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        # compare_cache resolves names case-insensitively
+        indexes = [models.Index(Lower("name"), name="cpu_name_lower_idx")]
 
     def __str__(self):
         return self.name
@@ -26,6 +34,10 @@ class GPU(models.Model):
     architecture = models.CharField(max_length=255)
     ray_tracing_support = models.BooleanField(default=False)
     release_year = models.IntegerField()
+    performance_index = models.FloatField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(Lower("name"), name="gpu_name_lower_idx")]
 
     def __str__(self):
         return self.name
@@ -36,6 +48,10 @@ class RAM(models.Model):
     size_gb = models.IntegerField()
     speed_mhz = models.IntegerField()
     type = models.CharField(max_length=50)
+    performance_index = models.FloatField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(Lower("name"), name="ram_name_lower_idx")]
 
     def __str__(self):
         return self.name
@@ -68,6 +84,20 @@ class Phone(models.Model):
     screen_type = models.CharField(max_length=255,blank=True,null=True)
     battery = models.IntegerField(blank=True,null=True)
     year = models.IntegerField(blank=True,null=True)
+    camera_main_mp = models.FloatField(blank=True, null=True, editable=False)
+    camera_count = models.IntegerField(blank=True, null=True, editable=False)
+    performance_index = models.FloatField(default=0, db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.camera_main_mp, self.camera_count = parse_camera_mp(self.camera_mp)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "camera_mp" in update_fields:
+            # the derived columns (and the score built on them) follow camera_mp
+            kwargs["update_fields"] = {*update_fields, "camera_main_mp", "camera_count", "performance_index"}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [models.Index(Lower("name"), name="phone_name_lower_idx")]
 
     def __str__(self):
         return self.name
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+List ordering by performance_index that stays right while the stored
+column is out of date (indexing.py): the rows are then sorted by their live
+scores from compare.catalog_subset and loaded a page at a time.
+"""
+import numpy as np
+from rest_framework.filters import OrderingFilter
+
+from core.compare import catalog_subset, index_is_current
+
+FIELD = "performance_index"
+
+
+class ScoreOrdered:
+    """Rows of model in a fixed pk order, loaded per slice (a page)"""
+
+    def __init__(self, model, pks):
+        self.model = model
+        self.pks = pks
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __getitem__(self, index):
+        pks = self.pks[index].tolist() if isinstance(index, slice) else [int(self.pks[index])]
+        objs = self.model.objects.in_bulk(pks)
+        rows = [objs[pk] for pk in pks if pk in objs]
+        return rows if isinstance(index, slice) else rows[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class ScoreOrderingFilter(OrderingFilter):
+    """OrderingFilter that sorts by the live scores while the stored
+    performance_index is not current"""
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        model = queryset.model
+        if not ordering or ordering[0].lstrip("-") != FIELD or index_is_current(model):
+            return super().filter_queryset(request, queryset, view)
+
+        pks, scores = catalog_subset(model, list(queryset.values_list("pk", flat=True)))
+        order = np.argsort(-scores if ordering[0].startswith("-") else scores, kind="stable")
+        return ScoreOrdered(model, pks[order])
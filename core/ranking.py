@@ -0,0 +1,78 @@
+"""
+Leaderboards over the compare.py performance index.
+
+Each component table is kept in process memory sorted by score (best first)
+and rebuilt only when the catalog changes, so a top-K request reads the
+first K entries instead of scanning and sorting the table.
+"""
+import numpy as np
+
+from core.compare import catalog_key, catalog_scores
+
+MAX_K = 100
+
+_sorted = {}
+
+
+def sorted_catalog(model):
+    """(pks, feature matrix, scores) ordered by descending score"""
+    key = catalog_key(model)
+    entry = _sorted.get(model)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    pks, matrix, scores = catalog_scores(model)
+    order = np.argsort(-scores, kind="stable")
+    data = (pks[order], matrix[order], scores[order])
+    _sorted[model] = (key, data)
+    return data
+
+
+def range_filters(features, params) -> dict:
+    """{column: (min, max)} from min_<field>/max_<field> query params.
+
+    Raises ValueError for a bound that is not a number.
+    """
+    ranges = {}
+    for j, feature in enumerate(features):
+        if feature.encode is not None:
+            continue
+        lo = params.get(f"min_{feature.field}")
+        hi = params.get(f"max_{feature.field}")
+        if lo is None and hi is None:
+            continue
+        try:
+            ranges[j] = (
+                float(lo) if lo is not None else -np.inf,
+                float(hi) if hi is not None else np.inf,
+            )
+        except ValueError:
+            raise ValueError(f"{feature.field} bounds must be numbers")
+    return ranges
+
+
+def range_mask(matrix, ranges) -> np.ndarray:
+    mask = np.ones(len(matrix), dtype=bool)
+    for j, (lo, hi) in ranges.items():
+        mask &= (matrix[:, j] >= lo) & (matrix[:, j] <= hi)
+    return mask
+
+
+def top_k(model, k: int, ranges: dict = None):
+    """(pks, scores) of the k best components inside ranges"""
+    pks, matrix, scores = sorted_catalog(model)
+    if not ranges:
+        return pks[:k], scores[:k]
+
+    # walk the sorted order in blocks so loose filters stay close to O(k)
+    block = max(4 * k, 256)
+    hits = []
+    found = 0
+    for start in range(0, len(pks), block):
+        idx = start + np.flatnonzero(range_mask(matrix[start:start + block], ranges))
+        hits.append(idx)
+        found += len(idx)
+        if found >= k:
+            break
+    idx = np.concatenate(hits)[:k] if hits else np.empty(0, dtype=np.int64)
+    return pks[idx], scores[idx]
@@ -0,0 +1,168 @@
+"""
+Token bucket in Redis shared by every process that calls OpenRouter.
+
+The bucket refills at OPENROUTER_RATE_LIMIT requests per second up to
+OPENROUTER_RATE_BURST tokens. A caller that finds it empty does not get
+rejected: it reserves the next free slot (the bucket goes into debt) and
+sleeps until then, so queued callers go out in order at the quota rate
+instead of bursting into 429s. Only a wait longer than
+OPENROUTER_RATE_MAX_WAIT is refused with RateLimited, which callers treat
+like an open breaker and serve their deterministic result.
+
+The bucket is kept on the Redis clock (TIME inside the script), so hosts
+with skewed clocks still share one schedule. A 429 from OpenRouter empties
+the bucket, so no worker bursts into the quota again right after it.
+"""
+import asyncio
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from core import deadlines
+from core.breaker import LLMUnavailable
+
+BUCKET_KEY = "llm:ratelimit:bucket"
+QUEUE_KEY = "llm:ratelimit:queue"
+STATS_KEY = "llm:ratelimit:stats"
+
+# KEYS[1] bucket; ARGV rate, burst, cost, max wait, "drain"
+# -> {1 if granted, seconds to wait for the slot}
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+
+local granted = 1
+local wait = 0
+if ARGV[5] == 'drain' then
+    tokens = math.min(tokens, 0)
+else
+    if tokens < cost then
+        wait = (cost - tokens) / rate
+    end
+    if wait > max_wait then
+        granted = 0
+    else
+        tokens = tokens - cost
+    end
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return {granted, tostring(wait)}
+"""
+
+_script = None
+
+
+class RateLimited(LLMUnavailable):
+    """The shared OpenRouter quota is booked up for longer than
+    OPENROUTER_RATE_MAX_WAIT"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OpenRouter rate limit reached, retry in {retry_after}s", retry_after)
+
+
+def enabled() -> bool:
+    return settings.OPENROUTER_RATE_LIMIT > 0
+
+
+def _run(cost: float, max_wait: float, mode: str = "take"):
+    global _script
+    conn = get_redis_connection("default")
+    if _script is None:
+        _script = conn.register_script(TOKEN_BUCKET)
+    granted, wait = _script(keys=[BUCKET_KEY], args=[settings.OPENROUTER_RATE_LIMIT, settings.OPENROUTER_RATE_BURST,
+                                                    cost, max_wait, mode], client=conn)
+    return bool(int(granted)), float(wait)
+
+
+def _reserve() -> float:
+    """Seconds until this caller's slot; raises RateLimited"""
+    granted, wait = _run(1, deadlines.cap(settings.OPENROUTER_RATE_MAX_WAIT))
+    conn = get_redis_connection("default")
+    if not granted:
+        conn.hincrby(STATS_KEY, "rejected", 1)
+        raise RateLimited(math.ceil(wait))
+    pipe = conn.pipeline()
+    pipe.hincrby(STATS_KEY, "granted", 1)
+    if wait > 0:
+        pipe.hincrby(STATS_KEY, "queued", 1)
+        pipe.hincrbyfloat(STATS_KEY, "wait_seconds", wait)
+        pipe.incr(QUEUE_KEY)
+    pipe.execute()
+    return wait
+
+
+def _dequeue():
+    get_redis_connection("default").decr(QUEUE_KEY)
+
+
+def acquire() -> float:
+    """Block until a request may go out; returns the seconds waited"""
+    if not enabled():
+        return 0.0
+    wait = _reserve()
+    if wait > 0:
+        try:
+            time.sleep(wait)
+        finally:
+            _dequeue()
+    return wait
+
+
+async def aacquire() -> float:
+    """acquire() for async callers; the wait does not hold a thread"""
+    if not enabled():
+        return 0.0
+    wait = await sync_to_async(_reserve, thread_sensitive=False)()
+    if wait > 0:
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            await sync_to_async(_dequeue, thread_sensitive=False)()
+    return wait
+
+
+def drain():
+    """OpenRouter answered 429: drop the saved-up burst for every process"""
+    if not enabled():
+        return
+    try:
+        _run(0, 0, "drain")
+    except Exception as e:
+        print(f"Could not drain the OpenRouter rate limiter: {e}")
+
+
+adrain = sync_to_async(drain, thread_sensitive=False)
+
+
+def stats() -> dict:
+    """Queue depth and wait times since the counters were created"""
+    conn = get_redis_connection("default")
+    raw = conn.hgetall(STATS_KEY)
+    values = {key.decode(): float(value) for key, value in raw.items()}
+    granted = int(values.get("granted", 0))
+    queued = int(values.get("queued", 0))
+    return {
+        "enabled": enabled(),
+        "rate": settings.OPENROUTER_RATE_LIMIT,
+        "burst": settings.OPENROUTER_RATE_BURST,
+        "queue_depth": max(int(conn.get(QUEUE_KEY) or 0), 0),
+        "granted": granted,
+        "queued": queued,
+        "rejected": int(values.get("rejected", 0)),
+        "wait_seconds": round(values.get("wait_seconds", 0), 3),
+        "avg_wait_seconds": round(values.get("wait_seconds", 0) / queued, 3) if queued else 0.0,
+    }
@@ -0,0 +1,182 @@
+"""
+Min/max normalization scales used by the compare.py scoring.
+
+Scales are kept per catalog model in process memory and in the default
+(Redis) cache and are maintained incrementally from the model signals in
+core/signals.py, so compare requests never aggregate over the whole table.
+A process re-reads the shared copy whenever the catalog version moves.
+
+Writers change the shared copy under a lock next to it (cache.add), so two
+processes saving at once cannot lose each other's min/max widening.
+"""
+import contextlib
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from core.catalog import catalog_version
+from core.engine import value as field_value
+from core.models import CPU, GPU, RAM, Phone
+
+# short key used in the scales dict (min_<key>/max_<key>) -> model field
+SCALE_FIELDS = {
+    CPU: {
+        "cc": "core_count",
+        "cs": "clock_speed_ghz",
+        "ipc": "ipc",
+        "tc": "thread_count",
+        "tdp": "tdp_watts",
+    },
+    GPU: {
+        "cc": "core_count",
+        "ck": "core_clock_ghz",
+        "bw": "memory_bandwidth_gbps",
+        "vram": "vram_gb",
+    },
+    RAM: {
+        "sz": "size_gb",
+        "sp": "speed_mhz",
+    },
+    Phone: {
+        "ram": "ram_size",
+        "mem": "memory_size",
+        "yr": "year",
+        "cam": "camera_main_mp",
+        "lens": "camera_count",
+        "bat": "battery",
+        "brand": "brand__coefficient",
+    },
+}
+
+LOCK_TIMEOUT = 10  # seconds; a crashed writer's lock expires on its own
+LOCK_WAIT = 5  # seconds a writer waits for the lock
+
+_local = {}
+
+
+def _cache_key(model):
+    return f"scales:{model._meta.label_lower}"
+
+
+def _aggregate(model):
+    aggs = {}
+    for key, field in SCALE_FIELDS[model].items():
+        aggs[f"min_{key}"] = Min(field)
+        aggs[f"max_{key}"] = Max(field)
+    return model.objects.aggregate(**aggs)
+
+
+def _store(model, scales):
+    cache.set(_cache_key(model), scales, None)
+    _local[model] = (catalog_version(model), scales)
+
+
+def get_scales(model) -> dict:
+    version = catalog_version(model)
+    entry = _local.get(model)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    scales = cache.get(_cache_key(model))
+    if scales is None:
+        scales = _aggregate(model)
+        _store(model, scales)
+    else:
+        _local[model] = (version, scales)
+    return scales
+
+
+@contextlib.contextmanager
+def _locked(model):
+    """Hold the scales lock of model for the block"""
+    key = f"{_cache_key(model)}:lock"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            # better unlocked than a failed save; the next rebuild evens it out
+            print(f"Could not lock the {model.__name__} scales, updating them unlocked")
+            break
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def _shared(model) -> dict:
+    """The shared copy as it is now (callers hold the lock)"""
+    scales = cache.get(_cache_key(model))
+    if scales is None:
+        scales = _aggregate(model)
+        _store(model, scales)
+    return scales
+
+
+def rebuild_scales(model) -> dict:
+    with _locked(model):
+        scales = _aggregate(model)
+        _store(model, scales)
+    return scales
+
+
+def old_values(instance) -> dict:
+    """Scoring field values currently stored for instance (empty for new rows)"""
+    model = type(instance)
+    if instance.pk is None or instance._state.adding:
+        return {}
+    return model.objects.filter(pk=instance.pk).values(*SCALE_FIELDS[model].values()).first() or {}
+
+
+def update_on_save(instance, previous: dict) -> bool:
+    """Fold a saved row into the scales; returns True if they changed"""
+    model = type(instance)
+    with _locked(model):
+        current = _shared(model)
+        scales = dict(current)
+        changed = False
+
+        for key, field in SCALE_FIELDS[model].items():
+            value = field_value(instance, field)
+            min_k, max_k = f"min_{key}", f"max_{key}"
+            lo, hi = scales[min_k], scales[max_k]
+            old = previous.get(field)
+
+            # the row holding an extremum moved inward (or lost the value): only
+            # a rescan can tell which row holds it now
+            if old is not None and ((old == lo and (value is None or value > lo))
+                                    or (old == hi and (value is None or value < hi))):
+                scales = _aggregate(model)
+                _store(model, scales)
+                return scales != current
+            # NULL specs (phones) do not take part in the scales
+            if value is None:
+                continue
+
+            if lo is None or value < lo:
+                scales[min_k] = value
+                changed = True
+            if hi is None or value > hi:
+                scales[max_k] = value
+                changed = True
+
+        if changed:
+            _store(model, scales)
+        return changed
+
+
+def update_on_delete(instance) -> bool:
+    """Drop a deleted row from the scales; returns True if they changed"""
+    model = type(instance)
+    with _locked(model):
+        current = _shared(model)
+        for key, field in SCALE_FIELDS[model].items():
+            value = field_value(instance, field)
+            if value is not None and value in (current[f"min_{key}"], current[f"max_{key}"]):
+                scales = _aggregate(model)
+                _store(model, scales)
+                return scales != current
+    return False
@@ -1,24 +1,43 @@
 from rest_framework import serializers
+from .compare import performance_indexes
 from .models import CPU, GPU, RAM, Needs, Phone
 
+
+class PerformanceIndexField(serializers.Field):
+    """The stored performance_index while it is current, else the live score
+    (the same value compare and top report)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(source="*", read_only=True, **kwargs)
+
+    def to_representation(self, obj):
+        return performance_indexes(type(obj), [obj])[0]
+
+
 class NeedsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Needs
         fields = '__all__'
 
 class CPUSerializer(serializers.ModelSerializer):
+    performance_index = PerformanceIndexField()
+
     class Meta:
         model = CPU
         fields = '__all__'
 
 
 class GPUSerializer(serializers.ModelSerializer):
+    performance_index = PerformanceIndexField()
+
     class Meta:
         model = GPU
         fields = '__all__'
 
 
 class RAMSerializer(serializers.ModelSerializer):
+    performance_index = PerformanceIndexField()
+
     class Meta:
         model = RAM
         fields = '__all__'
@@ -0,0 +1,48 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from core import scales
+from core.models import BrandsCoefficients, Phone
+from core.catalog import bump_catalog_version
+from core.compare import score_objects
+from core.indexing import recompute_on_commit
+
+
+def _before_component_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._scale_previous = scales.old_values(instance)
+    instance.performance_index = float(score_objects(sender, [instance])[0])
+
+
+def _after_component_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        scales.rebuild_scales(sender)
+        changed = True
+    else:
+        changed = scales.update_on_save(instance, getattr(instance, "_scale_previous", {}))
+    bump_catalog_version(sender, instance.pk)
+    if changed:
+        recompute_on_commit(sender)
+
+
+def _after_component_delete(sender, instance, **kwargs):
+    changed = scales.update_on_delete(instance)
+    bump_catalog_version(sender, instance.pk)
+    if changed:
+        recompute_on_commit(sender)
+
+
+def _after_brand_write(sender, instance, **kwargs):
+    # every phone of the brand moves, and its stored score with it
+    scales.rebuild_scales(Phone)
+    bump_catalog_version(Phone)
+    recompute_on_commit(Phone)
+
+
+post_save.connect(_after_brand_write, sender=BrandsCoefficients, dispatch_uid="scales-post-save-BrandsCoefficients")
+post_delete.connect(_after_brand_write, sender=BrandsCoefficients, dispatch_uid="scales-post-delete-BrandsCoefficients")
+
+for _model in scales.SCALE_FIELDS:
+    pre_save.connect(_before_component_save, sender=_model, dispatch_uid=f"scales-pre-save-{_model.__name__}")
+    post_save.connect(_after_component_save, sender=_model, dispatch_uid=f"scales-post-save-{_model.__name__}")
+    post_delete.connect(_after_component_delete, sender=_model, dispatch_uid=f"scales-post-delete-{_model.__name__}")
@@ -0,0 +1,170 @@
+"""
+Nearest-neighbour search over normalized spec vectors.
+
+Every table lives in the same 0-100 feature space its compare.py indexes
+are built from. Each table gets an in-memory KD-tree. Rows written after
+the tree was built (catalog.changed_pks) are folded in without a rebuild:
+their old tree entries are hidden and the new values go to a small overflow
+set that is searched by brute force next to the tree. The tree is rebuilt
+when the scales move, when the change log does not cover the writes, or
+once the overflow outgrows REBUILD_SHARE of the table. A space is never
+changed once built: catching up makes a new one next to the same tree, and
+the swap happens under a lock, so a request keeps a consistent snapshot.
+
+A missing spec (phones) counts as the catalog average of its feature, and
+rows with fewer than MIN_KNOWN_SHARE of their features known are never
+offered as neighbours, so a phone without specs does not sit next to
+every other one.
+"""
+import copy
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from core.catalog import catalog_version, changed_pks
+from core.compare import SCORING, catalog_scores, index_version
+from core.engine import fields, matrix_from_rows, normalize
+from core.ranking import range_mask
+from core.scales import get_scales
+
+MIN_KNOWN_SHARE = 0.5
+# overflow rows (share of the tree) beyond which the tree is rebuilt
+REBUILD_SHARE = 0.1
+MIN_REBUILD = 64
+
+_spaces = {}
+_lock = threading.Lock()
+
+
+def features_for(model):
+    return SCORING[model][0]
+
+
+class _Space:
+    """KD-tree over a table plus the rows written since it was built"""
+
+    def __init__(self, model, version, pks, matrix):
+        self.model = model
+        self.version = version
+        self.scales_version = index_version(model)
+        features = features_for(model)
+        points = normalize(matrix, features, get_scales(model))
+        missing = np.isnan(matrix)
+        # column averages over the known values, for the missing ones
+        known = (~missing).sum(axis=0)
+        self.means = np.where(missing, 0, points).sum(axis=0) / np.maximum(known, 1)
+        self.pks = pks
+        self.matrix = matrix
+        self.points = np.where(missing, self.means, points)
+        self.candidate = self._candidates(missing)
+        self.tree_size = len(pks)
+        self.tree = cKDTree(self.points) if len(pks) else None
+        self.rows = {pk: i for i, pk in enumerate(pks.tolist())}
+
+    @staticmethod
+    def _candidates(missing) -> np.ndarray:
+        if not missing.shape[1]:
+            return np.ones(len(missing), dtype=bool)
+        return (~missing).mean(axis=1) >= MIN_KNOWN_SHARE
+
+    def overflow(self) -> int:
+        return len(self.pks) - self.tree_size
+
+    def updated(self, version, pks):
+        """A copy with the rows written since the build folded in, or None if
+        a rebuild is due"""
+        space = copy.copy(self)
+        space.version = version
+        space.rows = dict(self.rows)
+        space.candidate = self.candidate.copy()
+        features = features_for(self.model)
+        for pk in pks:
+            row = space.rows.pop(pk, None)
+            if row is not None:
+                space.candidate[row] = False
+        rows = list(self.model.objects.filter(pk__in=pks).order_by("pk").values_list("pk", *fields(features)))
+        if rows:
+            new_pks = np.array([row[0] for row in rows], dtype=np.int64)
+            matrix = matrix_from_rows((row[1:] for row in rows), features)
+            missing = np.isnan(matrix)
+            points = np.where(missing, self.means, normalize(matrix, features, get_scales(self.model)))
+            for i, pk in enumerate(new_pks.tolist()):
+                space.rows[pk] = len(self.pks) + i
+            space.pks = np.concatenate([self.pks, new_pks])
+            space.matrix = np.concatenate([self.matrix, matrix])
+            space.points = np.concatenate([self.points, points])
+            space.candidate = np.concatenate([space.candidate, self._candidates(missing)])
+        if space.overflow() > max(MIN_REBUILD, REBUILD_SHARE * self.tree_size):
+            return None
+        return space
+
+    def nearest(self, row: int, want: int, mask) -> tuple:
+        """(rows, distances) of the want nearest rows passing mask"""
+        point = self.points[row]
+        found_rows, found_dist = [], []
+
+        if self.tree is not None:
+            in_tree = mask[:self.tree_size]
+            target = min(want, int(in_tree.sum()))
+            # ask for more neighbours until enough of them pass the filters
+            n = min(target + 1, self.tree_size)
+            while target:
+                dist, idx = self.tree.query(point, k=n)
+                dist, idx = np.atleast_1d(dist), np.atleast_1d(idx)
+                keep = in_tree[idx]
+                if keep.sum() >= target or n == self.tree_size:
+                    found_rows.append(idx[keep][:target])
+                    found_dist.append(dist[keep][:target])
+                    break
+                n = min(n * 4, self.tree_size)
+
+        extra = self.tree_size + np.flatnonzero(mask[self.tree_size:])
+        if len(extra):
+            found_rows.append(extra)
+            found_dist.append(np.linalg.norm(self.points[extra] - point, axis=1))
+
+        if not found_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        rows, dist = np.concatenate(found_rows), np.concatenate(found_dist)
+        order = np.argsort(dist, kind="stable")[:want]
+        return rows[order], dist[order]
+
+
+def _space(model) -> _Space:
+    version = catalog_version(model)
+    space = _spaces.get(model)
+    if space is not None and space.version == version:
+        return space
+
+    with _lock:
+        # another request may have caught up while this one waited
+        space = _spaces.get(model)
+        if space is not None and space.version == version:
+            return space
+        fresh = None
+        if space is not None and space.scales_version == index_version(model):
+            pks = changed_pks(model, space.version, version)
+            if pks is not None:
+                fresh = space.updated(version, pks)
+        if fresh is None:
+            pks, matrix, _ = catalog_scores(model)
+            fresh = _Space(model, version, pks, matrix)
+        _spaces[model] = fresh
+        return fresh
+
+
+def similar(model, pk: int, k: int, ranges: dict = None):
+    """(pks, distances) of the k nearest neighbours of pk inside ranges,
+    or None if pk is not in the catalog"""
+    space = _space(model)
+    row = space.rows.get(pk)
+    if row is None:
+        return None
+
+    mask = space.candidate.copy()
+    if ranges:
+        mask &= range_mask(space.matrix, ranges)
+    mask[row] = False
+    rows, dist = space.nearest(row, k, mask)
+    return space.pks[rows], dist
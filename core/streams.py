@@ -0,0 +1,149 @@
+"""
+Generators for the streaming endpoints.
+
+Everything here yields a chunk at a time so a StreamingHttpResponse can
+send large results without building them in memory, or (for the SSE
+streams) send each piece of an answer as soon as it exists.
+"""
+import csv
+import io
+import json
+import struct
+
+import numpy as np
+
+from core.ai import astream_comparison, stream_comparison
+from core.builds import enrich_with_llm
+from core.compare import SCORING, index_is_current, score_rows
+from core.engine import fields
+
+# matrix cells computed per broadcast block
+MATRIX_BLOCK_CELLS = 1_000_000
+
+# rows fetched from the database (and scored) per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _matrix_blocks(scores):
+    n = len(scores)
+    rows = max(1, MATRIX_BLOCK_CELLS // max(n, 1))
+    for start in range(0, n, rows):
+        # block[i][j] = scores[start + i] - scores[j]
+        yield start, scores[start:start + rows, None] - scores[None, :]
+
+
+def matrix_ndjson(pks, scores):
+    """A header line with the ids, then one {"id", "deltas"} line per row"""
+    yield (json.dumps({"ids": pks.tolist()}) + "\n").encode()
+    for start, block in _matrix_blocks(scores):
+        ids = pks[start:start + len(block)].tolist()
+        lines = [json.dumps({"id": pk, "deltas": row}) for pk, row in zip(ids, np.round(block, 2).tolist())]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def matrix_float32(pks, scores):
+    """uint32 n, n int64 ids, then the n x n float32 deltas row by row (little-endian)"""
+    yield struct.pack("<I", len(pks)) + pks.astype("<i8").tobytes()
+    for _, block in _matrix_blocks(scores):
+        yield block.astype("<f4").tobytes()
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_chunks(queryset, columns, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Lists of row dicts for queryset, chunk by chunk.
+
+    For scored models performance_index is the stored value while it is
+    current and is scored per chunk otherwise, so memory use does not grow
+    with the table.
+    """
+    model = queryset.model
+    rows = queryset.order_by("pk").values(*columns).iterator(chunk_size=chunk_size)
+    features = SCORING[model][0] if model in SCORING else None
+    stored = features is None or index_is_current(model)
+
+    for chunk in _chunked(rows, chunk_size):
+        if not stored:
+            scores = score_rows(model, ([row[f] for f in fields(features)] for row in chunk))
+            for row, value in zip(chunk, scores.tolist()):
+                row["performance_index"] = value
+        if features is not None:
+            for row in chunk:
+                row["performance_index"] = round(row["performance_index"], 2)
+        yield chunk
+
+
+def export_ndjson(chunks):
+    for chunk in chunks:
+        yield ("".join(json.dumps(row, default=str) + "\n" for row in chunk)).encode()
+
+
+def export_csv(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def sse(event: str, data) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _llm_frames(local: dict, event: str, data, name_key: str) -> list:
+    if event == "done":
+        data = enrich_with_llm(local, data, name_key)
+    frames = [sse(event, data)]
+    if event == "error":
+        frames.append(sse("done", {**local, "degraded": True}))
+    return frames
+
+
+def _local_then_llm_sse(local: dict, prompt, name_key: str):
+    yield sse("local", local)
+    for event, data in stream_comparison(prompt):
+        yield from _llm_frames(local, event, data, name_key)
+
+
+async def _alocal_then_llm_sse(local: dict, prompt, name_key: str):
+    yield sse("local", local)
+    async for event, data in astream_comparison(prompt):
+        for frame in _llm_frames(local, event, data, name_key):
+            yield frame
+
+
+def pc_compare_sse(local: dict, prompt):
+    """The local scores first, then the LLM's wording; `done` carries the
+    enriched result, or the local one if the LLM failed. For WSGI: the
+    wording arrives in one piece once the whole completion is in"""
+    return _local_then_llm_sse(local, prompt, "pc_name")
+
+
+def apc_compare_sse(local: dict, prompt):
+    """pc_compare_sse for ASGI, with the wording sent as it streams in"""
+    return _alocal_then_llm_sse(local, prompt, "pc_name")
+
+
+def phone_compare_sse(local: dict, prompt):
+    """pc_compare_sse for phones"""
+    return _local_then_llm_sse(local, prompt, "phone_name")
+
+
+def aphone_compare_sse(local: dict, prompt):
+    """apc_compare_sse for phones"""
+    return _alocal_then_llm_sse(local, prompt, "phone_name")
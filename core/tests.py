@@ -1,3 +1,1700 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import struct
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django_redis import get_redis_connection
+
+from core import (admission, ai, breaker, builds, catalog, compare, compare_cache, deadlines, hedging, indexing, jobs,
+                  llm_cache, llm_client, ranking, ratelimit, scales, similar, streams)
+from core.camera import parse_camera_mp
+from core.compare import CPU_FEATURES, WEIGHTS
+from core.compare_cache import _prepare, reorient
+from core.engine import Feature, matrix_from_rows, normalize, score
+from core.json_stream import FieldParser
+from core.models import CPU, GPU, RAM, BrandsCoefficients, Needs, Phone
+
+# tests that only need a cache run on this one, the others on the configured Redis
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# key prefixes the app writes to Redis, directly or through the cache (":<version>:" in front)
+APP_PREFIXES = ("llm:", "jobs:", "compare:", "performance-index:", "catalog:", "scales:")
+
+
+def _clear_redis():
+    """Drop the app's keys, not the whole database"""
+    conn = get_redis_connection("default")
+    for prefix in APP_PREFIXES:
+        for pattern in (f"{prefix}*", f":*:{prefix}*"):
+            keys = list(conn.scan_iter(pattern))
+            if keys:
+                conn.delete(*keys)
+
+
+def _forget_local_state():
+    """An empty cache and no per-process copies of what was in it"""
+    if settings.CACHES["default"]["BACKEND"].startswith("django_redis"):
+        _clear_redis()
+    else:
+        cache.clear()
+    scales._local.clear()
+    catalog._local.clear()
+    compare._catalog.clear()
+    ranking._sorted.clear()
+    similar._spaces.clear()
+    admission._semaphore = admission._async_semaphore = None
+
+
+def random_cpus(count, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        cores = int(rng.choice([4, 6, 8, 12, 16, 24]))
+        make_cpu(f"CPU {i}", core_count=cores, thread_count=cores * int(rng.choice([1, 2])),
+                 clock_speed_ghz=round(float(rng.uniform(2.5, 5.5)), 1), ipc=round(float(rng.uniform(0.8, 1.6)), 2),
+                 tdp_watts=int(rng.choice([35, 65, 105, 125, 170])))
+
+
+def make_cpu(name, **specs):
+    values = {"clock_speed_ghz": 3.5, "core_count": 8, "thread_count": 16, "cache_size_l1": 512,
+              "cache_size_l2": 4096, "cache_size_l3": 32768, "tdp_watts": 105, "architecture_generation": "Zen 3",
+              "ipc": 1.2}
+    values.update(specs)
+    return CPU.objects.create(name=name, **values)
+
+
+def make_gpu(name, **specs):
+    values = {"vram_gb": 8, "core_count": 4096, "core_clock_ghz": 1.8, "memory_bandwidth_gbps": 448,
+              "architecture": "Ampere", "ray_tracing_support": True, "release_year": 2021}
+    values.update(specs)
+    return GPU.objects.create(name=name, **values)
+
+
+def make_ram(name, **specs):
+    values = {"size_gb": 16, "speed_mhz": 3200, "type": "DDR4"}
+    values.update(specs)
+    return RAM.objects.create(name=name, **values)
+
+
+def random_parts(count, seed=0):
+    """count CPUs, GPUs and RAM kits"""
+    random_cpus(count, seed)
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        make_gpu(f"GPU {i}", vram_gb=int(rng.choice([6, 8, 12, 16, 24])), core_count=int(rng.integers(2000, 16000)),
+                 core_clock_ghz=round(float(rng.uniform(1.2, 2.6)), 2),
+                 memory_bandwidth_gbps=int(rng.integers(200, 1000)), ray_tracing_support=bool(rng.integers(2)))
+        make_ram(f"RAM {i}", size_gb=int(rng.choice([8, 16, 32, 64])), speed_mhz=int(rng.choice([2666, 3200, 3600, 6000])),
+                 type=str(rng.choice(["DDR4", "DDR5"])))
+
+
+# =====Scales=====
+@override_settings(CACHES=LOCMEM)
+class ScalesTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        self.small = make_cpu("Small", core_count=4, tdp_watts=65)
+        self.mid = make_cpu("Mid", core_count=8, tdp_watts=105)
+        self.big = make_cpu("Big", core_count=16, tdp_watts=170)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_scales_follow_saves(self):
+        found = scales.get_scales(CPU)
+        self.assertEqual((found["min_cc"], found["max_cc"]), (4, 16))
+        self.assertEqual((found["min_tdp"], found["max_tdp"]), (65, 170))
+
+        make_cpu("Bigger", core_count=24)
+        self.assertEqual(scales.get_scales(CPU)["max_cc"], 24)
+
+    def test_deleting_the_max_rescans(self):
+        self.big.delete()
+        found = scales.get_scales(CPU)
+        self.assertEqual(found["max_cc"], 8)
+        self.assertEqual(found["max_tdp"], 105)
+
+    def test_deleting_the_min_rescans(self):
+        self.small.delete()
+        found = scales.get_scales(CPU)
+        self.assertEqual(found["min_cc"], 8)
+        self.assertEqual(found["min_tdp"], 105)
+
+    def test_moving_the_max_inward_rescans(self):
+        self.big.core_count = 6
+        self.big.save()
+        self.assertEqual(scales.get_scales(CPU)["max_cc"], 8)
+
+    def test_matches_a_full_aggregate(self):
+        self.mid.delete()
+        make_cpu("Other", core_count=12, clock_speed_ghz=5.0, ipc=1.5)
+        self.big.delete()
+        self.assertEqual(scales.get_scales(CPU), scales._aggregate(CPU))
+
+
+# =====Engine=====
+def _normalize(value, min_v, max_v):
+    if max_v == min_v:
+        return 100.0
+    return 100 * (value - min_v) / (max_v - min_v)
+
+
+def baseline_cpu_index(cpu: dict, s: dict) -> float:
+    """The per-CPU formula compare.py used before engine.py"""
+    cc = _normalize(cpu["core_count"], s["min_cc"], s["max_cc"])
+    cs = _normalize(cpu["clock_speed_ghz"], s["min_cs"], s["max_cs"])
+    ipc = _normalize(cpu["ipc"], s["min_ipc"], s["max_ipc"])
+    tc = _normalize(cpu["thread_count"], s["min_tc"], s["max_tc"])
+    tdp = 100 - _normalize(cpu["tdp_watts"], s["min_tdp"], s["max_tdp"])
+    return (cc * WEIGHTS["core_count"] + cs * WEIGHTS["clock_speed"] + ipc * WEIGHTS["ipc"]
+            + tc * WEIGHTS["thread_count"] + tdp * WEIGHTS["tdp_efficiency"])
+
+
+class EngineTests(SimpleTestCase):
+    # every CPU has 16 threads: thread_count has no spread
+    cpus = [
+        {"core_count": 6, "clock_speed_ghz": 3.7, "ipc": 1.1, "thread_count": 16, "tdp_watts": 65},
+        {"core_count": 8, "clock_speed_ghz": 4.2, "ipc": 1.3, "thread_count": 16, "tdp_watts": 105},
+        {"core_count": 16, "clock_speed_ghz": 5.1, "ipc": 1.5, "thread_count": 16, "tdp_watts": 170},
+    ]
+
+    def scales_of(self, cpus):
+        found = {}
+        for key, field in (("cc", "core_count"), ("cs", "clock_speed_ghz"), ("ipc", "ipc"), ("tc", "thread_count"),
+                           ("tdp", "tdp_watts")):
+            found[f"min_{key}"] = min(cpu[field] for cpu in cpus)
+            found[f"max_{key}"] = max(cpu[field] for cpu in cpus)
+        return found
+
+    def test_score_matches_the_baseline_formula(self):
+        s = self.scales_of(self.cpus)
+        matrix = matrix_from_rows(([cpu[f.field] for f in CPU_FEATURES] for cpu in self.cpus), CPU_FEATURES)
+        expected = [baseline_cpu_index(cpu, s) for cpu in self.cpus]
+        np.testing.assert_allclose(score(matrix, CPU_FEATURES, s, WEIGHTS), expected)
+
+    def test_flat_feature_scores_full_and_tdp_is_inverted(self):
+        s = self.scales_of(self.cpus)
+        coolest = matrix_from_rows([[self.cpus[0][f.field] for f in CPU_FEATURES]], CPU_FEATURES)
+        hottest = matrix_from_rows([[self.cpus[2][f.field] for f in CPU_FEATURES]], CPU_FEATURES)
+        only_threads = {"core_count": 0, "clock_speed": 0, "ipc": 0, "thread_count": 1, "tdp_efficiency": 0}
+        only_tdp = {"core_count": 0, "clock_speed": 0, "ipc": 0, "thread_count": 0, "tdp_efficiency": 1}
+
+        self.assertEqual(score(coolest, CPU_FEATURES, s, only_threads)[0], 100.0)
+        self.assertEqual(score(coolest, CPU_FEATURES, s, only_tdp)[0], 100.0)
+        self.assertEqual(score(hottest, CPU_FEATURES, s, only_tdp)[0], 0.0)
+
+    def test_missing_values_score_zero(self):
+        features = (Feature("a", "a", "a"), Feature("b", "b", "b"), Feature("c", "c", "c", invert=True))
+        # a and c have no spread
+        s = {"min_a": 5, "max_a": 5, "min_b": 0, "max_b": 10, "min_c": 1, "max_c": 1}
+        matrix = np.array([[5.0, 5.0, 1.0], [np.nan, np.nan, np.nan]])
+        np.testing.assert_array_equal(normalize(matrix, features, s), [[100, 50, 0], [0, 0, 0]])
+
+
+# =====Stored scores=====
+class StoredIndexTests(TestCase):
+    """Runs on the configured Redis (the pending set)"""
+
+    def setUp(self):
+        _forget_local_state()
+        # each row is scored on save against the scales before it: Ryzen 5
+        # alone (and Ryzen 9 next to it) sits on flat scales and scores high
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, cores in (("Ryzen 5", 6), ("Ryzen 9", 16), ("Ryzen 7", 8)):
+                make_cpu(name, core_count=cores, thread_count=cores * 2, clock_speed_ghz=3 + cores / 8)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def live(self):
+        pks, _, scores = compare.catalog_scores(CPU)
+        return dict(zip(CPU.objects.in_bulk(pks.tolist()).values(), scores.tolist()))
+
+    def test_writes_leave_a_recompute_pending(self):
+        conn = get_redis_connection("default")
+        self.assertEqual(conn.smembers(indexing.PENDING_KEY), {b"core.cpu"})
+        self.assertFalse(compare.index_is_current(CPU))
+
+        self.assertEqual(indexing.recompute_pending(), 3)
+        self.assertTrue(compare.index_is_current(CPU))
+        self.assertFalse(conn.exists(indexing.PENDING_KEY))
+        for cpu, score in self.live().items():
+            self.assertAlmostEqual(CPU.objects.get(pk=cpu.pk).performance_index, score)
+
+    def test_failed_recompute_stays_pending(self):
+        with mock.patch.object(indexing, "recompute_performance_index", side_effect=RuntimeError("db gone")), \
+                self.assertLogs("core.indexing", "ERROR"):
+            self.assertEqual(indexing.recompute_pending(), 0)
+        self.assertEqual(get_redis_connection("default").smembers(indexing.PENDING_KEY), {b"core.cpu"})
+
+    def test_list_orders_and_serializes_live_scores_while_stale(self):
+        stored = dict(CPU.objects.values_list("name", "performance_index"))
+        live = {cpu.name: score for cpu, score in self.live().items()}
+        self.assertNotEqual(sorted(stored, key=stored.get), sorted(live, key=live.get))
+
+        response = self.client.get("/core/cpu/?ordering=-performance_index")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([row["name"] for row in results], sorted(live, key=live.get, reverse=True))
+        for row in results:
+            self.assertAlmostEqual(row["performance_index"], live[row["name"]])
+
+    def test_list_uses_the_stored_column_once_current(self):
+        indexing.recompute_pending()
+        response = self.client.get("/core/cpu/?ordering=performance_index")
+        names = [row["name"] for row in response.json()["results"]]
+        self.assertEqual(names, list(CPU.objects.order_by("performance_index").values_list("name", flat=True)))
+
+
+# =====Top-K=====
+@override_settings(CACHES=LOCMEM)
+class TopKTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_cpus(60)
+        pks, matrix, scores = compare.catalog_scores(CPU)
+        self.rows = [(float(score), int(pk), row) for pk, row, score in zip(pks, matrix, scores)]
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def full_sort(self, keep=lambda row: True):
+        # best first, ties in pk order like the stable argsort
+        return [pk for score, pk, row in sorted(self.rows, key=lambda r: (-r[0], r[1])) if keep(row)]
+
+    def test_matches_a_full_sort(self):
+        for k in (1, 7, 60, 100):
+            pks, scores = ranking.top_k(CPU, k)
+            self.assertEqual(pks.tolist(), self.full_sort()[:k])
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_filters_match_a_full_sort(self):
+        cores = [f.field for f in CPU_FEATURES].index("core_count")
+        tdp = [f.field for f in CPU_FEATURES].index("tdp_watts")
+        ranges = ranking.range_filters(CPU_FEATURES, {"min_core_count": "12", "max_tdp_watts": "125"})
+        expected = self.full_sort(lambda row: row[cores] >= 12 and row[tdp] <= 125)
+        for k in (1, 3, 100):
+            self.assertEqual(ranking.top_k(CPU, k, ranges)[0].tolist(), expected[:k])
+
+    def test_endpoint(self):
+        response = self.client.get("/core/cpu/top?k=5&min_core_count=8")
+        self.assertEqual(response.status_code, 200)
+        cores = [f.field for f in CPU_FEATURES].index("core_count")
+        expected = self.full_sort(lambda row: row[cores] >= 8)[:5]
+        self.assertEqual([CPU.objects.get(name=row["name"]).pk for row in response.json()["results"]], expected)
+
+        self.assertEqual(self.client.get("/core/cpu/top?min_core_count=many").status_code, 400)
+
+
+# =====N-way compare=====
+@override_settings(CACHES=LOCMEM)
+class MultiCompareTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_cpus(12)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_ranks_with_one_query(self):
+        names = ["CPU 3", "CPU 0", "CPU 7", "CPU 11"]
+        objs = [CPU.objects.get(name=name) for name in names]
+        live = dict(zip(names, compare.score_objects(CPU, objs).tolist()))
+
+        with self.assertNumQueries(1):
+            data, missing = compare.get_cpu_multi_comparison_json(names)
+        self.assertEqual(missing, [])
+        self.assertEqual([row["name"] for row in data["ranking"]], sorted(names, key=live.get, reverse=True))
+        self.assertEqual([row["rank"] for row in data["ranking"]], [1, 2, 3, 4])
+        self.assertEqual(data["winner"], data["ranking"][0]["name"])
+        self.assertEqual(data["names"], names)
+        for i, a in enumerate(names):
+            for j, b in enumerate(names):
+                self.assertAlmostEqual(data["deltas"][i][j], live[a] - live[b], places=1)
+
+    def test_endpoint(self):
+        response = self.client.post("/core/compare_cpu/", {"names": ["CPU 1", "CPU 2", "CPU 1"]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["names"], ["CPU 1", "CPU 2"])
+
+        response = self.client.post("/core/compare_cpu/", {"names": ["CPU 1", "Pentium 4"]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["missing"], ["Pentium 4"])
+
+        for names in (["CPU 1"], "CPU 1", ["CPU 1", 2], [f"CPU {i}" for i in range(compare.MAX_COMPARE + 1)]):
+            response = self.client.post("/core/compare_cpu/", {"names": names}, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+
+# =====Similar=====
+@override_settings(CACHES=LOCMEM)
+class SimilarTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_cpus(80, seed=1)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def brute_force(self, pk, k):
+        """Distances to the k nearest rows, from the whole table"""
+        pks, matrix, _ = compare.catalog_scores(CPU)
+        points = normalize(matrix, CPU_FEATURES, scales.get_scales(CPU))
+        row = pks.tolist().index(pk)
+        dist = np.linalg.norm(points - points[row], axis=1)
+        return dict(zip(pks.tolist(), dist.tolist())), np.sort(np.delete(dist, row))[:k]
+
+    def assert_matches(self, pk, k=10):
+        pks, dist = similar.similar(CPU, pk, k)
+        every, expected = self.brute_force(pk, k)
+        np.testing.assert_allclose(dist, expected, atol=1e-9)
+        # ties may come back in either order, but each distance belongs to its row
+        np.testing.assert_allclose(dist, [every[p] for p in pks.tolist()], atol=1e-9)
+
+    def write_inside_the_scales(self):
+        """Swap specs between rows and copy rows, so the scales do not move"""
+        specs = ("core_count", "thread_count", "clock_speed_ghz", "ipc", "tdp_watts")
+        cpus = list(CPU.objects.order_by("pk")[:6])
+        for a, b in ((cpus[0], cpus[1]), (cpus[2], cpus[3])):
+            values = {f: getattr(a, f) for f in specs}
+            for f in specs:
+                setattr(a, f, getattr(b, f))
+                setattr(b, f, values[f])
+            a.save()
+            b.save()
+        for i, cpu in enumerate(cpus[4:]):
+            make_cpu(f"Copy {i}", **{f: getattr(cpu, f) for f in specs})
+
+    def test_matches_brute_force_after_incremental_writes(self):
+        first = CPU.objects.order_by("pk").first().pk
+        self.assert_matches(first)
+        built = similar._space(CPU)
+
+        self.write_inside_the_scales()
+        space = similar._space(CPU)
+        self.assertIs(space.tree, built.tree)
+        self.assertEqual(space.overflow(), 6)
+        for cpu in CPU.objects.order_by("pk")[::7]:
+            self.assert_matches(cpu.pk)
+        self.assert_matches(CPU.objects.get(name="Copy 0").pk, k=200)
+
+    def test_catching_up_leaves_the_old_space_alone(self):
+        built = similar._space(CPU)
+        pks, points, rows = built.pks.copy(), built.points.copy(), dict(built.rows)
+
+        self.write_inside_the_scales()
+        space = similar._space(CPU)
+        self.assertIsNot(space, built)
+        np.testing.assert_array_equal(built.pks, pks)
+        np.testing.assert_array_equal(built.points, points)
+        self.assertEqual(built.rows, rows)
+        self.assertTrue(built.candidate.all())
+        self.assertEqual(built.overflow(), 0)
+
+    def test_rebuilds_when_the_scales_move(self):
+        built = similar._space(CPU)
+        make_cpu("Huge", core_count=128, thread_count=256)
+        space = similar._space(CPU)
+        self.assertIsNot(space.tree, built.tree)
+        self.assertEqual(space.overflow(), 0)
+        self.assert_matches(CPU.objects.get(name="Huge").pk)
+
+    def test_endpoint(self):
+        cpu = CPU.objects.order_by("pk").first()
+        response = self.client.get(f"/core/cpu/{cpu.pk}/similar?k=5")
+        self.assertEqual(response.status_code, 200)
+        found = [row["distance"] for row in response.json()["results"]]
+        self.assertEqual(found, [round(d, 2) for d in self.brute_force(cpu.pk, 5)[1].tolist()])
+
+        self.assertEqual(self.client.get("/core/cpu/999999/similar").status_code, 404)
+        self.assertEqual(self.client.get(f"/core/cpu/{cpu.pk}/similar?min_tdp_watts=hot").status_code, 400)
+
+
+# =====PC builds=====
+def pc(cpu, gpu, ram):
+    return {"cpu_name": cpu, "gpu_name": gpu, "ram_name": ram}
+
+
+FAST_PC = pc("Ryzen 9", "RTX 4090", "32GB DDR5")
+SLOW_PC = pc("Ryzen 5", "RTX 3060", "16GB DDR4")
+
+
+def make_pc_parts():
+    make_cpu("Ryzen 5", core_count=6, thread_count=12, clock_speed_ghz=3.9)
+    make_cpu("Ryzen 9", core_count=16, thread_count=32, clock_speed_ghz=4.9)
+    make_gpu("RTX 3060", vram_gb=12, core_count=3584, memory_bandwidth_gbps=360)
+    make_gpu("RTX 4090", vram_gb=24, core_count=16384, core_clock_ghz=2.5, memory_bandwidth_gbps=1008)
+    make_ram("16GB DDR4", size_gb=16, speed_mhz=3200, type="DDR4")
+    make_ram("32GB DDR5", size_gb=32, speed_mhz=6000, type="DDR5")
+
+
+@override_settings(CACHES=LOCMEM)
+class NeedProfileTests(TestCase):
+    def test_profiles(self):
+        self.assertEqual(builds.need_profile("Gaming")[0], "gaming")
+        self.assertEqual(builds.need_profile("video-editing")[0], "video_editing")
+        self.assertEqual(builds.need_profile("3D rendering")[0], "3d_rendering")
+        self.assertEqual(builds.need_profile("")[0], "general")
+        self.assertEqual(builds.need_profile("knitting")[0], "general")
+
+        Needs.objects.create(name="Streaming", description="Live game streaming with OBS")
+        self.assertEqual(builds.need_profile("streaming")[0], "gaming")
+        for weights in builds.NEED_PROFILES.values():
+            self.assertAlmostEqual(sum(weights.values()), 1)
+
+
+class PCScoreTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+        self.fast, self.slow = FAST_PC, SLOW_PC
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_weighted_scores(self):
+        data = builds.get_pc_score_json(self.slow, self.fast, "gaming")
+        self.assertEqual((data["winner"], data["need"], data["source"]), ("PC2", "gaming", "local"))
+        weights = builds.NEED_PROFILES["gaming"]
+        for entry, side in zip(data["comparison"], (self.slow, self.fast)):
+            parts = builds.component_scores([side])[0]
+            expected = sum(parts[key][1] * weights[key] for key in ("cpu", "gpu", "ram"))
+            self.assertAlmostEqual(entry["overall_score"], round(expected, 1))
+        self.assertEqual(len(data["comparison"][1]["strengths"]), 3)
+        self.assertEqual(data["comparison"][0]["strengths"], [])
+
+        tie = builds.get_pc_score_json(self.fast, self.fast, "work")
+        self.assertEqual(tie["winner"], "Tie")
+        self.assertIsNone(builds.get_pc_score_json(self.fast, pc("Ryzen 5", "Voodoo 2", "16GB DDR4"), "work"))
+
+    def test_llm_only_adds_wording(self):
+        data = builds.get_pc_score_json(self.slow, self.fast, "gaming")
+        scores = [entry["overall_score"] for entry in data["comparison"]]
+        llm = {"comparison": [{"pc_name": "PC2", "overall_score": 1, "strengths": ["Quiet"]}], "reasoning": "Why"}
+        data = builds.enrich_with_llm(data, llm)
+        self.assertEqual([entry["overall_score"] for entry in data["comparison"]], scores)
+        self.assertEqual(data["comparison"][1]["strengths"], ["Quiet"])
+        self.assertEqual((data["reasoning"], data["source"]), ("Why", "local+llm"))
+
+    @mock.patch("requests.Session.post")
+    def test_endpoint_skips_the_llm(self, post):
+        url = "/core/compare_pc/Ryzen 5/RTX 3060/16GB DDR4/Ryzen 9/RTX 4090/32GB DDR5/video editing"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["winner"], response.json()["source"]), ("PC2", "local"))
+        post.assert_not_called()
+
+        response = self.client.get("/core/compare_pc/Ryzen 5/Voodoo 2/16GB DDR4/Ryzen 9/RTX 4090/32GB DDR5/gaming")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM)
+class RecommendPCTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_parts(12, seed=2)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def brute_force(self, need, limit, keep=lambda key, row: True):
+        """Best overall scores over every CPU x GPU x RAM combination"""
+        weights = builds.NEED_PROFILES[need]
+        axes = []
+        for key, model, _ in builds.COMPONENTS:
+            pks, matrix, scores = compare.catalog_scores(model)
+            axes.append([float(score) for row, score in zip(matrix, scores) if keep(key, row)])
+        totals = [weights["cpu"] * c + weights["gpu"] * g + weights["ram"] * r
+                  for c in axes[0] for g in axes[1] for r in axes[2]]
+        return [round(total, 1) for total in sorted(totals, reverse=True)[:limit]]
+
+    def test_matches_the_full_product(self):
+        for need in ("gaming", "work"):
+            for limit in (1, 5, 30):
+                name, found = builds.recommend_builds(need, limit)
+                self.assertEqual(name, need)
+                self.assertEqual([build["overall_score"] for build in found], self.brute_force(need, limit))
+
+    def test_endpoint_filters(self):
+        tdp = [f.field for f in CPU_FEATURES].index("tdp_watts")
+        response = self.client.get("/core/recommend_pc?need=gaming&limit=8&max_tdp=105&ram_min_size_gb=32")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["need"], body["count"]), ("gaming", 8))
+
+        expected = self.brute_force("gaming", 8, lambda key, row: (
+            key != "cpu" or row[tdp] <= 105) and (key != "ram" or row[0] >= 32))
+        self.assertEqual([build["overall_score"] for build in body["results"]], expected)
+        for build in body["results"]:
+            self.assertLessEqual(CPU.objects.get(pk=build["cpu"]["id"]).tdp_watts, 105)
+            self.assertGreaterEqual(RAM.objects.get(pk=build["ram"]["id"]).size_gb, 32)
+
+        self.assertEqual(self.client.get("/core/recommend_pc?limit=lots").status_code, 400)
+        self.assertEqual(self.client.get("/core/recommend_pc?ram_min_size_gb=64&ram_max_size_gb=8").json()["count"], 0)
+
+
+# =====Comparison matrix=====
+@override_settings(CACHES=LOCMEM)
+class MatrixTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_cpus(25, seed=3)
+        pks, _, scores = compare.catalog_scores(CPU)
+        self.scores = dict(zip(pks.tolist(), scores.tolist()))
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def ndjson(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        return lines[0]["ids"], lines[1:]
+
+    def test_ndjson_in_blocks(self):
+        # 7 cells per block splits the 25 x 25 matrix into single rows
+        with mock.patch("core.streams.MATRIX_BLOCK_CELLS", 7):
+            ids, rows = self.ndjson("/core/cpu/matrix")
+        self.assertEqual(ids, sorted(self.scores))
+        self.assertEqual([row["id"] for row in rows], ids)
+        for row in rows:
+            expected = [round(self.scores[row["id"]] - self.scores[other], 2) for other in ids]
+            np.testing.assert_allclose(row["deltas"], expected, atol=0.011)
+
+    def test_subset_keeps_the_order_and_drops_unknown_ids(self):
+        a, b, c = sorted(self.scores)[:3]
+        ids, rows = self.ndjson(f"/core/cpu/matrix?ids={c},999999,{a},{b}")
+        self.assertEqual(ids, [c, a, b])
+        self.assertEqual(rows[0]["deltas"][0], 0)
+        self.assertAlmostEqual(rows[1]["deltas"][0], self.scores[a] - self.scores[c], places=2)
+
+    def test_float32(self):
+        response = self.client.get("/core/cpu/matrix?output=float32")
+        body = b"".join(response.streaming_content)
+        n = struct.unpack("<I", body[:4])[0]
+        ids = np.frombuffer(body[4:4 + 8 * n], dtype="<i8")
+        deltas = np.frombuffer(body[4 + 8 * n:], dtype="<f4").reshape(n, n)
+        scores = np.array([self.scores[pk] for pk in ids.tolist()])
+        self.assertEqual(n, 25)
+        np.testing.assert_allclose(deltas, scores[:, None] - scores[None, :], atol=1e-3)
+
+    def test_bad_ids(self):
+        self.assertEqual(self.client.get("/core/cpu/matrix?ids=1,two").status_code, 400)
+
+
+# =====Export=====
+@override_settings(CACHES=LOCMEM)
+class ExportTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        random_cpus(30, seed=4)
+        pks, _, scores = compare.catalog_scores(CPU)
+        self.scores = {pk: round(score, 2) for pk, score in zip(pks.tolist(), scores.tolist())}
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_ndjson(self):
+        response = self.client.get("/core/cpu/export")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="cpu.ndjson"')
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], sorted(self.scores))
+        self.assertEqual({row["id"]: row["performance_index"] for row in rows}, self.scores)
+        self.assertEqual(rows[0]["name"], "CPU 0")
+
+    def test_csv(self):
+        response = self.client.get("/core/cpu/export?output=csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual({int(row["id"]): float(row["performance_index"]) for row in rows}, self.scores)
+
+    def test_chunks(self):
+        columns = ["id", "name"] + [f.field for f in CPU_FEATURES] + ["performance_index"]
+        chunks = list(streams.export_chunks(CPU.objects.all(), columns, chunk_size=8))
+        self.assertEqual([len(chunk) for chunk in chunks], [8, 8, 8, 6])
+        self.assertEqual({row["id"]: row["performance_index"] for chunk in chunks for row in chunk}, self.scores)
+
+
+# =====LLM cache=====
+PC_ANSWER = {
+    "comparison": [{"pc_name": "PC1", "strengths": ["Cheap"]}, {"pc_name": "PC2", "strengths": ["Fast"]}],
+    "winner": "PC2",
+    "reasoning": "PC2 has the faster parts",
+}
+
+
+def openrouter_response(content, status=200, headers=None):
+    """What a mocked requests.Session.post hands back for a chat completion"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    response._content = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+    return response
+
+
+class LLMCacheTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_keys_and_compression(self):
+        llm_cache.set_completion("m", "prompt", 0.1, "answer " * 100)
+        self.assertEqual(llm_cache.get_completion("m", "prompt", 0.1), "answer " * 100)
+        self.assertLess(len(cache.get(llm_cache.completion_key("m", "prompt", 0.1))), 100)
+        for other in (("n", "prompt", 0.1), ("m", "prompt!", 0.1), ("m", "prompt", 0.2)):
+            self.assertIsNone(llm_cache.get_completion(*other))
+
+    @mock.patch("requests.Session.post")
+    def test_repeat_comparisons_are_served_from_the_cache(self, post):
+        post.return_value = openrouter_response(PC_ANSWER)
+        self.assertEqual(ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming"), PC_ANSWER)
+        self.assertEqual(ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming"), PC_ANSWER)
+        self.assertEqual(post.call_count, 1)
+
+        ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "work")
+        self.assertEqual(post.call_count, 2)
+
+        # an edited component changes the prompt, so the old answer is not served
+        CPU.objects.filter(name="Ryzen 9").update(clock_speed_ghz=5.2)
+        ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming")
+        self.assertEqual(post.call_count, 3)
+
+    @mock.patch("requests.Session.post")
+    def test_invalid_answers_are_not_cached(self, post):
+        post.return_value = openrouter_response({"winner": "PC2"})
+        ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming")
+        ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming")
+        self.assertEqual(post.call_count, 2)
+
+
+# =====OpenRouter client=====
+@override_settings(OPENROUTER_MAX_RETRIES=2, OPENROUTER_BACKOFF=0.5)
+@mock.patch("core.llm_client.time.sleep")
+@mock.patch("requests.Session.post")
+class LLMClientTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_retries_5xx_with_backoff(self, post, sleep):
+        post.side_effect = [openrouter_response("", 503), openrouter_response("", 502), openrouter_response("{}")]
+        self.assertEqual(llm_client.post_chat({}, {}).status_code, 200)
+        self.assertEqual(post.call_count, 3)
+        first, second = [call.args[0] for call in sleep.call_args_list]
+        self.assertTrue(0.25 <= first <= 0.75 and 0.5 <= second <= 1.5)
+        for call in post.call_args_list:
+            self.assertEqual(call.kwargs["timeout"], (settings.OPENROUTER_CONNECT_TIMEOUT,
+                                                      settings.OPENROUTER_READ_TIMEOUT))
+
+    def test_gives_up_with_the_last_answer(self, post, sleep):
+        post.return_value = openrouter_response("", 500)
+        self.assertEqual(llm_client.post_chat({}, {}).status_code, 500)
+        self.assertEqual(post.call_count, 3)
+
+    @override_settings(OPENROUTER_RATE_LIMIT=0)
+    def test_retry_after_is_honoured_up_to_a_cap(self, post, sleep):
+        post.side_effect = [openrouter_response("", 429, {"Retry-After": "3"}),
+                            openrouter_response("", 429, {"Retry-After": "600"}), openrouter_response("{}")]
+        llm_client.post_chat({}, {})
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [3, llm_client.MAX_RETRY_AFTER])
+
+    def test_client_errors_are_not_retried(self, post, sleep):
+        post.return_value = openrouter_response("", 400)
+        self.assertEqual(llm_client.post_chat({}, {}).status_code, 400)
+        self.assertEqual(post.call_count, 1)
+
+    def test_connection_errors_are_retried(self, post, sleep):
+        post.side_effect = [requests.ConnectionError(), openrouter_response("{}")]
+        self.assertEqual(llm_client.post_chat({}, {}).status_code, 200)
+
+        post.reset_mock()
+        post.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            llm_client.post_chat({}, {})
+        self.assertEqual(post.call_count, 3)
+
+    def test_read_timeouts_are_not_retried(self, post, sleep):
+        post.side_effect = requests.ReadTimeout()
+        with self.assertRaises(requests.ReadTimeout):
+            llm_client.post_chat({}, {})
+        self.assertEqual(post.call_count, 1)
+
+    def test_one_pooled_session(self, post, sleep):
+        self.assertIs(llm_client.get_session(), llm_client.get_session())
+
+
+# =====Async views=====
+PC_URL = "compare_pc/Ryzen 5/RTX 3060/16GB DDR4/Ryzen 9/RTX 4090/32GB DDR5/gaming"
+
+
+def httpx_answer(content, status=200):
+    """What a mocked httpx.AsyncClient.post hands back for a chat completion"""
+    body = {"choices": [{"message": {"content": json.dumps(content)}}]}
+    return httpx.Response(status, json=body, request=httpx.Request("POST", llm_client.OPENROUTER_URL))
+
+
+@mock.patch("httpx.AsyncClient.post", new_callable=mock.AsyncMock)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+        self.clients = []
+        new_client = llm_client._new_async_client
+
+        def track():
+            client = new_client()
+            self.clients.append(client)
+            return client
+        patcher = mock.patch("core.llm_client._new_async_client", side_effect=track)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_wsgi_closes_the_client_with_the_request(self, post):
+        post.return_value = httpx_answer(PC_ANSWER)
+        response = self.client.get(f"/core/async/{PC_URL}?enrich=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["source"], "local+llm")
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(len(self.clients), 1)
+        self.assertTrue(self.clients[0].is_closed)
+
+    async def test_asgi_keeps_the_loops_client(self, post):
+        post.return_value = httpx_answer(PC_ANSWER)
+        response = await AsyncClient().get(f"/core/async/{PC_URL}?enrich=1")
+        self.assertEqual(response.json()["source"], "local+llm")
+        self.assertEqual(len(self.clients), 1)
+        self.assertIs(llm_client.get_async_client(), self.clients[0])
+        self.assertFalse(self.clients[0].is_closed)
+        await self.clients[0].aclose()
+
+    def test_failing_upstream_degrades(self, post):
+        post.return_value = httpx_answer({}, status=400)
+        body = self.client.get(f"/core/async/{PC_URL}?enrich=1").json()
+        self.assertEqual((body["source"], body["degraded"]), ("local", True))
+
+
+class AsyncAdmissionTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    @override_settings(LLM_ADMISSION_ASYNC_LIMIT=1, LLM_ADMISSION_QUEUE_TIMEOUT=0.2)
+    def test_the_async_limit_holds_across_event_loops(self):
+        # every async_to_sync call runs on an event loop of its own, like WSGI requests
+        slot = async_to_sync(admission.aacquire)()
+        with self.assertRaises(admission.Overloaded):
+            async_to_sync(admission.aacquire)()
+        async_to_sync(admission.arelease)(slot)
+        async_to_sync(admission.arelease)(async_to_sync(admission.aacquire)())
+        self.assertEqual(admission.stats()["refused"]["process"], 1)
+
+
+# =====Single flight=====
+@override_settings(LLM_FLIGHT_WAIT=0.3)
+class SingleFlightTests(TestCase):
+    args = ("model", "prompt", 0.1)
+
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_waiter_gets_the_answer_in_flight(self):
+        self.assertIsNone(llm_cache.claim_or_wait(*self.args))
+
+        def answer():
+            time.sleep(0.1)
+            llm_cache.set_completion(*self.args, "done")
+        thread = threading.Thread(target=answer)
+        thread.start()
+        self.assertEqual(llm_cache.claim_or_wait(*self.args), "done")
+        thread.join()
+
+    def test_waiter_times_out(self):
+        self.assertIsNone(llm_cache.claim_or_wait(*self.args))
+        started = time.monotonic()
+        with self.assertRaises(llm_cache.FlightPending) as raised:
+            llm_cache.claim_or_wait(*self.args)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(raised.exception.retry_after, llm_cache.RETRY_AFTER)
+
+    def test_next_waiter_takes_over_a_released_lock(self):
+        self.assertIsNone(llm_cache.claim_or_wait(*self.args))
+        llm_cache.release_flight(*self.args)
+        self.assertIsNone(llm_cache.claim_or_wait(*self.args))
+
+    @mock.patch("requests.Session.post")
+    def test_comparison_in_flight_elsewhere_does_not_call_upstream(self, post):
+        make_pc_parts()
+        parts = [model.objects.get(name=name) for side in (SLOW_PC, FAST_PC)
+                 for model, name in zip((CPU, GPU, RAM), side.values())]
+        prompt = ai.build_pc_prompt(*parts, "gaming")
+        key = llm_cache.completion_key(ai.OPENROUTER_MODEL, prompt, ai.OPENROUTER_TEMPERATURE)
+        cache.set(f"{key}:lock", "another worker", 60)
+
+        self.assertIsNone(ai.get_pc_comparison_json(SLOW_PC, FAST_PC, "gaming"))
+        post.assert_not_called()
+
+
+# =====Jobs=====
+def sse_events(response):
+    """(event, data) pairs and comment lines of a streamed SSE response"""
+    return sse_events_text(b"".join(response.streaming_content))
+
+
+def sse_events_text(content):
+    events = []
+    for block in content.decode().split("\n\n"):
+        if block.startswith(":"):
+            events.append((block, None))
+        elif block:
+            event, data = block.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@mock.patch("requests.Session.post")
+class JobTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+        self.conn = get_redis_connection("default")
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def take(self, worker):
+        """Move the next job onto worker's processing list, like work() does"""
+        processing = jobs.PROCESSING_KEY.format(worker)
+        return processing, self.conn.blmove(jobs.QUEUE_KEY, processing, 1, "RIGHT", "LEFT")
+
+    def test_async_mode_always_enriches(self, post):
+        post.return_value = openrouter_response(PC_ANSWER)
+        response = self.client.get(f"/core/{PC_URL}?mode=async")
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        self.assertEqual(self.client.get(f"/core/jobs/{job_id}").json()["status"], jobs.QUEUED)
+
+        processing, raw = self.take("worker")
+        self.assertTrue(json.loads(raw)["params"]["enrich"])
+        jobs._run_and_ack(self.conn, processing, raw)
+        self.assertEqual(self.conn.llen(processing), 0)
+        job = self.client.get(f"/core/jobs/{job_id}").json()
+        self.assertEqual((job["status"], job["status_code"], job["result"]["source"]), (jobs.DONE, 200, "local+llm"))
+        self.assertEqual(post.call_count, 1)
+
+    def test_jobs_of_dead_workers_are_requeued(self, post):
+        for _ in range(2):
+            jobs.enqueue("compare_pc", pc1_components=SLOW_PC, pc2_components=FAST_PC, need="gaming", enrich=True)
+        jobs._heartbeat(self.conn, "alive")
+        jobs._heartbeat(self.conn, "dead")
+        _, first = self.take("alive")
+        _, second = self.take("dead")
+        self.assertEqual(self.conn.llen(jobs.QUEUE_KEY), 0)
+
+        # the dead worker's heartbeat lease runs out
+        self.conn.delete(jobs.HEARTBEAT_KEY.format("dead"))
+        with self.assertLogs("core.jobs", "WARNING"):
+            self.assertEqual(jobs.recover(self.conn), 1)
+        self.assertEqual(self.conn.lrange(jobs.QUEUE_KEY, 0, -1), [second])
+        self.assertEqual(self.conn.smembers(jobs.WORKERS_KEY), {b"alive"})
+        self.assertEqual(jobs.recover(self.conn), 0)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_a_job_that_keeps_killing_workers_is_given_up(self, post):
+        job = jobs.enqueue("compare_pc", pc1_components=SLOW_PC, pc2_components=FAST_PC, need="gaming", enrich=True)
+        message = json.loads(self.take("worker")[1])
+        # both workers that ran it died: it stayed `running` and was requeued
+        jobs._save({**jobs.get_job(job["id"]), "status": jobs.RUNNING, "attempts": 2})
+        with self.assertLogs("core.jobs", "ERROR"):
+            found = jobs.run_job(message)
+        self.assertEqual((found["status"], found["status_code"]), (jobs.FAILED, 500))
+        post.assert_not_called()
+
+    def test_events_stream(self, post):
+        job = {"id": "j", "status": jobs.QUEUED}
+        polls = [job, job, job, {**job, "status": jobs.RUNNING}, {**job, "status": jobs.DONE, "result": {}}]
+        with mock.patch("core.views.get_job", side_effect=polls), \
+                mock.patch.multiple("core.views.JobEventsView", POLL_INTERVAL=0, KEEPALIVE=0):
+            response = self.client.get("/core/jobs/j/events")
+            self.assertFalse(response.is_async)
+            events = sse_events(response)
+        self.assertEqual([event for event, _ in events], ["status", ": keepalive", "status", "result"])
+        self.assertEqual(events[2][1], {"id": "j", "status": jobs.RUNNING})
+
+        self.assertEqual(self.client.get("/core/jobs/missing/events").status_code, 404)
+
+    async def test_events_stream_under_asgi(self, post):
+        job = await sync_to_async(jobs.enqueue)("compare_pc", pc1_components=SLOW_PC, pc2_components=FAST_PC,
+                                               need="gaming", enrich=True)
+        await sync_to_async(jobs._save)({**job, "status": jobs.DONE, "status_code": 200, "result": {}})
+        response = await AsyncClient().get(f"/core/jobs/{job['id']}/events")
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(content.startswith("event: result"))
+
+
+# =====Streaming JSON=====
+class FieldParserTests(SimpleTestCase):
+    document = {
+        "winner": "PC1 \"gaming\" {rig}",
+        "comparison": [{"name": "PC1", "score": 81.5, "parts": [1, 2]}, {"name": "PC2", "score": 60}],
+        "reasoning": "PC1 has the faster GPU } ] ,",
+        "tie": False,
+        "margin": 21.5,
+        "notes": None,
+    }
+
+    def events(self, text, size):
+        parser = FieldParser()
+        events = []
+        for start in range(0, len(text), size):
+            events.extend(parser.feed(text[start:start + size]))
+        return events
+
+    def test_chunk_boundaries_do_not_matter(self):
+        text = "```json\n" + json.dumps(self.document, indent=2) + "\n```"
+        expected = [
+            ("field", "winner", self.document["winner"]),
+            ("item", "comparison", 0, self.document["comparison"][0]),
+            ("item", "comparison", 1, self.document["comparison"][1]),
+            ("field", "comparison", self.document["comparison"]),
+            ("field", "reasoning", self.document["reasoning"]),
+            ("field", "tie", False),
+            ("field", "margin", 21.5),
+            ("field", "notes", None),
+        ]
+        for size in (1, 2, 3, 7, 64, len(text)):
+            with self.subTest(size=size):
+                self.assertEqual(self.events(text, size), expected)
+
+    def test_items_come_before_the_object_closes(self):
+        parser = FieldParser()
+        text = json.dumps(self.document)
+        cut = text.index('"reasoning"')
+        events = parser.feed(text[:cut])
+        self.assertIn(("item", "comparison", 1, self.document["comparison"][1]), events)
+        self.assertFalse(parser.finished)
+
+
+# =====Comparison streams=====
+def openrouter_stream(content, pieces=5):
+    """An httpx client whose transport answers every request with content
+    streamed in pieces the way OpenRouter streams a completion"""
+    size = len(content) // pieces + 1
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': content[i:i + size]}}]})}\n\n"
+             for i in range(0, len(content), size)]
+    body = (": OPENROUTER PROCESSING\n\n" + "".join(lines) + "data: [DONE]\n\n").encode()
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    return httpx.AsyncClient(transport=transport)
+
+
+class CompareStreamTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+        self.prompt = ai.pc_prompt(SLOW_PC, FAST_PC, "gaming")
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def cached(self):
+        return llm_cache.get_completion(ai.OPENROUTER_MODEL, self.prompt, ai.OPENROUTER_TEMPERATURE)
+
+    @mock.patch("requests.Session.post")
+    def test_wsgi_stream(self, post):
+        post.return_value = openrouter_response(PC_ANSWER)
+        response = self.client.get(f"/core/stream/{PC_URL}")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        # a WSGI server only streams a sync iterator
+        self.assertFalse(response.is_async)
+        events = sse_events(response)
+        self.assertEqual([event for event, _ in events],
+                         ["local", "comparison", "comparison", "winner", "reasoning", "done"])
+        self.assertEqual(events[0][1]["source"], "local")
+        self.assertEqual(events[1][1], {"index": 0, "item": PC_ANSWER["comparison"][0]})
+        self.assertEqual((events[-1][1]["source"], events[-1][1]["reasoning"]), ("local+llm", PC_ANSWER["reasoning"]))
+        self.assertIsNotNone(self.cached())
+
+        sse_events(self.client.get(f"/core/stream/{PC_URL}"))
+        self.assertEqual(post.call_count, 1)
+
+    @mock.patch("requests.Session.post")
+    def test_wsgi_stream_falls_back_to_the_local_result(self, post):
+        post.return_value = openrouter_response({"winner": "PC2"})
+        events = sse_events(self.client.get(f"/core/stream/{PC_URL}"))
+        self.assertEqual([event for event, _ in events], ["local", "error", "done"])
+        self.assertEqual(events[1][1]["status_code"], 502)
+        self.assertTrue(events[-1][1]["degraded"])
+
+        post.return_value = openrouter_response("", 400)
+        events = sse_events(self.client.get(f"/core/stream/{PC_URL}"))
+        self.assertEqual(events[1][1]["status_code"], 400)
+        self.assertIsNone(self.cached())
+
+        self.assertEqual(self.client.get(f"/core/stream/{PC_URL.replace('RTX 3060', 'Voodoo 2')}").status_code, 400)
+
+    async def stream(self, content):
+        with mock.patch("core.llm_client._new_async_client", return_value=openrouter_stream(content)):
+            response = await AsyncClient().get(f"/core/stream/{PC_URL}")
+            self.assertTrue(response.is_async)
+            return sse_events_text(b"".join([chunk async for chunk in response.streaming_content]))
+
+    async def test_asgi_stream(self):
+        events = await self.stream(json.dumps(PC_ANSWER))
+        self.assertEqual([event for event, _ in events],
+                         ["local", "comparison", "comparison", "winner", "reasoning", "done"])
+        self.assertEqual(events[-1][1]["source"], "local+llm")
+        self.assertEqual(await sync_to_async(self.cached)(), json.dumps(PC_ANSWER))
+
+    async def test_asgi_stream_does_not_cache_an_invalid_answer(self):
+        events = await self.stream(json.dumps({"comparison": PC_ANSWER["comparison"]}))
+        self.assertEqual([event for event, _ in events][-2:], ["error", "done"])
+        self.assertTrue(events[-1][1]["degraded"])
+        self.assertIsNone(await sync_to_async(self.cached)())
+
+
+# =====Circuit breaker=====
+@override_settings(CACHES=LOCMEM, LLM_BREAKER_MIN_CALLS=4, LLM_BREAKER_ERROR_RATE=0.5, LLM_BREAKER_SLOW_CALL=5,
+                   LLM_BREAKER_COOLDOWN=30)
+class BreakerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def open_breaker(self):
+        for ok in (True, True, False, False):
+            breaker.after_call(breaker.before_call(), ok, 0.1)
+
+    def end_cooldown(self):
+        # OPEN_KEY expires with the cooldown
+        cache.delete(breaker.OPEN_KEY)
+
+    def test_stays_closed_below_the_error_rate(self):
+        for ok in (True, True, True, False):
+            breaker.after_call(breaker.before_call(), ok, 0.1)
+        self.assertEqual(breaker.state(), "closed")
+
+    def test_slow_calls_count_as_failures(self):
+        for latency in (0.1, 0.1, 6, 6):
+            breaker.after_call(breaker.before_call(), True, latency)
+        self.assertEqual(breaker.state(), "open")
+
+    def test_opens_and_fails_fast(self):
+        self.open_breaker()
+        self.assertEqual(breaker.state(), "open")
+        with self.assertRaises(breaker.CircuitOpen) as raised:
+            breaker.before_call()
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.open_breaker()
+        self.end_cooldown()
+        self.assertEqual(breaker.state(), "half-open")
+        self.assertEqual(breaker.before_call(), breaker.PROBE)
+        with self.assertRaises(breaker.CircuitOpen):
+            breaker.before_call()
+
+    def test_good_probe_closes(self):
+        self.open_breaker()
+        self.end_cooldown()
+        breaker.after_call(breaker.before_call(), True, 0.1)
+        self.assertEqual(breaker.state(), "closed")
+        self.assertEqual(breaker.before_call(), breaker.CLOSED)
+
+    def test_bad_probe_reopens(self):
+        self.open_breaker()
+        self.end_cooldown()
+        breaker.after_call(breaker.before_call(), False, 0.1)
+        self.assertEqual(breaker.state(), "open")
+
+    def test_cancelled_probe_frees_the_slot(self):
+        self.open_breaker()
+        self.end_cooldown()
+        breaker.cancel(breaker.before_call())
+        self.assertEqual(breaker.before_call(), breaker.PROBE)
+
+
+def hanging_client():
+    """An httpx client whose requests never get an answer"""
+    async def hang(request):
+        await asyncio.sleep(60)
+    return httpx.AsyncClient(transport=httpx.MockTransport(hang))
+
+
+@override_settings(LLM_BREAKER_MIN_CALLS=2, LLM_BREAKER_ERROR_RATE=0.5, OPENROUTER_MAX_RETRIES=2)
+@mock.patch("core.llm_client.time.sleep")
+@mock.patch("requests.Session.post")
+class GuardTests(TestCase):
+    """The retries, the breaker and the rate limiter together, on the configured Redis"""
+
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def half_open(self):
+        for ok in (False, False):
+            breaker.after_call(breaker.before_call(), ok, 0.1)
+        cache.delete(breaker.OPEN_KEY)
+
+    def test_retries_count_once_and_an_open_breaker_stops_calls(self, post, sleep):
+        post.return_value = openrouter_response("", 503)
+        llm_client.post_chat({}, {})
+        self.assertEqual((post.call_count, breaker.state()), (3, "closed"))
+        llm_client.post_chat({}, {})
+        self.assertEqual(breaker.state(), "open")
+
+        with self.assertRaises(breaker.CircuitOpen):
+            llm_client.post_chat({}, {})
+        self.assertEqual(post.call_count, 6)
+
+    @override_settings(OPENROUTER_RATE_LIMIT=10, OPENROUTER_RATE_BURST=5)
+    def test_a_429_drains_the_limiter_for_the_retry(self, post, sleep):
+        post.side_effect = [openrouter_response("", 429, {"Retry-After": "1"}), openrouter_response("{}")]
+        self.assertEqual(llm_client.post_chat({}, {}).status_code, 200)
+        # Retry-After, then the wait for the next token of an emptied bucket
+        retry_after, wait = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(retry_after, 1)
+        self.assertTrue(0 < wait <= 1 / settings.OPENROUTER_RATE_LIMIT)
+
+    @override_settings(OPENROUTER_RATE_LIMIT=1, OPENROUTER_RATE_BURST=1, OPENROUTER_RATE_MAX_WAIT=0)
+    def test_rate_limited_calls_are_not_held_against_openrouter(self, post, sleep):
+        post.return_value = openrouter_response("{}")
+        self.half_open()
+        ratelimit._reserve()
+        with self.assertRaises(ratelimit.RateLimited):
+            llm_client.post_chat({}, {})
+        post.assert_not_called()
+        # the probe slot was given back
+        self.assertEqual(breaker.state(), "half-open")
+        self.assertEqual(breaker.before_call(), breaker.PROBE)
+
+    async def test_a_stream_cancelled_before_its_first_delta_records_nothing(self, post, sleep):
+        await sync_to_async(self.half_open)()
+
+        async def consume():
+            async for _ in llm_client.astream_chat({}, {}):
+                pass
+        with mock.patch("core.llm_client._new_async_client", return_value=hanging_client()):
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(await sync_to_async(breaker.state)(), "half-open")
+        self.assertEqual(await breaker.abefore_call(), breaker.PROBE)
+
+    async def test_a_stream_is_judged_by_its_first_delta(self, post, sleep):
+        await sync_to_async(self.half_open)()
+        with mock.patch("core.llm_client._new_async_client", return_value=openrouter_stream("{}")):
+            self.assertEqual("".join([delta async for delta in llm_client.astream_chat({}, {})]), "{}")
+        self.assertEqual(await sync_to_async(breaker.state)(), "closed")
+
+
+# =====Camera=====
+class CameraParserTests(SimpleTestCase):
+    def test_formats(self):
+        cases = {
+            "50 MP": (50.0, 1),
+            "50MP + 12MP + 5MP": (50.0, 3),
+            "108+12+2": (108.0, 3),
+            "2x12 MP": (12.0, 2),
+            "2 × 12 MP + 8 MP": (12.0, 3),
+            "Dual 12 MP": (12.0, 2),
+            "Triple-12MP": (12.0, 3),
+            "12,2 MP": (12.2, 1),
+            "48 MP (wide), 12 MP (ultrawide), front 32 MP": (48.0, 2),
+            "64 МП + 8 МП, фронтальная 16 МП": (64.0, 2),
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_camera_mp(text), expected)
+
+    def test_no_sensors(self):
+        for text in (None, "", "no camera", "4000 MP", "front 32 MP"):
+            with self.subTest(text=text):
+                self.assertEqual(parse_camera_mp(text), (None, None))
+
+    def test_units_win_over_bare_numbers(self):
+        # "4K" and "60fps" are not sensors once something is marked MP
+        self.assertEqual(parse_camera_mp("12 MP, 4K 60fps video"), (12.0, 1))
+
+
+@override_settings(CACHES=LOCMEM)
+class PhoneCameraFieldsTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_update_fields_persists_derived_columns(self):
+        brand = BrandsCoefficients.objects.create(name="Nothing", coefficient=1.0)
+        phone = Phone.objects.create(name="Nothing Phone 2", brand=brand, image="phone.png", camera_mp="50 MP")
+        phone.camera_mp = "50MP + 50MP"
+        phone.save(update_fields=["camera_mp"])
+        stored = Phone.objects.values("camera_main_mp", "camera_count").get(pk=phone.pk)
+        self.assertEqual(stored, {"camera_main_mp": 50.0, "camera_count": 2})
+
+
+# =====Compare cache=====
+class ReorientTests(SimpleTestCase):
+    body = {
+        "winner": "Ryzen 7",
+        "reasoning": "Ryzen 7 wins (index 70.0 vs 40.0)",
+        "comparison": [{"name": "Ryzen 7", "performance_index": 70.0}, {"name": "Core i5", "performance_index": 40.0}],
+    }
+
+    def test_reverses_only_the_rows(self):
+        flipped = reorient("cpu", self.body)
+        self.assertEqual([row["name"] for row in flipped["comparison"]], ["Core i5", "Ryzen 7"])
+        self.assertEqual(flipped["winner"], self.body["winner"])
+        self.assertEqual(flipped["reasoning"], self.body["reasoning"])
+        # the cached body is left alone
+        self.assertEqual(self.body["comparison"][0]["name"], "Ryzen 7")
+
+    def test_labelled_kinds_are_refused(self):
+        for kind in ("pc", "phone"):
+            with self.assertRaises(ValueError):
+                reorient(kind, {"comparison": []})
+
+
+@override_settings(CACHES=LOCMEM)
+class CompareKeyTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_cpu("Ryzen 7 5800X")
+        make_cpu("Core i5-12400")
+        brand = BrandsCoefficients.objects.create(name="Nothing", coefficient=1.0)
+        Phone.objects.create(name="Nothing Phone 2", brand=brand, image="phone.png")
+        Phone.objects.create(name="Phone 1", brand=brand, image="phone.png")
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_cpu_orders_share_a_key(self):
+        key1, flipped1, names1 = _prepare("cpu", (CPU,), ("ryzen  7 5800x",), ("Core%20i5-12400",), ())
+        key2, flipped2, names2 = _prepare("cpu", (CPU,), ("Core i5-12400",), ("Ryzen 7 5800X",), ())
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(flipped1, flipped2)
+        self.assertEqual(names1, [("Ryzen 7 5800X",), ("Core i5-12400",)])
+
+    def test_phone_orders_are_cached_apart(self):
+        key1, flipped1, _ = _prepare("phone", (Phone,), ("Nothing Phone 2",), ("Phone 1",), ())
+        key2, flipped2, _ = _prepare("phone", (Phone,), ("Phone 1",), ("Nothing Phone 2",), ())
+        self.assertNotEqual(key1, key2)
+        self.assertFalse(flipped1 or flipped2)
+
+    def test_unknown_name(self):
+        self.assertIsNone(_prepare("cpu", (CPU,), ("Ryzen 7 5800X",), ("Pentium 4",), ()))
+
+    def test_reversed_request_is_served_from_the_cache(self):
+        first = self.client.get("/core/compare_cpu/Ryzen 7 5800X/Core i5-12400").json()
+        with mock.patch("core.views.get_cpu_comparison_json") as compare_json:
+            second = self.client.get("/core/compare_cpu/core i5-12400/ryzen 7 5800x").json()
+        compare_json.assert_not_called()
+        self.assertEqual(second["comparison"], first["comparison"][::-1])
+        self.assertEqual(second["winner"], first["winner"])
+
+
+# =====Cache warmer=====
+class WarmCompareCacheTests(TransactionTestCase):
+    # the command warms pairs in worker threads, which need committed rows
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+        make_cpu("Ryzen 7", core_count=8)
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def warm(self, *args):
+        out = io.StringIO()
+        call_command("warm_compare_cache", *args, stdout=out)
+        return out.getvalue()
+
+    def cached(self, kind, models, side1, side2, extra=()):
+        return compare_cache.is_cached(kind, models, side1, side2, extra)
+
+    def test_given_pairs_resume(self):
+        out = self.warm("--pair", "cpu", "Ryzen 5", "Ryzen 9", "--pair", "cpu", "Ryzen 9", "Pentium 4")
+        self.assertIn("1 warmed, 0 already cached, 1 failed", out)
+        self.assertTrue(self.cached("cpu", (CPU,), ("Ryzen 9",), ("Ryzen 5",)))
+
+        out = self.warm("--pair", "cpu", "ryzen 9", "ryzen 5", "--pair", "cpu", "Ryzen 5", "Ryzen 7")
+        self.assertIn("1 warmed, 1 already cached, 0 failed, hit ratio 50%", out)
+
+    def test_most_requested_pairs(self):
+        for names, count in (([("Ryzen 5",), ("Ryzen 9",)], 3), ([("Ryzen 7",), ("Ryzen 9",)], 1)):
+            for _ in range(count):
+                compare_cache._record("cpu", names, False, ())
+        self.warm("--kinds", "cpu", "--top", "1")
+        self.assertTrue(self.cached("cpu", (CPU,), ("Ryzen 5",), ("Ryzen 9",)))
+        self.assertFalse(self.cached("cpu", (CPU,), ("Ryzen 7",), ("Ryzen 9",)))
+
+    @mock.patch("requests.Session.post")
+    def test_enrich_warms_the_llm_wording(self, post):
+        post.return_value = openrouter_response(PC_ANSWER)
+        self.warm("--pair", "pc", *SLOW_PC.values(), *FAST_PC.values(), "gaming", "--enrich")
+        self.assertTrue(self.cached("pc", jobs.PC_MODELS, tuple(SLOW_PC.values()), tuple(FAST_PC.values()),
+                                    ("gaming", True)))
+        self.assertEqual(post.call_count, 1)
+
+        # what the endpoint serves now costs no OpenRouter call
+        self.assertEqual(self.client.get(f"/core/{PC_URL}?enrich=1").json()["source"], "local+llm")
+        self.assertEqual(post.call_count, 1)
+
+    def test_bad_pairs(self):
+        with self.assertRaises(CommandError):
+            self.warm("--pair", "tablet", "A", "B")
+        with self.assertRaises(CommandError):
+            self.warm("--pair", "cpu", "Ryzen 5")
+
+
+# =====Rate limit=====
+@override_settings(OPENROUTER_RATE_LIMIT=10, OPENROUTER_RATE_BURST=2, OPENROUTER_RATE_MAX_WAIT=0.25)
+class RateLimitTests(SimpleTestCase):
+    """Runs the token bucket script against the configured Redis"""
+
+    def setUp(self):
+        _forget_local_state()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def debt_wait(self):
+        # a queued caller's slot is when the bucket's debt is paid back
+        tokens = float(get_redis_connection("default").hget(ratelimit.BUCKET_KEY, "tokens"))
+        return max(-tokens, 0) / settings.OPENROUTER_RATE_LIMIT
+
+    def test_burst_then_queue_then_refuse(self):
+        self.assertEqual(ratelimit._reserve(), 0)
+        self.assertEqual(ratelimit._reserve(), 0)
+        # empty bucket: each caller gets the next slot at 10/s
+        first = ratelimit._reserve()
+        self.assertAlmostEqual(first, self.debt_wait())
+        second = ratelimit._reserve()
+        self.assertAlmostEqual(second, self.debt_wait())
+        self.assertGreater(second, first)
+        with self.assertRaises(ratelimit.RateLimited) as raised:
+            ratelimit._reserve()
+        self.assertIsInstance(raised.exception, breaker.LLMUnavailable)
+
+        stats = ratelimit.stats()
+        self.assertEqual((stats["granted"], stats["queued"], stats["rejected"]), (4, 2, 1))
+
+    def test_drain_drops_the_burst(self):
+        ratelimit.drain()
+        wait = ratelimit._reserve()
+        self.assertGreater(wait, 0)
+        self.assertAlmostEqual(wait, self.debt_wait())
+
+    @override_settings(OPENROUTER_RATE_LIMIT=0)
+    def test_disabled(self):
+        self.assertEqual(ratelimit.acquire(), 0)
+        self.assertFalse(get_redis_connection("default").exists(ratelimit.BUCKET_KEY))
+
+
+# =====Hedging=====
+def model_of(data):
+    return json.loads(data)["model"]
+
+
+@override_settings(OPENROUTER_MODELS=["primary/model", "backup/model"], OPENROUTER_HEDGE_DEFAULT_DELAY=0.05,
+                   OPENROUTER_HEDGE_MIN_DELAY=0.01, OPENROUTER_RATE_LIMIT=0)
+class HedgingTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        hedging._delays.clear()
+        self.prompt = "Compare two things"
+
+    def tearDown(self):
+        _forget_local_state()
+        hedging._delays.clear()
+
+    def post_hedged(self):
+        return hedging.post_hedged(lambda model: ai.completion_payload(self.prompt, model), {},
+                                   lambda answer: ai.valid_completion(answer) is not None)
+
+    def wins(self):
+        return {entry["model"]: entry["wins"] for entry in hedging.stats()["models"]}
+
+    @mock.patch("requests.Session.post")
+    def test_slow_primary_is_hedged(self, post):
+        release = threading.Event()
+
+        def answer(url, headers, data, timeout):
+            if model_of(data) == "primary/model":
+                release.wait(5)
+                return openrouter_response({"from": "primary"})
+            return openrouter_response({"from": "backup"})
+        post.side_effect = answer
+
+        try:
+            response = self.post_hedged()
+        finally:
+            release.set()
+        self.assertEqual(json.loads(ai.valid_completion(response)), {"from": "backup"})
+        self.assertEqual(hedging.stats()["hedged"], 1)
+        self.assertEqual(self.wins(), {"primary/model": 0, "backup/model": 1})
+
+        # the loser is left to finish in its pool thread, then reports its latency
+        for _ in range(100):
+            if hedging.latencies("primary/model"):
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(hedging.latencies("primary/model")), 1)
+
+    @override_settings(OPENROUTER_HEDGE_DEFAULT_DELAY=30, OPENROUTER_HEDGE_MAX_DELAY=30)
+    @mock.patch("requests.Session.post")
+    def test_rejected_answer_moves_on(self, post):
+        post.side_effect = lambda url, headers, data, timeout: openrouter_response(
+            "not json" if model_of(data) == "primary/model" else {"from": "backup"})
+        response = self.post_hedged()
+        self.assertEqual(json.loads(ai.valid_completion(response)), {"from": "backup"})
+        self.assertEqual(post.call_count, 2)
+
+    @override_settings(OPENROUTER_MODELS=["primary/model"])
+    @mock.patch("requests.Session.post")
+    def test_single_model_is_not_hedged(self, post):
+        post.return_value = openrouter_response({"from": "primary"})
+        self.post_hedged()
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(hedging.stats()["hedged"], 0)
+
+    def test_async_loser_is_cancelled(self):
+        cancelled = []
+
+        async def answer(url, headers, content, timeout):
+            if model_of(content) == "primary/model":
+                try:
+                    await asyncio.sleep(60)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+            return httpx_answer({"from": "backup"})
+
+        async def hedged():
+            async with llm_client.async_client(shared=False):
+                return await hedging.apost_hedged(lambda model: ai.completion_payload(self.prompt, model), {},
+                                                  lambda answer: ai.valid_completion(answer) is not None)
+
+        with mock.patch("httpx.AsyncClient.post", new_callable=mock.AsyncMock, side_effect=answer):
+            response = async_to_sync(hedged)()
+        self.assertEqual(json.loads(ai.valid_completion(response)), {"from": "backup"})
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(self.wins(), {"primary/model": 0, "backup/model": 1})
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+    @override_settings(OPENROUTER_HEDGE_MIN_SAMPLES=5, OPENROUTER_HEDGE_PERCENTILE=50, OPENROUTER_HEDGE_MAX_DELAY=4)
+    def test_delay_follows_the_latencies(self):
+        self.assertEqual(hedging.hedge_delay("primary/model"), 0.05)
+        for seconds in (1, 1, 1, 2, 10):
+            hedging.record_latency("primary/model", seconds)
+        hedging._delays.clear()
+        self.assertEqual(hedging.hedge_delay("primary/model"), 1)
+
+        with override_settings(OPENROUTER_HEDGE_PERCENTILE=95):
+            hedging._delays.clear()
+            self.assertEqual(hedging.hedge_delay("primary/model"), 4)
+
+
+# =====Batched phone comparisons=====
+def phone_verdict(pair=None, winner="Phone1"):
+    verdict = {"comparison": [{"phone_name": "Phone1", "overall_score": 80}, {"phone_name": "Phone2", "overall_score": 70}],
+               "winner": winner, "reasoning": "Better cameras"}
+    return verdict if pair is None else {"pair": pair, **verdict}
+
+
+@override_settings(LLM_BATCH_SIZE=2, OPENROUTER_RATE_LIMIT=0)
+@mock.patch("requests.Session.post")
+class PhoneBatchTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        brand = BrandsCoefficients.objects.create(name="Nothing", coefficient=1.0)
+        for name, battery in (("Phone 1", 4500), ("Phone 2", 4700), ("Phone 3", 5000)):
+            Phone.objects.create(name=name, brand=brand, image="phone.png", ram_size=8, memory_size=256,
+                                 camera_mp="50MP + 50MP", battery=battery, year=2023)
+        self.pairs = [("Phone 1", "Phone 2"), ("Phone 1", "Phone 3"), ("Phone 2", "Phone 3")]
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def test_pairs_split_into_batches(self, post):
+        post.side_effect = [openrouter_response([phone_verdict(1), phone_verdict(2, winner="Phone2")]),
+                            openrouter_response([phone_verdict(1)])]
+        results = ai.get_phone_batch_comparison_json(self.pairs)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual([result["winner"] for result in results], ["Phone1", "Phone2", "Phone1"])
+
+        # every pair prompt is written once, with the phones listed once
+        prompt = json.loads(post.call_args_list[0].kwargs["data"])["messages"][0]["content"]
+        self.assertIn("1. P1 (Phone1) vs P2 (Phone2)", prompt)
+        self.assertIn("2. P1 (Phone1) vs P3 (Phone2)", prompt)
+        self.assertIn("\nP3: ", prompt)
+        self.assertNotIn("\nP4: ", prompt)
+
+        # each answer is cached as its own pair's completion
+        self.assertEqual(ai.get_phone_comparison_json("Phone 1", "Phone 3")["winner"], "Phone2")
+        self.assertEqual(post.call_count, 2)
+
+    def test_missing_entries_are_none(self, post):
+        post.return_value = openrouter_response([{"pair": 2, "winner": "Phone1"}, phone_verdict(1)])
+        results = ai.get_phone_batch_comparison_json(self.pairs[:2] + [("Phone 1", "Phone 9")])
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(results[0]["winner"], "Phone1")
+        self.assertIsNone(results[1])
+        self.assertIsNone(results[2])
+
+    @override_settings(LLM_BATCH_SIZE=4)
+    def test_shortlist_endpoint(self, post):
+        post.return_value = openrouter_response([phone_verdict(n) for n in (1, 2, 3)])
+        body = {"phones": ["Phone 1", "Phone 2", "Phone 3"]}
+        response = self.client.post("/core/compare_phone/batch", body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([(r["phone1"], r["phone2"]) for r in results], self.pairs)
+        self.assertEqual({r["status_code"] for r in results}, {200})
+        self.assertEqual(post.call_count, 1)
+
+        # all three are cached now
+        self.client.post("/core/compare_phone/batch", body, content_type="application/json")
+        self.assertEqual(post.call_count, 1)
+
+    def test_bad_pairs(self, post):
+        for body in ({}, {"pairs": [["Phone 1"]]}, {"pairs": [["Phone 1", "Phone 2"]] * 46}):
+            response = self.client.post("/core/compare_phone/batch", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        post.assert_not_called()
+
+
+# =====Admission control=====
+@override_settings(LLM_ADMISSION_PROCESS_LIMIT=1, LLM_ADMISSION_CLUSTER_LIMIT=1, LLM_ADMISSION_QUEUE_TIMEOUT=0.1,
+                   OPENROUTER_RATE_LIMIT=0)
+@mock.patch("requests.Session.post")
+class AdmissionTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def fill_cluster(self):
+        # another worker holds the only cluster slot
+        self.assertTrue(admission._take_lease("other-worker"))
+
+    def test_refused_call_degrades(self, post):
+        post.return_value = openrouter_response(PC_ANSWER)
+        self.fill_cluster()
+        data = self.client.get(f"/core/{PC_URL}?enrich=1").json()
+        self.assertTrue(data["degraded"])
+        post.assert_not_called()
+        self.assertEqual(admission.stats()["refused"]["cluster"], 1)
+
+        # the degraded result is not cached: once the slot is free the LLM is asked
+        admission._release_lease("other-worker")
+        self.assertEqual(self.client.get(f"/core/{PC_URL}?enrich=1").json()["source"], "local+llm")
+        self.assertEqual(post.call_count, 1)
+
+    @override_settings(LLM_ADMISSION_SHED=True)
+    def test_refused_call_is_shed(self, post):
+        self.fill_cluster()
+        response = self.client.get(f"/core/{PC_URL}?enrich=1")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], str(admission.RETRY_AFTER))
+        self.assertEqual(response.json()["retry_after"], admission.RETRY_AFTER)
+        post.assert_not_called()
+
+        # cheap endpoints never ask for a slot
+        response = self.client.get(f"/core/compare_pc/{'/'.join(SLOW_PC.values())}/{'/'.join(FAST_PC.values())}/gaming")
+        self.assertEqual(response.status_code, 200)
+
+    def test_process_limit(self, post):
+        slot = admission.acquire()
+        try:
+            with self.assertRaises(admission.Overloaded):
+                admission.acquire()
+            # a hedge does not wait for a slot, and is not held against the request
+            with self.assertRaises(admission.Overloaded):
+                admission.acquire(hedge=True)
+        finally:
+            admission.release(slot)
+        admission.release(admission.acquire())
+        refused = admission.stats()["refused"]
+        self.assertEqual((refused["process"], refused["hedge"]), (1, 1))
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+    @override_settings(LLM_ADMISSION_QUEUE=0)
+    def test_full_queue_refuses_at_once(self, post):
+        with self.assertRaises(admission.Overloaded):
+            admission.acquire()
+        self.assertEqual(admission.stats()["refused"]["queue"], 1)
+
+
+# =====Request deadline=====
+@override_settings(REQUEST_DEADLINE=25, REQUEST_DEADLINE_MAX=60, REQUEST_DEADLINE_RESERVE=0.5, OPENROUTER_RATE_LIMIT=0)
+class DeadlineTests(TestCase):
+    def setUp(self):
+        _forget_local_state()
+        make_pc_parts()
+
+    def tearDown(self):
+        _forget_local_state()
+
+    def budget(self, header=None):
+        headers = {} if header is None else {"headers": {deadlines.HEADER: header}}
+        return deadlines.request_budget(RequestFactory().get("/", **headers))
+
+    def test_request_budget(self):
+        floor = 0.5 + deadlines.MIN_QUERY_BUDGET
+        self.assertEqual(self.budget(), 25)
+        self.assertEqual(self.budget("10"), 10)
+        self.assertEqual(self.budget("600"), 60)
+        for header in ("0", "-3", "0.2"):
+            self.assertEqual(self.budget(header), floor)
+        for header in ("nan", "inf", "-inf", "soon"):
+            self.assertEqual(self.budget(header), 25)
+
+    @mock.patch("requests.Session.post")
+    def test_tiny_budget_degrades_instead_of_timing_out(self, post):
+        response = self.client.get(f"/core/{PC_URL}?enrich=1", headers={deadlines.HEADER: "0"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["degraded"])
+        post.assert_not_called()
+
+    def test_spent_deadline_is_a_504(self):
+        with mock.patch("core.deadlines.remaining", return_value=0.0):
+            response = self.client.get("/core/cpu/")
+        self.assertEqual(response.status_code, 504)
+        # outside a request there is no deadline
+        self.assertIsNone(deadlines.remaining())
+        self.assertEqual(CPU.objects.count(), 2)
@@ -4,18 +4,51 @@ from . import views
 urlpatterns = [
     path("phone/", views.PhoneListCreateAPIView.as_view(), name="phone-list-create"),
     path("phone/<int:pk>", views.PhoneDetailAPIView.as_view(), name="phone-detail"),
+    path("phone/scores", views.PhoneScoresAPIView.as_view(), name="phone-scores"),
+    path("phone/top", views.PhoneTopAPIView.as_view(), name="phone-top"),
+    path("phone/<int:pk>/similar", views.PhoneSimilarAPIView.as_view(), name="phone-similar"),
+    path("phone/export", views.PhoneExportAPIView.as_view(), name="phone-export"),
+    path("compare_phone/batch", views.PhoneBatchCompareAPIView.as_view(), name="phone-compare-batch"),
     path("compare_phone/<str:phone1>/<str:phone2>", views.PhoneCompareAPIView.as_view(), name="phone-compare-list-create"),
+    path("async/compare_phone/<str:phone1>/<str:phone2>", views.PhoneCompareAsyncView.as_view(), name="phone-compare-async"),
+    path("stream/compare_phone/<str:phone1>/<str:phone2>", views.PhoneCompareStreamView.as_view(), name="phone-compare-stream"),
     path("cpu/", views.CPUListCreateAPIView.as_view(), name="cpu-list-create"),
     path("cpu/<int:pk>", views.CPUDetailAPIView.as_view(), name="cpu-detail"),
+    path("cpu/scores", views.CPUScoresAPIView.as_view(), name="cpu-scores"),
+    path("cpu/top", views.CPUTopAPIView.as_view(), name="cpu-top"),
+    path("cpu/matrix", views.CPUMatrixAPIView.as_view(), name="cpu-matrix"),
+    path("cpu/export", views.CPUExportAPIView.as_view(), name="cpu-export"),
+    path("cpu/<int:pk>/similar", views.CPUSimilarAPIView.as_view(), name="cpu-similar"),
     path("compare_cpu/<str:cpu1>/<str:cpu2>", views.CPUCompareAPIView.as_view(), name="cpu-compare-list-create"),
+    path("compare_cpu/", views.CPUMultiCompareAPIView.as_view(), name="cpu-multi-compare"),
     path("gpu/", views.GPUListCreateAPIView.as_view(), name="gpu-list-create"),
     path("gpu/<int:pk>", views.GPUDetailAPIView.as_view(), name="gpu-detail"),
+    path("gpu/scores", views.GPUScoresAPIView.as_view(), name="gpu-scores"),
+    path("gpu/top", views.GPUTopAPIView.as_view(), name="gpu-top"),
+    path("gpu/matrix", views.GPUMatrixAPIView.as_view(), name="gpu-matrix"),
+    path("gpu/export", views.GPUExportAPIView.as_view(), name="gpu-export"),
+    path("gpu/<int:pk>/similar", views.GPUSimilarAPIView.as_view(), name="gpu-similar"),
     path("compare_gpu/<str:gpu1>/<str:gpu2>", views.GPUCompareAPIView.as_view(), name="gpu-compare-list-create"),
+    path("compare_gpu/", views.GPUMultiCompareAPIView.as_view(), name="gpu-multi-compare"),
     path("ram/", views.RAMListCreateAPIView.as_view(), name="ram-list-create"),
     path("ram/<int:pk>", views.RAMDetailAPIView.as_view(), name="ram-detail"),
+    path("ram/scores", views.RAMScoresAPIView.as_view(), name="ram-scores"),
+    path("ram/top", views.RAMTopAPIView.as_view(), name="ram-top"),
+    path("ram/matrix", views.RAMMatrixAPIView.as_view(), name="ram-matrix"),
+    path("ram/export", views.RAMExportAPIView.as_view(), name="ram-export"),
+    path("ram/<int:pk>/similar", views.RAMSimilarAPIView.as_view(), name="ram-similar"),
     path("compare_ram/<str:ram1>/<str:ram2>", views.RAMCompareAPIView.as_view(), name="ram-compare-list-create"),
+    path("compare_ram/", views.RAMMultiCompareAPIView.as_view(), name="ram-multi-compare"),
     path("needs/", views.NeedsListCreateAPIView.as_view(), name="needs-list-create"),
     path("needs/<int:pk>", views.NeedsDetailAPIView.as_view(), name="needs-detail"),
     path("compare_pc/<str:cpu1>/<str:gpu1>/<str:ram1>/<str:cpu2>/<str:gpu2>/<str:ram2>/<str:need>",
          views.NeedsCompareAPIView.as_view(), name="needs-compare"),
+    path("async/compare_pc/<str:cpu1>/<str:gpu1>/<str:ram1>/<str:cpu2>/<str:gpu2>/<str:ram2>/<str:need>",
+         views.NeedsCompareAsyncView.as_view(), name="needs-compare-async"),
+    path("stream/compare_pc/<str:cpu1>/<str:gpu1>/<str:ram1>/<str:cpu2>/<str:gpu2>/<str:ram2>/<str:need>",
+         views.NeedsCompareStreamView.as_view(), name="needs-compare-stream"),
+    path("recommend_pc", views.RecommendPCAPIView.as_view(), name="recommend-pc"),
+    path("llm/status", views.LLMStatusAPIView.as_view(), name="llm-status"),
+    path("jobs/<str:job_id>", views.JobAPIView.as_view(), name="job-detail"),
+    path("jobs/<str:job_id>/events", views.JobEventsView.as_view(), name="job-events"),
 ]
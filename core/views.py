@@ -1,24 +1,222 @@
+import numpy as np
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.views import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
-from .compare import *
-from .ai import get_pc_comparison_json, get_phone_comparison_json
+from .compare import (MAX_COMPARE, SCORING, catalog_subset, get_cpu_comparison_json, get_cpu_multi_comparison_json,
+                      get_gpu_comparison_json, get_gpu_multi_comparison_json, get_phone_score_json,
+                      get_ram_comparison_json, get_ram_multi_comparison_json)
+from .ai import aget_pc_comparison_json, aget_phone_comparison_json, pc_prompt, phone_prompt
+from .builds import COMPONENTS, MAX_BUILDS, enrich_with_llm, get_pc_score_json, recommend_builds
+from . import admission, breaker, hedging, llm_client, ratelimit
+from .compare_cache import acompare, canonical_name, compare_pair
+from .ordering import ScoreOrderingFilter
+from .jobs import (FINISHED, MAX_BATCH_PAIRS, PC_MODELS, aget_job, compare_pc, compare_phone, compare_phones, enqueue,
+                   get_job, llm_failed, pc_components, pc_side)
 from .models import *
 from .serializers import CPUSerializer, GPUSerializer, RAMSerializer, NeedsSerializer, PhoneSerializer
+import asyncio
+import functools
+import time
 import urllib.parse
 from .pagination import *
+from .ranking import MAX_K, range_filters, top_k
+from .similar import features_for, similar
+from .streams import (apc_compare_sse, aphone_compare_sse, export_chunks, export_csv, export_ndjson, matrix_float32,
+                      matrix_ndjson, pc_compare_sse, phone_compare_sse, sse)
 from rest_framework import filters
 
+
+def _parse_ids(value):
+    """Comma separated ids from a query param, or None when it is absent"""
+    if not value:
+        return None
+    try:
+        return [int(i) for i in value.split(",") if i]
+    except ValueError:
+        raise ValueError("ids must be a comma separated list of integers")
+
+
+def _accepted(request, job):
+    """202 pointing at the poll and SSE endpoints of a queued job"""
+    poll = request.build_absolute_uri(f"/core/jobs/{job['id']}")
+    return Response({
+        "job_id": job["id"],
+        "status": job["status"],
+        "poll": poll,
+        "events": f"{poll}/events",
+    }, status=202, headers={"Location": poll})
+
+
+def _event_stream(events):
+    """A text/event-stream response. WSGI servers only stream a sync
+    iterator (an async one is collected first) and ASGI servers only an async
+    one, so the views pass the generator that fits _asgi(request)."""
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _asgi(request) -> bool:
+    """Served by an ASGI server, whose event loop outlives the request"""
+    return isinstance(request, ASGIRequest)
+
+
+def _llm_client_scope(view):
+    """Async view method whose OpenRouter calls use a client that does not
+    outlive its event loop (llm_client.async_client)"""
+    @functools.wraps(view)
+    async def wrapper(self, request, *args, **kwargs):
+        async with llm_client.async_client(shared=_asgi(request)):
+            return await view(self, request, *args, **kwargs)
+    return wrapper
+
+
+class ComponentScoresAPIView(APIView):
+    """performance_index for many components at once (?ids=1,2,3 or the whole table)"""
+    model = None
+
+    def get(self, request):
+        try:
+            ids = _parse_ids(request.query_params.get("ids"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        pks, scores = catalog_subset(self.model, ids)
+        return Response({
+            "ids": pks.tolist(),
+            "performance_index": np.round(scores, 2).tolist(),
+        })
+
+
+class ComponentMatrixAPIView(APIView):
+    """All-pairs performance_index differences, streamed.
+
+    ?ids=1,2,3 (default: the whole table, up to MAX_MATRIX rows) and
+    ?output=ndjson (default) or float32; see core/streams.py for both layouts.
+    """
+    model = None
+    MAX_MATRIX = 5000
+
+    def get(self, request):
+        try:
+            ids = _parse_ids(request.query_params.get("ids"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        pks, scores = catalog_subset(self.model, ids)
+        if len(pks) > self.MAX_MATRIX:
+            return Response({"error": f"At most {self.MAX_MATRIX} components per matrix, pass ids"}, status=400)
+
+        if request.query_params.get("output") == "float32":
+            return StreamingHttpResponse(matrix_float32(pks, scores), content_type="application/octet-stream")
+        return StreamingHttpResponse(matrix_ndjson(pks, scores), content_type="application/x-ndjson")
+
+
+class ExportAPIView(APIView):
+    """The whole table as a streamed ?output=ndjson (default) or csv download"""
+    model = None
+    columns = None
+
+    def get_columns(self):
+        return self.columns or [f.attname for f in self.model._meta.concrete_fields]
+
+    def get(self, request):
+        columns = self.get_columns()
+        chunks = export_chunks(self.model.objects.all(), columns)
+        name = self.model._meta.model_name
+        if request.query_params.get("output") == "csv":
+            response = StreamingHttpResponse(export_csv(chunks, columns), content_type="text/csv")
+            response["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        else:
+            response = StreamingHttpResponse(export_ndjson(chunks), content_type="application/x-ndjson")
+            response["Content-Disposition"] = f'attachment; filename="{name}.ndjson"'
+        return response
+
+
+class ComponentTopAPIView(APIView):
+    """The k best components by performance_index (?k=20&min_<field>=..&max_<field>=..)"""
+    model = None
+    serializer_class = None
+
+    def get(self, request):
+        try:
+            k = min(max(int(request.query_params.get("k", 10)), 1), MAX_K)
+            ranges = range_filters(SCORING[self.model][0], request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        pks, scores = top_k(self.model, k, ranges)
+        objs = self.model.objects.in_bulk(pks.tolist())
+        results = []
+        for pk, value in zip(pks.tolist(), scores.tolist()):
+            if pk not in objs:
+                continue
+            item = self.serializer_class(objs[pk]).data
+            item["performance_index"] = round(value, 2)
+            results.append(item)
+        return Response({"count": len(results), "results": results})
+
+
+class SimilarAPIView(APIView):
+    """The k nearest neighbours of a component in normalized spec space
+    (?k=10&min_<field>=..&max_<field>=..)"""
+    model = None
+    serializer_class = None
+
+    def get(self, request, pk):
+        try:
+            k = min(max(int(request.query_params.get("k", 10)), 1), MAX_K)
+            ranges = range_filters(features_for(self.model), request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        found = similar(self.model, pk, k, ranges)
+        if found is None:
+            return Response({"error": "Not found"}, status=404)
+
+        pks, distances = found
+        objs = self.model.objects.in_bulk(pks.tolist() + [pk])
+        results = []
+        for other, distance in zip(pks.tolist(), distances.tolist()):
+            if other in objs:
+                results.append({"id": other, **self.serializer_class(objs[other]).data, "distance": round(distance, 2)})
+        return Response({
+            "component": {"id": pk, **self.serializer_class(objs[pk]).data},
+            "results": results,
+        })
+
+
+class MultiCompareAPIView(APIView):
+    """Rank up to MAX_COMPARE components: POST {"names": [...]}"""
+    compare = None
+
+    def post(self, request):
+        names = request.data.get("names") if isinstance(request.data, dict) else None
+        if (not isinstance(names, list) or not all(isinstance(n, str) for n in names)
+                or not 2 <= len(names) <= MAX_COMPARE):
+            return Response({"error": f"names must be a list of 2 to {MAX_COMPARE} strings"}, status=400)
+
+        data, missing = type(self).compare(names)
+        if data is None:
+            return Response({"error": "Components not found", "missing": missing}, status=404)
+        return Response(data)
+
+
 class CPUListCreateAPIView(generics.ListCreateAPIView):
     queryset = CPU.objects.order_by('pk')
     serializer_class = CPUSerializer
 
     pagination_class = CPUPagination
 
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (filters.SearchFilter, ScoreOrderingFilter)
     search_fields = ('name',)
+    ordering_fields = ('performance_index',)
 
     @method_decorator(cache_page(15,key_prefix='cpu-list-create-api-view'))
     def list(self, request, *args, **kwargs):
@@ -30,13 +228,35 @@ class CPUDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class CPUCompareAPIView(APIView):
-
-    @method_decorator(cache_page(15,key_prefix='cpu-compare-api-view'))
     def get(self, request, cpu1, cpu2):
-        data = get_cpu_comparison_json(cpu1, cpu2)
-        if data is None:
-            return Response({"error": "Failed to compare processors"}, status=400)
-        return Response(data)
+        status, data = compare_pair("cpu", CPU, cpu1, cpu2, get_cpu_comparison_json, "Failed to compare processors")
+        return Response(data, status=status)
+
+
+class CPUMultiCompareAPIView(MultiCompareAPIView):
+    compare = staticmethod(get_cpu_multi_comparison_json)
+
+
+class CPUScoresAPIView(ComponentScoresAPIView):
+    model = CPU
+
+
+class CPUMatrixAPIView(ComponentMatrixAPIView):
+    model = CPU
+
+
+class CPUExportAPIView(ExportAPIView):
+    model = CPU
+
+
+class CPUTopAPIView(ComponentTopAPIView):
+    model = CPU
+    serializer_class = CPUSerializer
+
+
+class CPUSimilarAPIView(SimilarAPIView):
+    model = CPU
+    serializer_class = CPUSerializer
 
 
 class GPUListCreateAPIView(generics.ListCreateAPIView):
@@ -45,8 +265,9 @@ class GPUListCreateAPIView(generics.ListCreateAPIView):
 
     pagination_class = GPUPagination
 
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (filters.SearchFilter, ScoreOrderingFilter)
     search_fields = ('name',)
+    ordering_fields = ('performance_index',)
 
     @method_decorator(cache_page(15,key_prefix='gpu-list-create-api-view'))
     def list(self, request, *args, **kwargs):
@@ -59,13 +280,35 @@ class GPUDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class GPUCompareAPIView(APIView):
-
-    @method_decorator(cache_page(15,key_prefix='gpu-compare-api-view'))
     def get(self, request, gpu1, gpu2):
-        data = get_gpu_comparison_json(gpu1, gpu2)
-        if data is None:
-            return Response({"error": "Failed to compare video cards"}, status=400)
-        return Response(data)
+        status, data = compare_pair("gpu", GPU, gpu1, gpu2, get_gpu_comparison_json, "Failed to compare video cards")
+        return Response(data, status=status)
+
+
+class GPUMultiCompareAPIView(MultiCompareAPIView):
+    compare = staticmethod(get_gpu_multi_comparison_json)
+
+
+class GPUScoresAPIView(ComponentScoresAPIView):
+    model = GPU
+
+
+class GPUMatrixAPIView(ComponentMatrixAPIView):
+    model = GPU
+
+
+class GPUExportAPIView(ExportAPIView):
+    model = GPU
+
+
+class GPUTopAPIView(ComponentTopAPIView):
+    model = GPU
+    serializer_class = GPUSerializer
+
+
+class GPUSimilarAPIView(SimilarAPIView):
+    model = GPU
+    serializer_class = GPUSerializer
 
 
 class RAMListCreateAPIView(generics.ListCreateAPIView):
@@ -74,8 +317,9 @@ class RAMListCreateAPIView(generics.ListCreateAPIView):
 
     pagination_class = RAMPagination
 
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (filters.SearchFilter, ScoreOrderingFilter)
     search_fields = ('name',)
+    ordering_fields = ('performance_index',)
 
     @method_decorator(cache_page(15,key_prefix='ram-list-create-api-view'))
     def list(self, request, *args, **kwargs):
@@ -88,12 +332,35 @@ class RAMDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class RAMCompareAPIView(APIView):
-    @method_decorator(cache_page(15,key_prefix='ram-compare-api-view'))
     def get(self, request, ram1, ram2):
-        data = get_ram_comparison_json(ram1, ram2)
-        if data is None:
-            return Response({"error": "Failed to compare RAMs"}, status=400)
-        return Response(data)
+        status, data = compare_pair("ram", RAM, ram1, ram2, get_ram_comparison_json, "Failed to compare RAMs")
+        return Response(data, status=status)
+
+
+class RAMMultiCompareAPIView(MultiCompareAPIView):
+    compare = staticmethod(get_ram_multi_comparison_json)
+
+
+class RAMScoresAPIView(ComponentScoresAPIView):
+    model = RAM
+
+
+class RAMMatrixAPIView(ComponentMatrixAPIView):
+    model = RAM
+
+
+class RAMExportAPIView(ExportAPIView):
+    model = RAM
+
+
+class RAMTopAPIView(ComponentTopAPIView):
+    model = RAM
+    serializer_class = RAMSerializer
+
+
+class RAMSimilarAPIView(SimilarAPIView):
+    model = RAM
+    serializer_class = RAMSerializer
 
 
 class NeedsListCreateAPIView(generics.ListCreateAPIView):
@@ -116,8 +383,6 @@ class NeedsDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class NeedsCompareAPIView(APIView):
-
-    @method_decorator(cache_page(2*60,key_prefix='needs-compare-api-view'))
     def get(self, request, cpu1, gpu1, ram1, cpu2, gpu2, ram2, need):
         cpu1 = urllib.parse.unquote(cpu1)
         gpu1 = urllib.parse.unquote(gpu1)
@@ -140,10 +405,100 @@ class NeedsCompareAPIView(APIView):
             'ram_name': ram2
         }
 
-        data = get_pc_comparison_json(pc1_components, pc2_components, need)
-        if data is None:
-            return Response({"error": "Failed to compare PC configurations"}, status=400)
-        return Response(data)
+        enrich = request.query_params.get("enrich", "").lower() in ("1", "true", "yes")
+        if request.query_params.get("mode") == "async":
+            # the local scores are immediate, a job is only worth it for the LLM wording
+            return _accepted(request, enqueue("compare_pc", pc1_components=pc1_components,
+                                              pc2_components=pc2_components, need=need, enrich=True))
+
+        status, data = compare_pc(pc1_components, pc2_components, need, enrich)
+        return Response(data, status=status)
+
+
+class NeedsCompareAsyncView(View):
+    """NeedsCompareAPIView for ASGI: the OpenRouter round trip does not hold a worker thread"""
+
+    @_llm_client_scope
+    async def get(self, request, cpu1, gpu1, ram1, cpu2, gpu2, ram2, need):
+        pc1_components = {
+            'cpu_name': urllib.parse.unquote(cpu1),
+            'gpu_name': urllib.parse.unquote(gpu1),
+            'ram_name': urllib.parse.unquote(ram1)
+        }
+        pc2_components = {
+            'cpu_name': urllib.parse.unquote(cpu2),
+            'gpu_name': urllib.parse.unquote(gpu2),
+            'ram_name': urllib.parse.unquote(ram2)
+        }
+        need = urllib.parse.unquote(need)
+        enrich = request.GET.get("enrich", "").lower() in ("1", "true", "yes")
+
+        async def compute(side1, side2):
+            pc1, pc2 = pc_components(side1), pc_components(side2)
+            data = await sync_to_async(get_pc_score_json)(pc1, pc2, need)
+            if data is None:
+                return 400, {"error": "Failed to compare PC configurations"}
+            if enrich:
+                llm = await aget_pc_comparison_json(pc1, pc2, need)
+                if llm is None:
+                    data["degraded"] = True
+                data = enrich_with_llm(data, llm)
+            return 200, data
+
+        status, data = await acompare("pc", PC_MODELS, pc_side(pc1_components), pc_side(pc2_components), compute,
+                                      extra=(canonical_name(need), enrich))
+        return JsonResponse(data, status=status)
+
+
+class NeedsCompareStreamView(View):
+    """compare_pc over Server-Sent Events: `local` with the local scores right
+    away, then the LLM's comparison[] entries, winner and reasoning (as they
+    stream in under ASGI, all at once under WSGI), and `done` with the
+    enriched result"""
+
+    def get(self, request, cpu1, gpu1, ram1, cpu2, gpu2, ram2, need):
+        pc1_components = {
+            'cpu_name': urllib.parse.unquote(cpu1),
+            'gpu_name': urllib.parse.unquote(gpu1),
+            'ram_name': urllib.parse.unquote(ram1)
+        }
+        pc2_components = {
+            'cpu_name': urllib.parse.unquote(cpu2),
+            'gpu_name': urllib.parse.unquote(gpu2),
+            'ram_name': urllib.parse.unquote(ram2)
+        }
+        need = urllib.parse.unquote(need)
+
+        local = get_pc_score_json(pc1_components, pc2_components, need)
+        if local is None:
+            return JsonResponse({"error": "Failed to compare PC configurations"}, status=400)
+        prompt = pc_prompt(pc1_components, pc2_components, need)
+        return _event_stream((apc_compare_sse if _asgi(request) else pc_compare_sse)(local, prompt))
+
+
+class RecommendPCAPIView(APIView):
+    """Best CPU+GPU+RAM builds for a need.
+
+    ?need=gaming&limit=10&max_tdp=125, plus per-axis range filters such as
+    cpu_min_core_count=8, gpu_min_vram_gb=12 or ram_min_size_gb=32.
+    """
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            limit = min(max(int(params.get("limit", 10)), 1), MAX_BUILDS)
+            ranges = {}
+            for key, model, _ in COMPONENTS:
+                prefix = f"{key}_"
+                axis_params = {k[len(prefix):]: v for k, v in params.items() if k.startswith(prefix)}
+                if key == "cpu" and "max_tdp" in params:
+                    axis_params.setdefault("max_tdp_watts", params["max_tdp"])
+                ranges[key] = range_filters(SCORING[model][0], axis_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        need, builds = recommend_builds(params.get("need"), limit, ranges)
+        return Response({"need": need, "count": len(builds), "results": builds})
 
 
 class PhoneListCreateAPIView(generics.ListCreateAPIView):
@@ -165,21 +520,175 @@ class PhoneDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PhoneSerializer
 
 
+class PhoneExportAPIView(ExportAPIView):
+    model = Phone
+    columns = ['id', 'name', 'brand__name', 'brand__coefficient', 'image', 'ram_size', 'memory_size', 'processor',
+               'os_type', 'graphic_processor', 'camera_mp', 'camera_main_mp', 'camera_count', 'screen_type',
+               'battery', 'year', 'performance_index']
+
+
+class PhoneScoresAPIView(ComponentScoresAPIView):
+    model = Phone
+
+
+class PhoneTopAPIView(ComponentTopAPIView):
+    model = Phone
+    serializer_class = PhoneSerializer
+
+
+class PhoneSimilarAPIView(SimilarAPIView):
+    model = Phone
+    serializer_class = PhoneSerializer
+
+
 class PhoneCompareAPIView(APIView):
+    def get(self, request, phone1, phone2):
+        phone1 = urllib.parse.unquote(phone1)
+        phone2 = urllib.parse.unquote(phone2)
+
+        enrich = request.query_params.get("enrich", "").lower() in ("1", "true", "yes")
+        if request.query_params.get("mode") == "async":
+            # the local scores are immediate, a job is only worth it for the LLM wording
+            return _accepted(request, enqueue("compare_phone", phone1=phone1, phone2=phone2, enrich=True))
+
+        status, data = compare_phone(phone1, phone2, enrich)
+        return Response(data, status=status)
+
+
+class PhoneBatchCompareAPIView(APIView):
+    """compare_phone for many pairs at once: POST {"pairs": [[name1, name2], ...]}
+    or {"phones": [...]} for every pair of a shortlist. With "enrich" (the
+    default) the LLM wording of the uncached pairs is asked for in batched
+    prompts of LLM_BATCH_SIZE pairs instead of one call per pair"""
+
+    def post(self, request):
+        body = request.data if isinstance(request.data, dict) else {}
+        pairs = body.get("pairs")
+        if pairs is None and isinstance(body.get("phones"), list):
+            phones = list(dict.fromkeys(body["phones"]))
+            pairs = [[a, b] for i, a in enumerate(phones) for b in phones[i + 1:]]
+        if (not isinstance(pairs, list) or not 1 <= len(pairs) <= MAX_BATCH_PAIRS
+                or not all(isinstance(pair, list) and len(pair) == 2 and all(isinstance(n, str) for n in pair)
+                           for pair in pairs)):
+            return Response({"error": f"pairs must be a list of 1 to {MAX_BATCH_PAIRS} [name1, name2] pairs "
+                                      f"(or phones a shortlist with that many pairs)"}, status=400)
+
+        enrich = body.get("enrich", True) not in (False, 0, "0", "false", "no")
+        results = compare_phones([tuple(pair) for pair in pairs], enrich)
+        return Response({"results": [{"phone1": phone1, "phone2": phone2, "status_code": status, "result": data}
+                                     for (phone1, phone2), (status, data) in zip(pairs, results)]})
+
+
+class PhoneCompareAsyncView(View):
+    """PhoneCompareAPIView for ASGI: the OpenRouter round trip does not hold a worker thread"""
+
+    @_llm_client_scope
+    async def get(self, request, phone1, phone2):
+        enrich = request.GET.get("enrich", "").lower() in ("1", "true", "yes")
+
+        async def compute(side1, side2):
+            data = await sync_to_async(get_phone_score_json)(side1[0], side2[0])
+            if data is None:
+                return 400, {"error": "Failed to compare phones. Phone not found or database error."}
+            if enrich:
+                llm = await aget_phone_comparison_json(side1[0], side2[0])
+                if llm_failed(llm):
+                    data["degraded"] = True
+                    llm = None
+                data = enrich_with_llm(data, llm, "phone_name")
+            return 200, data
+
+        status, data = await acompare("phone", (Phone,), (urllib.parse.unquote(phone1),),
+                                      (urllib.parse.unquote(phone2),), compute, extra=(enrich,))
+        return JsonResponse(data, status=status)
+
+
+class LLMStatusAPIView(APIView):
+    """OpenRouter circuit breaker state, rate limiter queue depth and waits,
+    per model latencies and hedge delays, and admission control counts"""
+
+    def get(self, request):
+        return Response({"breaker": breaker.state(), "rate_limiter": ratelimit.stats(), "hedging": hedging.stats(),
+                         "admission": admission.stats()})
+
+
+class JobAPIView(APIView):
+    """Status of a ?mode=async comparison; once finished it carries the
+    status_code and result the synchronous endpoint would have returned"""
+
+    def get(self, request, job_id):
+        job = get_job(job_id)
+        if job is None:
+            return Response({"error": "Job not found or expired"}, status=404)
+        return Response(job)
+
+
+class JobEventsView(View):
+    """Server-Sent Events for a job: a `status` event on every change and a
+    final `result` event with the finished job. Under WSGI the stream holds
+    a worker thread while it polls (see _event_stream)."""
+
+    POLL_INTERVAL = 0.5  # seconds
+    KEEPALIVE = 15  # seconds between comment lines that keep proxies from closing the stream
+
+    def get(self, request, job_id):
+        if get_job(job_id) is None:
+            return JsonResponse({"error": "Job not found or expired"}, status=404)
+        return _event_stream(self.aevents(job_id) if _asgi(request) else self.events(job_id))
+
+    def frame(self, job_id, job, state: dict):
+        """(message or None, finished) for the job as polled just now; state
+        keeps the last status sent and when anything was sent last"""
+        if job is None:
+            return sse("error", {"error": "Job not found or expired"}), True
+        if job["status"] in FINISHED:
+            return sse("result", job), True
+        now = time.monotonic()
+        if job["status"] != state.get("status"):
+            state.update(status=job["status"], sent=now)
+            return sse("status", {"id": job_id, "status": job["status"]}), False
+        if now - state["sent"] >= self.KEEPALIVE:
+            state["sent"] = now
+            return ": keepalive\n\n", False
+        return None, False
+
+    def events(self, job_id):
+        deadline = time.monotonic() + settings.JOB_EVENTS_TIMEOUT
+        state = {}
+        while time.monotonic() < deadline:
+            message, finished = self.frame(job_id, get_job(job_id), state)
+            if message is not None:
+                yield message
+            if finished:
+                return
+            time.sleep(self.POLL_INTERVAL)
+        yield sse("timeout", {"id": job_id, "status": state.get("status")})
+
+    async def aevents(self, job_id):
+        deadline = time.monotonic() + settings.JOB_EVENTS_TIMEOUT
+        state = {}
+        while time.monotonic() < deadline:
+            message, finished = self.frame(job_id, await aget_job(job_id), state)
+            if message is not None:
+                yield message
+            if finished:
+                return
+            await asyncio.sleep(self.POLL_INTERVAL)
+        yield sse("timeout", {"id": job_id, "status": state.get("status")})
+
+
+class PhoneCompareStreamView(View):
+    """compare_phone over Server-Sent Events: `local` with the local scores
+    right away, then the LLM's comparison[] entries, winner and reasoning (as
+    they stream in under ASGI, all at once under WSGI), and `done` with the
+    enriched result"""
 
-    @method_decorator(cache_page(15,key_prefix='phone-compare-api-view'))
     def get(self, request, phone1, phone2):
         phone1 = urllib.parse.unquote(phone1)
         phone2 = urllib.parse.unquote(phone2)
-        data = get_phone_comparison_json(phone1, phone2)
-        if data is None:
-            return Response({"error": "Failed to compare phones. Phone not found or database error."}, status=400)
-        if isinstance(data, dict) and data.get("error") and data.get("api_error"):
-            # API error (rate limit, etc.)
-            status_code = data.get("status_code", 429)
-            return Response({
-                "error": data.get("message", "API error occurred"),
-                "details": data.get("details", ""),
-                "error_code": data.get("error_code")
-            }, status=status_code)
-        return Response(data)
\ No newline at end of file
+
+        local = get_phone_score_json(phone1, phone2)
+        if local is None:
+            return JsonResponse({"error": "Failed to compare phones. Phone not found or database error."}, status=400)
+        prompt = phone_prompt(phone1, phone2)
+        return _event_stream((aphone_compare_sse if _asgi(request) else phone_compare_sse)(local, prompt))
@@ -28,6 +28,10 @@ else:
 echo "Populating database with sample data..."
 python populate_data.py
 
+# Пересчитываем сохраненные индексы производительности
+echo "Recomputing performance indexes..."
+python manage.py recompute_performance_index
+
 # Собираем статические файлы
 echo "Collecting static files..."
 python manage.py collectstatic --noinput